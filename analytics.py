@@ -0,0 +1,172 @@
+"""
+Columnar chain analytics.
+
+load_columns() turns the fixed 144-byte block headers into NumPy arrays, one per field, without building a
+Python object per block: the block offsets come from the digest cache, and each field is gathered from the
+memory-mapped segment files with one vectorized indexing operation per chunk of blocks. The reports below
+work on those arrays:
+    - state_distribution: current state of the items of every case
+    - checkout_frequency: how often each item has been checked out
+    - dwell_times: how long items stayed in each state before their next action
+NumPy is optional for the rest of bchoc; it is only needed here (pip install numpy).
+"""
+import mmap
+from blockchain import Blockchain, State
+
+try:
+    import numpy as np
+except ImportError:  # analytics are unavailable, everything else works without numpy
+    np = None
+
+# Header fields gathered by load_columns: name -> (byte offset in the header, numpy type).
+# Multi-byte numbers are native byte order, like the struct format the chain is written with.
+HEADER_COLUMNS = (
+    ('timestamp', 32, '=f8'),
+    ('case_id', 40, 'S16'),  # the UUID only uses the first 16 of the 32 bytes
+    ('item_id', 72, '=u4'),
+    ('state', 104, 'S12'),
+    ('data_length', 140, '=u4'),
+)
+STATE_ORDER = tuple(state.value for state in State)  # state code -> name, for the codes in Columns.state
+UNKNOWN_STATE = 255
+CHUNK_BLOCKS = 1 << 16  # blocks gathered per vectorized step, bounds the temporary index arrays
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("chain analytics need numpy, install it with: pip install numpy")
+
+
+class Columns:
+    """
+    The chain as parallel arrays, one entry per block in chain order:
+        - offset: logical byte offset of the block (uint64), see SegmentedChain
+        - timestamp: seconds since the epoch, UTC (float64)
+        - case_id: raw 16-byte case UUID (S16)
+        - item_id: item ID (uint32)
+        - state: state code (uint8), an index into STATE_ORDER or UNKNOWN_STATE
+        - data_offset / data_length: logical offset and length of the data area of the block
+    """
+
+    def __init__(self, offset, fields):
+        self.offset = offset
+        self.timestamp = fields['timestamp']
+        self.case_id = fields['case_id']
+        self.item_id = fields['item_id']
+        self.state = encode_states(fields['state'])
+        self.data_length = fields['data_length']
+        self.data_offset = offset + Blockchain.RECORD_SIZE
+
+    def __len__(self):
+        return len(self.offset)
+
+
+def encode_states(raw_states):
+    """
+    Converts an array of raw 12-byte states to uint8 codes, one vectorized comparison per known state.
+    """
+    codes = np.full(len(raw_states), UNKNOWN_STATE, dtype=np.uint8)
+    for code, name in enumerate(STATE_ORDER):
+        codes[raw_states == name.encode()] = code #numpy strips the trailing null padding
+    return codes
+
+
+def load_columns(blockchain=None):
+    """
+    Loads every block header of the chain into a Columns object.
+    :param blockchain: the Blockchain to read, defaults to the one at BCHOC_FILE_PATH.
+    """
+    _require_numpy()
+    blockchain = blockchain if blockchain is not None else Blockchain()
+    cache = blockchain._get_digest_cache() #synchronized, so it lists every block
+    offsets = np.fromfile(cache.path, dtype=[('offset', '<u8'), ('digest', 'S32')])['offset']
+
+    fields = {name: [np.zeros(0, dtype=kind)] for name, start, kind in HEADER_COLUMNS}
+    #Segments are listed after the cache was read, so every cached block is in one of them
+    for segment in blockchain._storage().segments():
+        first, last = np.searchsorted(offsets, [segment.base, segment.base + segment.length])
+        if first == last:
+            continue
+        with open(segment.path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            _gather(np.frombuffer(mm, dtype=np.uint8), offsets[first:last] - segment.base, fields)
+        finally:
+            mm.close()
+    fields = {name: np.concatenate(parts) for name, parts in fields.items()}
+    return Columns(offsets, fields)
+
+
+def _gather(segment, offsets, fields):
+    """
+    Appends the header fields of the blocks at the given offsets of a mapped segment to the field lists.
+    """
+    for first in range(0, len(offsets), CHUNK_BLOCKS):
+        chunk = offsets[first:first + CHUNK_BLOCKS].astype(np.int64)
+        for name, start, kind in HEADER_COLUMNS:
+            positions = chunk[:, None] + np.arange(start, start + np.dtype(kind).itemsize)
+            fields[name].append(segment[positions].view(kind).ravel())
+
+
+def _latest_per_item(columns):
+    """
+    Index of the last block of every item, in item_id order.
+    """
+    items, reversed_index = np.unique(columns.item_id[::-1], return_index=True)
+    return items, len(columns) - 1 - reversed_index
+
+
+def state_distribution(columns):
+    """
+    Counts the current state of the items of every case. The INITIAL block is left out.
+    :return: list of (case_id hex, {state: number of items}) sorted by case.
+    """
+    items, latest = _latest_per_item(columns)
+    latest = latest[columns.state[latest] != STATE_ORDER.index("INITIAL")]
+    cases, case_index = np.unique(columns.case_id[latest], return_inverse=True)
+    counts = np.zeros((len(cases), UNKNOWN_STATE + 1), dtype=np.int64)
+    np.add.at(counts, (case_index.ravel(), columns.state[latest]), 1)
+
+    report = []
+    for case, row in zip(cases, counts):
+        states = {_state_name(code): int(row[code]) for code in np.nonzero(row)[0]}
+        report.append((case.ljust(16, b'\x00').hex(), states))
+    return report
+
+
+def checkout_frequency(columns, top=None):
+    """
+    Counts the checkouts of every item.
+    :param top: only return the items checked out most often.
+    :return: list of (item_id, checkouts), most checked out first.
+    """
+    checked_out = columns.item_id[columns.state == STATE_ORDER.index("CHECKEDOUT")]
+    items, counts = np.unique(checked_out, return_counts=True)
+    order = np.argsort(-counts, kind='stable')
+    if top is not None:
+        order = order[:top]
+    return [(int(items[i]), int(counts[i])) for i in order]
+
+
+def dwell_times(columns):
+    """
+    Measures how long items stayed in each state: the time between a block and the next block of the same
+    item is counted towards the state of the earlier block. The current state of an item has no end yet
+    and isn't counted.
+    :return: list of (state, intervals, mean, median, max), durations in seconds.
+    """
+    order = np.argsort(columns.item_id, kind='stable') #chain order within each item
+    item_ids = columns.item_id[order]
+    same_item = item_ids[1:] == item_ids[:-1]
+    durations = np.diff(columns.timestamp[order])[same_item]
+    states = columns.state[order][:-1][same_item]
+
+    report = []
+    for code in np.unique(states):
+        spent = durations[states == code]
+        report.append((_state_name(code), len(spent), float(spent.mean()), float(np.median(spent)), float(spent.max())))
+    return report
+
+
+def _state_name(code):
+    return STATE_ORDER[code] if code < len(STATE_ORDER) else "UNKNOWN"
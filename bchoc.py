@@ -1,93 +1,468 @@
 #!/usr/bin/env python3
 from blockchain import Blockchain
+from chain_lock import LockTimeout
+from uuid import UUID
 import argparse
+import contextlib
+import io
+import json
+import profiling
+import sys
+import time
 
-def parse(command):
+BATCH_ACTIONS = ('add', 'checkout', 'remove')  # actions batch mode groups into shared appends
+BATCH_GROUP = 1000  # default number of operations per append in batch mode
+_parser = None  # built once by build_parser and reused for every command
+
+def build_parser():
+    """
+    Returns the command parser, building it on first use.
+    """
+    global _parser
+    if _parser is not None:
+        return _parser
     parser = argparse.ArgumentParser(description='Blockchain Chain of Custody Management System')
     parser.add_argument('bchoc')
-    parser.add_argument('action', choices=['add', 'checkout', 'show', 'remove', 'init', 'verify'], help='Action to perform on the blockchain')
-    parser.add_argument('-i', '--item_id', help='Item ID for the blockchain operation')
+    parser.add_argument('action', choices=['add', 'checkout', 'show', 'remove', 'init', 'verify', 'report', 'export', 'import', 'merkle', 'batch'], help='Action to perform on the blockchain')
+    parser.add_argument('what', nargs='?', choices=['cases', 'items', 'history', 'states', 'checkouts', 'dwell',
+                                                    'root', 'prove', 'check', 'compare'],
+                        help="For 'show': list cases, items of a case (-c) or the history of an item (-i). "
+                             "For 'report': item states per case, checkouts per item or time spent in each state. "
+                             "For 'merkle': print the root, prove a block (-i or --block), check a proof (--proof) "
+                             "or compare with another copy of the chain (--other, or --root and --leaves)")
+    parser.add_argument('-i', '--item_id', action='append', help='Item ID for the blockchain operation, can be given several times')
     parser.add_argument ('-c', '--case_id', help= 'Case ID for the blockchain operation')
     parser.add_argument('-p', '--password', help='Password for blockchain verification')
+    parser.add_argument('--full', action='store_true', help='Re-verify the whole chain instead of only the blocks added since the last verify')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of processes hashing the chain in parallel during verify')
+    parser.add_argument('--top', type=int, default=10, help="Number of items listed by 'report checkouts'")
+    parser.add_argument('--stats', action='store_true', help='Print counters and timings of the command to stderr')
+    parser.add_argument('--stats-json', action='store_true', help='Like --stats, as JSON')
+    parser.add_argument('--profile', metavar='FILE', help='Run the command under cProfile and dump the profile to FILE')
+    parser.add_argument('--archive', metavar='FILE', help="Archive written by 'export' or read by 'import'; 'show' and 'verify' read it instead of the chain")
+    parser.add_argument('--codec', choices=['zlib', 'zstd'], default='zlib', help="Compression used by 'export'")
+    parser.add_argument('--block', type=int, help="Position of the block proven by 'merkle prove'")
+    parser.add_argument('--proof', metavar='FILE', help="Proof written by 'merkle prove', checked by 'merkle check' (- for stdin)")
+    parser.add_argument('--other', metavar='PATH', help="Chain file compared by 'merkle compare'")
+    parser.add_argument('--root', help="Root of a remote copy of the chain, for 'merkle compare'")
+    parser.add_argument('--leaves', type=int, help="Number of blocks the --root covers, or the prefix 'merkle root' prints the root of")
+    parser.add_argument('--script', metavar='FILE', default='-', help="Operations run by 'batch', one per line (- for stdin, the default)")
+    parser.add_argument('--format', choices=['auto', 'lines', 'jsonl'], default='auto',
+                        help="Syntax of the 'batch' script: bchoc commands, JSON objects, or either, line by line")
+    parser.add_argument('--group', type=int, default=BATCH_GROUP, help="Operations 'batch' writes with each append")
+    _parser = parser
+    return parser
 
+def parse(command, quiet=False):
+    """
+    Parses one command, given as a string or a list of arguments starting with 'bchoc'.
+    :param quiet: don't print anything for an invalid command (batch mode reports it itself).
+    :return: the parsed arguments, or None if the command is invalid.
+    """
+    parser = build_parser()
     try: #if argparse encounters an invalid input it exits the system so if an invalid command is passed we have to 
         #raise an exception and handle accordingly so the program keeps prompting the user for input
-        args = parser.parse_args(command.split())
+        with contextlib.redirect_stderr(io.StringIO()) if quiet else contextlib.suppress():
+            args = parser.parse_args(command.split() if isinstance(command, str) else command)
         return args
     except SystemExit:
         # This handles invalid input so program doesnt exit
-        print("Invalid command or arguments. Please try again.")
+        if not quiet:
+            print("Invalid command or arguments. Please try again.")
         return None
 
-def main():
-    blockchain = Blockchain() #creates instance of blockchain structure which automatically calls init function
+def main(argv=None):
+    blockchain = Blockchain() #creates instance of blockchain structure; nothing is read until a command needs it
+    argv = sys.argv[1:] if argv is None else argv
+
+    if argv:
+        # One-shot mode (bchoc add -c CASE -i ITEM): runs the single command given on the command line and exits
+        args = parse(['bchoc'] + argv)
+        if args is None:
+            return 1
+        return execute(blockchain, args)
 
     while True:
-        command = input("Enter command: ")
+        try:
+            command = input("Enter command: ")
+        except EOFError:
+            return 0
         args = parse(command)
 
         if args is None : 
             continue 
 
-        elif args.action == 'add':
-            if args.item_id:
-                data = {"action": "add", "case_id": args.case_id, "item_id": args.item_id}
-                blockchain.add_block(data)
-                outcome = blockchain.add_block(data)
-                if (outcome == True):
-                    print(f"Checked out item {args.item_id} from the blockchain.")
-                else: 
-                    print("Block add failed")
-            else:
-                print("Item ID is required for 'checkout' action.")
-
-        elif args.action == 'checkout':
-            if args.item_id:
-                data = {"action": "checkout", "item_id": args.item_id}
-                outcome = blockchain.add_block(data)
-                if (outcome == True):
-                    print(f"Checked out item {args.item_id} from the blockchain.")
-                else: 
-                    print("Block checkout failed")
-            else:
-                print("Item ID is required for 'checkout' action.")
-
-        elif args.action == 'show':
-            for block in blockchain._read_blocks():
-                print(f"Block {block.index} - Hash: {block.hash}")
-                print("Timestamp:", block.timestamp)
-                print("Data:", block.data)
-                print("Previous Hash:", block.previous_hash)
+        execute(blockchain, args)
+
+def execute(blockchain, args):
+    """
+    Runs one parsed command, collecting stats (--stats, --stats-json or BCHOC_PROFILE) and profiling it (--profile)
+    if asked to.
+    :return: exit status, 1 if the chain was locked by another process for longer than BCHOC_LOCK_TIMEOUT.
+    """
+    was_enabled = profiling.enabled
+    if args.stats or args.stats_json:
+        profiling.enable()
+    profiling.reset() #stats are reported per command
+    try:
+        if args.profile:
+            profiling.profile_call(args.profile, run, blockchain, args)
+        else:
+            run(blockchain, args)
+    except LockTimeout as e:
+        print(f"The chain is busy, another process is writing to it ({e}). Try again.")
+        return 1
+    finally:
+        if profiling.enabled:
+            profiling.report(blockchain._lock, fmt="json" if args.stats_json else None)
+        if not was_enabled:
+            profiling.disable()
+    return 0
+
+def run(blockchain, args):
+    """
+    Carries out one parsed command.
+    """
+    if args.action == 'add':
+        if args.item_id:
+            # All items are added in one batch, written with a single append
+            actions = [{"action": "add", "case_id": args.case_id, "item_id": item_id} for item_id in args.item_id]
+            outcome = blockchain.add_blocks(actions)
+            if (outcome == True):
+                for item_id in args.item_id:
+                    print(f"Added item {item_id} to the blockchain.")
+            else: 
+                print("Block add failed")
+        else:
+            print("Item ID is required for 'add' action.")
+
+    elif args.action == 'checkout':
+        for item_id in args.item_id or []:
+            data = {"action": "checkout", "item_id": item_id}
+            outcome = blockchain.add_block(data)
+            if (outcome == True):
+                print(f"Checked out item {item_id} from the blockchain.")
+            else: 
+                print("Block checkout failed")
+        if not args.item_id:
+            print("Item ID is required for 'checkout' action.")
+
+    elif args.action == 'show' and args.what == 'cases':
+        for case_id in blockchain.get_cases():
+            print(UUID(case_id))
+
+    elif args.action == 'show' and args.what == 'items':
+        if args.case_id:
+            try:
+                items = blockchain.get_case_items(args.case_id)
+            except ValueError:
+                print(f"Invalid case ID: {args.case_id}")
+                return
+            for item_id in items:
+                print(item_id)
+        else:
+            print("Case ID is required for 'show items'.")
+
+    elif args.action == 'show' and args.what == 'history':
+        for item_id in args.item_id or []:
+            try:
+                history = blockchain.get_item_history(item_id)
+            except (ValueError, OverflowError):
+                print(f"Invalid item ID: {item_id}")
+                continue
+            for block in history:
+                print("Case:", UUID(block['case_id']))
+                print("Item:", block['item_id'])
+                print("Action:", block['state'])
+                print("Time:", block['timestamp'].isoformat() + "Z")
+                print()
+        if not args.item_id:
+            print("Item ID is required for 'show history'.")
+
+    elif args.action == 'show':
+        # Blocks are streamed from the chain file (or the archive) and printed as they are decoded
+        source = archive(args) if args.archive else blockchain
+        if source is None:
+            return
+        blocks = source.iter_blocks()
+        try:
+            for index, block in enumerate(blocks):
+                print(f"Block {index} - Hash: {blockchain._calculate_block_hash(block)}")
+                print("Timestamp:", block['timestamp'])
+                print("Data:", block['data'])
+                print("Previous Hash:", block['previous_hash'])
                 print("\n")
+        except ValueError as e: #damaged archive
+            print(f"Archive is damaged: {e}")
+
+    elif args.action == 'remove':
+        for item_id in args.item_id or []:
+            data = {"action": "remove", "item_id": item_id}
+            outcome = blockchain.add_block(data)
+            if (outcome == True):
+                print(f"Removed item {item_id} from the blockchain.")
+            else: 
+                print("Block remove failed")
+        if not args.item_id:
+            print("Item ID is required for 'remove' action.")
+
+    elif args.action == 'init':
+        # initial = blockchain._check_for_initial()
+        # if initial == True:
+        #     print("Initialized a new blockchain.")
+        # else : 
+        #     print("Blochain initialization failed")
+        blockchain.init()
+    # Optionally, you might want to handle initialization logic here.
+    #checks for initial block to verify blokchain is setup properly
+
+    elif args.action == 'verify':
+        archive_report = None
+        if args.archive:
+            source = archive(args)
+            if source is None:
+                return
+            archive_report = source.verify()
+        blockchain._verify_checksums(full=args.full, jobs=args.jobs, report=archive_report)
+
+    elif args.action in ('export', 'import'):
+        transfer(blockchain, args)
 
-        elif args.action == 'remove':
-            if args.item_id:
-                data = {"action": "remove", "item_id": args.item_id}
-                blockchain.add_block(data)
-                outcome = blockchain.add_block(data)
-                if (outcome == True):
-                    print(f"Removed item {args.item_id} from the blockchain.")
-                else: 
-                    print("Block remove failed")
+    elif args.action == 'report':
+        report(blockchain, args)
+
+    elif args.action == 'merkle':
+        merkle(blockchain, args)
+
+    elif args.action == 'batch':
+        batch(blockchain, args)
+
+    else :
+        print("invalid command")
+
+
+def archive(args):
+    """
+    Opens the archive given with --archive, or prints why it can't and returns None.
+    """
+    import chain_archive
+    try:
+        return chain_archive.ChainArchive(args.archive)
+    except (ValueError, ImportError, OSError) as e:
+        print(f"Cannot read archive {args.archive}: {e}")
+        return None
+
+def transfer(blockchain, args):
+    """
+    Exports the chain to an archive, or imports an archive into a new chain.
+    """
+    import chain_archive
+    if not args.archive:
+        print(f"An archive file (--archive) is required for '{args.action}'.")
+        return
+    try:
+        if args.action == 'export':
+            result = chain_archive.export_chain(blockchain, args.archive, codec=args.codec)
+            print(f"Exported {result['blocks']} blocks: {result['chain_bytes']} bytes of chain in "
+                  f"{result['archive_bytes']} bytes of archive.")
+        else:
+            written = chain_archive.import_archive(args.archive, blockchain._file_path())
+            print(f"Imported {written} blocks.")
+    except (ValueError, ImportError, OSError) as e:
+        print(f"{args.action.capitalize()} failed: {e}")
+
+def report(blockchain, args):
+    """
+    Prints one of the aggregate reports computed over the columnar view of the chain.
+    """
+    try:
+        import analytics
+        columns = analytics.load_columns(blockchain)
+    except ImportError as e:
+        print(e)
+        return
+
+    if args.what == 'states':
+        for case_id, states in analytics.state_distribution(columns):
+            print("Case:", UUID(case_id))
+            for state, count in sorted(states.items()):
+                print(f"  {state}: {count}")
+    elif args.what == 'checkouts':
+        for item_id, count in analytics.checkout_frequency(columns, top=args.top):
+            print(f"Item {item_id}: {count} checkouts")
+    elif args.what == 'dwell':
+        for state, intervals, mean, median, longest in analytics.dwell_times(columns):
+            print(f"{state}: {intervals} intervals, mean {mean:.1f}s, median {median:.1f}s, max {longest:.1f}s")
+    else:
+        print("Report type is required: states, checkouts or dwell.")
+
+def merkle(blockchain, args):
+    """
+    Prints the Merkle root of the chain, writes or checks the inclusion proof of one block, or compares the chain
+    with another copy of it.
+    """
+    import chain_merkle
+    try:
+        if args.what == 'root':
+            tree = blockchain.merkle_tree()
+            leaves = tree.leaves if args.leaves is None else args.leaves
+            print(f"Blocks: {leaves}")
+            print(f"Root: {tree.root(leaves).hex()}")
+        elif args.what == 'prove':
+            if not args.item_id and args.block is None:
+                print("Item ID (-i) or block position (--block) is required for 'merkle prove'.")
+                return
+            proof = blockchain.merkle_proof(index=args.block, item_id=args.item_id[0] if args.item_id else None)
+            if proof is None:
+                print(f"Item {args.item_id[0]} is not in the chain.")
             else:
-                print("Item ID is required for 'remove' action.")
+                print(json.dumps(proof, indent=2))
+        elif args.what == 'check':
+            if not args.proof:
+                print("A proof file (--proof) is required for 'merkle check'.")
+                return
+            with (sys.stdin if args.proof == '-' else open(args.proof)) as f:
+                proof = json.load(f)
+            if not chain_merkle.verify_proof(proof):
+                print("Proof is INVALID.")
+                return
+            print(f"Proof is valid: block {proof['index']} is in the chain of {proof['leaves']} blocks with root {proof['root']}.")
+            tree = blockchain.merkle_tree()
+            if tree.leaves >= proof['leaves']:
+                matches = tree.root(proof['leaves']).hex() == proof['root']
+                print("The local chain " + ("has this root." if matches else "has a different root."))
+        elif args.what == 'compare':
+            compare(blockchain, args)
+        else:
+            print("Merkle command is required: root, prove, check or compare.")
+    except (ValueError, KeyError, TypeError, OSError) as e:
+        print(f"Merkle {args.what} failed: {e}")
+
+def compare(blockchain, args):
+    """
+    Compares the chain with another copy: a local chain file (--other), where the first block they disagree on is
+    found by bisecting prefix roots, or the root and block count printed by 'merkle root' on a remote copy.
+    """
+    if args.other:
+        other = Blockchain(args.other)
+        if not other._storage().exists():
+            print(f"Chain {args.other} not found.")
+            return
+        divergence, mine, theirs = blockchain.first_divergence(other)
+        if divergence is not None:
+            print(f"Chains diverge at block {divergence}.")
+        elif mine == theirs:
+            print(f"Chains are identical ({mine} blocks).")
+        else:
+            print(f"Chains agree on their first {min(mine, theirs)} blocks; "
+                  f"{'this' if mine > theirs else 'the other'} chain has {abs(mine - theirs)} more.")
+    elif args.root and args.leaves is not None:
+        tree = blockchain.merkle_tree()
+        if args.leaves > tree.leaves:
+            print(f"The remote chain is longer: this chain has {tree.leaves} blocks.")
+        elif tree.root(args.leaves).hex() == args.root.lower():
+            print(f"The first {args.leaves} blocks match the remote chain.")
+        else:
+            print(f"The chains differ within the first {args.leaves} blocks; "
+                  f"compare 'merkle root --leaves N' for smaller N to find where.")
+    else:
+        print("Another chain (--other) or a remote root (--root and --leaves) is required for 'merkle compare'.")
 
-        elif args.action == 'init':
-            # initial = blockchain._check_for_initial()
-            # if initial == True:
-            #     print("Initialized a new blockchain.")
-            # else : 
-            #     print("Blochain initialization failed")
-            blockchain.init()
-        # Optionally, you might want to handle initialization logic here.
-        #checks for initial block to verify blokchain is setup properly
+def read_operations(lines, fmt='auto'):
+    """
+    Parses a batch script. Lines are bchoc commands ("add -c CASE -i 1 -i 2", with or without a leading "bchoc")
+    or JSON objects shaped like the add_block actions ({"action": "add", "case_id": CASE, "item_id": 1}, item_id
+    also taking a list); blank lines and lines starting with # are skipped.
+    Yields (line number, action dictionary, None) for every item of an add/checkout/remove, (line number, None,
+    parsed arguments) for any other command and (line number, None, error message) for a line that can't be parsed.
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        if fmt == 'jsonl' or (fmt == 'auto' and line.startswith('{')):
+            try:
+                operation = json.loads(line)
+                action = operation['action']
+                item_ids = operation['item_id']
+            except (ValueError, KeyError, TypeError) as e:
+                yield number, None, f"Invalid JSON operation: {e}"
+                continue
+            if action not in BATCH_ACTIONS:
+                yield number, None, f"Invalid JSON operation: unknown action '{action}'"
+                continue
+            for item_id in item_ids if isinstance(item_ids, list) else [item_ids]:
+                yield number, dict(operation, item_id=item_id), None
+            continue
+        words = line.split()
+        args = parse(words if words[0] == 'bchoc' else ['bchoc'] + words, quiet=True)
+        if args is None:
+            yield number, None, "Invalid command or arguments."
+        elif args.action in BATCH_ACTIONS and args.item_id:
+            for item_id in args.item_id:
+                yield number, {"action": args.action, "case_id": args.case_id, "item_id": item_id}, None
+        elif args.action in BATCH_ACTIONS:
+            yield number, None, f"Item ID is required for '{args.action}' action."
+        elif args.action == 'batch':
+            yield number, None, "A batch can't run another batch."
+        else:
+            yield number, None, args
 
-        elif args.action == 'verify':
-            blockchain._verify_checksums()
+def batch(blockchain, args):
+    """
+    Runs a batch script (see read_operations). Operations are validated as they are read and every --group of
+    them is written with one append, then one result line per operation is printed:
+        <line> <action> <item> OK | REFUSED <reason>
+    Any other command in the script (show, verify, ...) runs after the operations before it are written.
+    A summary with the throughput follows the results.
+    """
+    group = max(1, args.group)
+    totals = {'applied': 0, 'refused': 0, 'invalid': 0, 'commands': 0, 'appends': 0}
+    pending = []  # (line number, action dictionary) waiting for the next append
+    began = time.perf_counter()
+
+    def flush():
+        if not pending:
+            return
+        results = blockchain.apply_actions([data for number, data in pending])
+        output = []
+        for (number, data), (applied, reason) in zip(pending, results):
+            totals['applied' if applied else 'refused'] += 1
+            output.append(f"{number} {data['action']} {data['item_id']} " + ("OK" if applied else f"REFUSED {reason}"))
+        totals['appends'] += any(applied for applied, reason in results)
+        print("\n".join(output))
+        del pending[:]
+
+    try:
+        source = sys.stdin if args.script == '-' else open(args.script)
+    except OSError as e:
+        print(f"Cannot read script {args.script}: {e}")
+        return
+    try:
+        for number, data, other in read_operations(source, args.format):
+            if data is not None:
+                pending.append((number, data))
+                if len(pending) >= group:
+                    flush()
+            elif isinstance(other, str):
+                flush()
+                totals['invalid'] += 1
+                print(f"{number} - - INVALID {other}")
+            else:
+                flush()
+                totals['commands'] += 1
+                run(blockchain, other)
+        flush()
+    finally:
+        if source is not sys.stdin:
+            source.close()
 
-        else :
-            print("invalid command")
-    
+    seconds = time.perf_counter() - began
+    operations = totals['applied'] + totals['refused']
+    rate = f"{operations / seconds:.0f}" if seconds else "-"
+    print(f"Batch: {operations} operations in {seconds:.3f}s ({rate} ops/s), {totals['applied']} applied, "
+          f"{totals['refused']} refused, {totals['invalid']} invalid lines, {totals['commands']} other commands, "
+          f"{totals['appends']} appends")
 
 def verify_blockchain_integrity(blockchain, password):
     # Example: Perform integrity verification logic based on the password
@@ -95,4 +470,4 @@ def verify_blockchain_integrity(blockchain, password):
     return True
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Long-running bchoc daemon and its thin client.
+
+The server keeps one Blockchain instance, with its item index and tail already loaded, and answers
+JSON Lines requests over a Unix domain socket (or localhost TCP with --port). Every request is one line:
+    {"op": "add", "case_id": "...", "item_ids": [1, 2]}
+and every response is one line:
+    {"ok": true, "result": ...}   or   {"ok": false, "error": "..."}
+Appends are serialized through a single writer thread; show, history, state and verify are served
+concurrently from a pool of reader threads.
+
+Usage:
+    python3 bchoc_server.py serve [--socket PATH | --port N]
+    python3 bchoc_server.py add -c CASE_ID -i ITEM_ID [-i ITEM_ID ...]
+    python3 bchoc_server.py checkout -i ITEM_ID
+    python3 bchoc_server.py remove -i ITEM_ID
+    python3 bchoc_server.py show | cases | items -c CASE_ID | history -i ITEM_ID | state -i ITEM_ID | verify [--full] [--jobs N]
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from blockchain import Blockchain, DEFAULT_FILE_PATH
+
+WRITE_OPS = ('add', 'checkout', 'remove')
+READ_OPS = ('show', 'history', 'cases', 'items', 'state', 'verify', 'ping')
+
+
+def default_socket_path():
+    """
+    The socket lives next to the chain file, so each chain gets its own daemon.
+    """
+    return os.getenv("BCHOC_SOCKET", os.getenv("BCHOC_FILE_PATH", DEFAULT_FILE_PATH) + ".sock")
+
+
+def block_to_json(block):
+    """
+    Converts a block dictionary from Blockchain.iter_blocks into something json can encode.
+    """
+    return {key: value.isoformat() if isinstance(value, datetime) else value for key, value in block.items()}
+
+
+class ChainServer:
+    """
+    Serves one Blockchain to many clients. Appends run one at a time on a dedicated writer thread, so
+    concurrent clients can never interleave blocks; reads run on a separate thread pool and stream the
+    chain through the memory-mapped reader, which is unaffected by appends in progress.
+    """
+
+    def __init__(self, blockchain=None, readers=None):
+        self.blockchain = blockchain if blockchain is not None else Blockchain()
+        self.writer = ThreadPoolExecutor(max_workers=1)
+        self.readers = ThreadPoolExecutor(max_workers=readers)
+
+    def warm(self):
+        """
+        Loads the indexes and tail up front so the first request doesn't pay for it.
+        """
+        self.blockchain._get_item_index()
+        self.blockchain._get_history_index()
+        self.blockchain._get_tail()
+
+    async def handle(self, reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                response = {"ok": True, "result": await self.dispatch(json.loads(line.decode()))}
+            except Exception as e:
+                response = {"ok": False, "error": str(e)}
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+        writer.close()
+
+    async def dispatch(self, request):
+        op = request.get("op")
+        loop = asyncio.get_event_loop()
+        if op in WRITE_OPS:
+            return await loop.run_in_executor(self.writer, self._write, request)
+        if op in READ_OPS:
+            return await loop.run_in_executor(self.readers, getattr(self, "_" + op), request)
+        raise ValueError(f"unknown op: {op}")
+
+    def _write(self, request):
+        op = request["op"]
+        if op == "add":
+            actions = [{"action": "add", "case_id": request.get("case_id"), "item_id": item_id}
+                       for item_id in request.get("item_ids", [])]
+            if not actions:
+                raise ValueError("item_ids is required for 'add'")
+            if not self.blockchain.add_blocks(actions):
+                raise ValueError("add failed")
+            return len(actions)
+        if not self.blockchain.add_block({"action": op, "item_id": request["item_id"]}):
+            raise ValueError(f"{op} failed for item {request['item_id']}")
+        return 1
+
+    def _ping(self, request):
+        return "pong"
+
+    def _show(self, request):
+        return [block_to_json(block) for block in self.blockchain.iter_blocks()]
+
+    def _history(self, request):
+        return [block_to_json(block) for block in self.blockchain.get_item_history(request["item_id"])]
+
+    def _cases(self, request):
+        return self.blockchain.get_cases()
+
+    def _items(self, request):
+        return self.blockchain.get_case_items(request["case_id"])
+
+    def _state(self, request):
+        entry = self.blockchain._get_item_index().get(int(request["item_id"]))
+        if entry is None:
+            return None
+        state, offset, case_id = entry
+        return {"state": state, "offset": offset, "case_id": case_id}
+
+    def _verify(self, request):
+        report = self.blockchain.verify(full=bool(request.get("full")), jobs=int(request.get("jobs", 1)))
+        return {
+            "blocks": report.num_blocks,
+            "checked": report.num_blocks - report.resumed_from,
+            "state": report.error,
+            "violations": [violation._asdict() for violation in report.violations],
+        }
+
+
+def serve(socket_path=None, port=None):
+    """
+    Runs the daemon until interrupted. Listens on localhost TCP if port is given, otherwise on a Unix socket.
+    """
+    server = ChainServer()
+    server.warm()
+    loop = asyncio.get_event_loop()
+    if port is not None:
+        listener = loop.run_until_complete(asyncio.start_server(server.handle, '127.0.0.1', port))
+        print(f"bchoc server listening on 127.0.0.1:{port}")
+    else:
+        socket_path = socket_path or default_socket_path()
+        if os.path.exists(socket_path):
+            os.remove(socket_path) #left over from a previous run
+        listener = loop.run_until_complete(asyncio.start_unix_server(server.handle, socket_path))
+        print(f"bchoc server listening on {socket_path}")
+    sys.stdout.flush()
+    if hasattr(signal, 'SIGTERM') and os.name != 'nt':
+        loop.add_signal_handler(signal.SIGTERM, loop.stop) #shut down cleanly when terminated
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        loop.run_until_complete(listener.wait_closed())
+        if port is None and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+class Client:
+    """
+    Minimal blocking client: one connection, one request line out, one response line back.
+    """
+
+    def __init__(self, socket_path=None, port=None):
+        if port is not None:
+            self.sock = socket.create_connection(('127.0.0.1', port))
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(socket_path or default_socket_path())
+        self.file = self.sock.makefile('rwb')
+
+    def request(self, op, **fields):
+        fields["op"] = op
+        self.file.write(json.dumps(fields).encode() + b"\n")
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("server closed the connection")
+        return json.loads(line.decode())
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='bchoc daemon and client')
+    parser.add_argument('op', choices=('serve',) + WRITE_OPS + READ_OPS, help='serve, or the request to send to a running server')
+    parser.add_argument('-i', '--item_id', action='append', help='Item ID for the request, can be given several times for add')
+    parser.add_argument('-c', '--case_id', help='Case ID for add and items')
+    parser.add_argument('--full', action='store_true', help='For verify: ignore the checkpoint and re-verify the whole chain')
+    parser.add_argument('--jobs', type=int, default=1, help='For verify: number of processes hashing the chain in parallel')
+    parser.add_argument('--socket', help='Unix socket path (defaults to BCHOC_FILE_PATH + ".sock")')
+    parser.add_argument('--port', type=int, help='Use localhost TCP on this port instead of a Unix socket')
+    args = parser.parse_args(argv)
+
+    if args.op == 'serve':
+        serve(args.socket, args.port)
+        return 0
+
+    fields = {}
+    if args.op == 'add':
+        fields = {"case_id": args.case_id, "item_ids": args.item_id or []}
+    elif args.op == 'items':
+        fields = {"case_id": args.case_id}
+    elif args.op == 'verify':
+        fields = {"full": args.full, "jobs": args.jobs}
+    elif args.item_id:
+        fields = {"item_id": args.item_id[0]}
+
+    client = Client(args.socket, args.port)
+    try:
+        response = client.request(args.op, **fields)
+    finally:
+        client.close()
+
+    if not response["ok"]:
+        print("Error:", response["error"])
+        return 1
+    print(json.dumps(response["result"], indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for bchoc.
+
+For every size a synthetic chain is generated with chaingen, then each scenario runs in a fresh process against
+it, so timings include cold caches and the peak resident memory of one scenario isn't inflated by the ones
+before it:
+    - index_build: first open of the chain, building the item and history indexes
+    - lookup: latest state of random items, as add/checkout/remove look it up
+    - item_history: full history of random items, as 'show history' reads it
+    - show: every block formatted like 'show', printed to /dev/null
+    - verify_full / verify_parallel: full verify with one process and with --jobs
+    - append: single-block adds, each its own transaction
+    - bulk_intake: batches of new items, one transaction per batch
+    - durable_block / durable_batch / durable_time: transactions of a few new items with each durability
+      level (BCHOC_DURABILITY), to compare the cost of fsyncing every block, every batch or on a timer
+    - verify_incremental: verify resuming from the checkpoint left by verify_full
+Scenarios that change the chain run after the read-only ones. A separate small chain is generated with every
+kind of corruption, and the violations verify reports are compared with the ones that were injected.
+Results are printed as JSON (and written to --output), one entry per size and scenario, so runs can be compared.
+
+Usage:
+    python3 bench.py [--sizes 1000,10000,100000] [--scenarios verify_full,lookup] [--jobs 4] [--output FILE] [--keep DIR]
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import chaingen
+from blockchain import Blockchain
+
+try:
+    import resource
+except ImportError:  # not available on Windows, memory isn't reported there
+    resource = None
+
+HERE = os.path.abspath(__file__)
+SCENARIOS = ('index_build', 'lookup', 'item_history', 'show', 'verify_full', 'verify_parallel',
+             'append', 'bulk_intake', 'durable_block', 'durable_batch', 'durable_time', 'verify_incremental')
+LOOKUPS = 10000
+HISTORIES = 1000
+APPENDS = 200
+INTAKE_BATCHES = 10
+INTAKE_BATCH = 1000
+DURABLE_BATCHES = 100
+DURABLE_BATCH = 10
+NEW_ITEMS = 1 << 31  # item IDs added by the benchmark start here, above every generated one
+SCENARIO_ITEMS = 1 << 24  # item IDs reserved for each scenario that adds items
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    #ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def scenario(name, blockchain, items, blocks, jobs):
+    """
+    Runs one scenario against the chain at BCHOC_FILE_PATH.
+    :return: (operations done, result to report or None)
+    """
+    rng = random.Random(0)
+    case_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+    first = NEW_ITEMS + SCENARIOS.index(name) * SCENARIO_ITEMS
+
+    if name == 'index_build':
+        blockchain._get_digest_cache()
+        blockchain._get_history_index()
+        blockchain._get_item_index()
+        return 1, None
+    if name == 'lookup':
+        found = sum(blockchain._latest_entry(rng.randint(1, items)) is not None for _ in range(LOOKUPS))
+        return LOOKUPS, found
+    if name == 'item_history':
+        found = sum(len(blockchain.get_item_history(rng.randint(1, items))) for _ in range(HISTORIES))
+        return HISTORIES, found
+    if name == 'show':
+        import bchoc
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            bchoc.run(blockchain, bchoc.parse(['bchoc', 'show']))
+        return blocks, None
+    if name in ('verify_full', 'verify_parallel', 'verify_incremental'):
+        report = blockchain.verify(full=name != 'verify_incremental', jobs=jobs if name == 'verify_parallel' else 1)
+        return report.num_blocks - report.resumed_from, report.error
+    if name == 'append':
+        ok = sum(blockchain.add_block({"action": "add", "case_id": case_id, "item_id": first + n})
+                 for n in range(APPENDS))
+        return APPENDS, ok
+    if name == 'bulk_intake' or name.startswith('durable_'):
+        batches, size = (INTAKE_BATCHES, INTAKE_BATCH) if name == 'bulk_intake' else (DURABLE_BATCHES, DURABLE_BATCH)
+        ok = 0
+        for batch in range(batches):
+            start = first + batch * size
+            ok += blockchain.add_blocks([{"action": "add", "case_id": case_id, "item_id": item_id}
+                                         for item_id in range(start, start + size)])
+        blockchain._storage().sync() #time mode: the last group commit is part of the cost
+        return batches * size, ok
+    raise ValueError(f"Unknown scenario: {name}")
+
+
+def worker(name, items, blocks, jobs):
+    """
+    Entry point of the scenario processes: prints the measurement as one JSON line.
+    """
+    baseline = peak_rss_mb()
+    blockchain = Blockchain()
+    began = time.perf_counter()
+    ops, result = scenario(name, blockchain, items, blocks, jobs)
+    seconds = time.perf_counter() - began
+    print(json.dumps({"seconds": seconds, "ops": ops, "result": result,
+                      "baseline_rss_mb": baseline, "peak_rss_mb": peak_rss_mb()}))
+
+
+def run_scenario(name, chain_path, items, blocks, jobs):
+    env = dict(os.environ, BCHOC_FILE_PATH=chain_path)
+    if name.startswith('durable_'):
+        env["BCHOC_DURABILITY"] = name[len('durable_'):]
+    command = [sys.executable, HERE, '--worker', name, '--items', str(items), '--blocks', str(blocks), '--jobs', str(jobs)]
+    output = subprocess.run(command, env=env, stdout=subprocess.PIPE, check=True).stdout
+    measurement = json.loads(output.decode().splitlines()[-1])
+    measurement["ops_per_s"] = round(measurement["ops"] / measurement["seconds"], 1) if measurement["seconds"] else None
+    measurement["seconds"] = round(measurement["seconds"], 4)
+    return measurement
+
+
+def generate(chain_path, size, cases, corruptions=()):
+    began = time.perf_counter()
+    manifest = chaingen.generate(chain_path, size, cases=cases, corruptions=corruptions)
+    seconds = time.perf_counter() - began
+    return manifest, {"seconds": round(seconds, 4), "ops": size, "ops_per_s": round(size / seconds, 1),
+                      "result": None, "peak_rss_mb": peak_rss_mb()}
+
+
+def corruption_check(directory, size):
+    """
+    Generates a chain with every kind of corruption and checks that verify reports exactly the injected violations.
+    """
+    chain_path = os.path.join(directory, "corrupt.dat")
+    manifest = chaingen.generate(chain_path, size, corruptions=[(kind, 2) for kind in chaingen.CORRUPTIONS], seed=1)
+    os.environ["BCHOC_FILE_PATH"] = chain_path
+    report = Blockchain().verify(full=True)
+    expected = {(violation["index"], violation["error"]) for violation in manifest["violations"]}
+    found = {(violation.index, violation.error) for violation in report.violations}
+    return {
+        "blocks": size,
+        "injected": len(expected),
+        "skipped": manifest["skipped_corruptions"],
+        "missing": [{"index": index, "error": error} for index, error in sorted(expected - found)],
+        "unexpected": [{"index": index, "error": error} for index, error in sorted(found - expected)],
+        "passed": expected == found,
+    }
+
+
+def git_revision():
+    try:
+        output = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(HERE),
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+        return output.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark bchoc on synthetic chains')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='Comma-separated chain sizes in blocks, up to 10000000')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma-separated scenarios to run')
+    parser.add_argument('--cases', type=int, default=100, help='Cases the generated items are spread over')
+    parser.add_argument('--jobs', type=int, default=4, help='Processes used by verify_parallel')
+    parser.add_argument('--corruption-blocks', type=int, default=10000, help='Size of the corrupted chain, 0 to skip the check')
+    parser.add_argument('--output', help='Also write the JSON results to this file')
+    parser.add_argument('--keep', help='Directory to keep the chains in, instead of a temporary one')
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--items', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--blocks', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.items, args.blocks, args.jobs)
+        return 0
+
+    scenarios = [name for name in args.scenarios.split(',') if name]
+    for name in scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name}, choose from {', '.join(SCENARIOS)}")
+
+    directory = args.keep or tempfile.mkdtemp(prefix="bchoc-bench-")
+    os.makedirs(directory, exist_ok=True)
+    results = []
+    try:
+        for size in [int(size) for size in args.sizes.split(',')]:
+            chain_path = os.path.join(directory, f"chain-{size}.dat")
+            manifest, measurement = generate(chain_path, size, args.cases)
+            results.append(dict(blocks=size, scenario='generate', **measurement))
+            for name in scenarios:
+                measurement = run_scenario(name, chain_path, manifest["items"], size, args.jobs)
+                results.append(dict(blocks=size, scenario=name, **measurement))
+            if not args.keep:
+                shutil.rmtree(chain_path + ".segments", ignore_errors=True)
+                for name in os.listdir(directory):
+                    if name.startswith(os.path.basename(chain_path)):
+                        os.remove(os.path.join(directory, name))
+        check = corruption_check(directory, args.corruption_blocks) if args.corruption_blocks else None
+    finally:
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    output = json.dumps({
+        "meta": {
+            "date": datetime.datetime.utcnow().isoformat() + "Z",
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "segment_size": int(os.getenv("BCHOC_SEGMENT_SIZE", str(64 * 1024 * 1024))),
+        },
+        "results": results,
+        "corruption_check": check,
+    }, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    print(output)
+    return 0 if check is None or check["passed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,5 @@
 import os
+import mmap
 import struct
 from enum import Enum
 from datetime import datetime, timezone
@@ -6,6 +7,122 @@ import hashlib
 from uuid import UUID
 from enum import Enum
 import sys
+from chain_index import ItemIndex, HistoryIndex, DigestCache
+from chain_lock import ChainLock, LockTimeout
+import chain_merkle
+from chain_segments import SegmentedChain
+import profiling
+import verification
+
+DEFAULT_FILE_PATH = "C:\\Projects\\CSE469 Project\\CSE469\\chain.dat"
+CHECKPOINT_SUFFIX = ".chk"
+TORN_SUFFIX = ".torn"  # torn tails cut off the chain are kept as BCHOC_FILE_PATH + ".torn-<offset>"
+RECOVERY_ENTRIES = 1024  # digest cache entries searched back for the last intact block
+
+BLOCK_FIELDS = ('previous_hash', 'timestamp', 'case_id', 'item_id', 'state', 'data_length', 'data')
+
+KNOWN_FIELDS = BLOCK_FIELDS + ('offset', 'hash')
+# Raw 12-byte state field -> state name, so every block shares the same few strings
+STATE_NAMES = {}
+
+class Block:
+    """
+    One record of the chain, decoded lazily from its raw bytes (144 header bytes followed by the data area).
+    item_id and state, which nearly every caller reads, are decoded up front (state strings are shared between
+    blocks); everything else is a property that decodes on access, so a caller that only looks at state and
+    item_id never pays for building a UUID string, a datetime or the data string. The raw bytes are kept for hashing.
+    Blocks can also be indexed like the dictionaries _read_blocks used to return (block['state']).
+    """
+
+    __slots__ = ('raw', 'offset', 'item_id', 'state', '_hash')
+
+    def __init__(self, raw, offset=None):
+        self.raw = raw
+        self.offset = offset
+        self.item_id = int.from_bytes(raw[72:104], byteorder=sys.byteorder)
+        state = raw[104:116]
+        self.state = STATE_NAMES.get(state) or state.decode('utf-8').strip('\x00')
+        self._hash = None
+
+    @property
+    def previous_hash(self):
+        return self.raw[0:32].hex()
+
+    @property
+    def timestamp(self):
+        return datetime.utcfromtimestamp(struct.unpack_from('d', self.raw, 32)[0])
+
+    @property
+    def case_id(self):
+        return self.raw[40:56].hex() #uuid only uses the first 16 bytes
+
+    @property
+    def data_length(self):
+        return struct.unpack_from('I', self.raw, 140)[0]
+
+    @property
+    def data(self):
+        return self.raw[144:].decode('utf-8')
+
+    @property
+    def hash(self):
+        """
+        Hex SHA-256 of the raw record, what the next block stores as previous_hash. Computed once.
+        """
+        if self._hash is None:
+            self._hash = hashlib.sha256(self.raw).hexdigest()
+        return self._hash
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field) from None
+
+    def __setitem__(self, field, value):
+        if field != 'hash':
+            raise KeyError(field)
+        self._hash = value #precomputed by a parallel verify
+
+    def keys(self):
+        return BLOCK_FIELDS
+
+    def items(self):
+        return [(field, getattr(self, field)) for field in BLOCK_FIELDS]
+
+    def __repr__(self):
+        return f"Block(offset={self.offset}, item_id={self.item_id}, state={self.state!r})"
+
+class ProfiledBlock(Block):
+    """
+    A Block that counts the fields it decodes and times its hashing. Handed out instead of Block while profiling
+    is enabled, so Block itself carries no instrumentation.
+    """
+
+    __slots__ = ()
+
+    @property
+    def timestamp(self):
+        profiling.count('timestamps_decoded')
+        return Block.timestamp.fget(self)
+
+    @property
+    def case_id(self):
+        profiling.count('case_ids_decoded')
+        return Block.case_id.fget(self)
+
+    @property
+    def data(self):
+        profiling.count('data_decoded')
+        return Block.data.fget(self)
+
+    @property
+    def hash(self):
+        if self._hash is None:
+            with profiling.timer('sha256'):
+                self._hash = hashlib.sha256(self.raw).hexdigest()
+            profiling.count('hashes_computed')
+        return self._hash
 
 class State(Enum):
     INITIAL = "INITIAL"
@@ -14,21 +131,167 @@ class State(Enum):
     DISPOSED = "DISPOSED"
     DESTROYED = "DESTROYED"
     RELEASED = "RELEASED"
+
+STATE_NAMES.update((state.value.ljust(12, '\x00').encode(), state.value) for state in State)
     
+def hash_range(file_path, start, stop):
+    """
+    Returns the concatenated raw SHA-256 digests of the complete blocks starting in [start, stop) of a segment file,
+    offsets being positions in that file. Runs in the worker processes of a parallel verify, so it only takes
+    picklable arguments.
+    """
+    digests = []
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mm)
+        try:
+            offset = start
+            while offset < stop and offset + Blockchain.RECORD_SIZE <= size:
+                end = offset + Blockchain.RECORD_SIZE + struct.unpack_from('I', mm, offset + Blockchain.RECORD_SIZE - 4)[0]
+                if end > size:
+                    break
+                record = view[offset:end]
+                digests.append(hashlib.sha256(record).digest())
+                record.release()
+                offset = end
+        finally:
+            view.release()
+            mm.close()
+    return b''.join(digests)
+
+class Transaction:
+    """
+    A batch of blocks appended to the chain as one unit. The chain lock is held from the moment the
+    transaction starts until it is written, so the tail it links to can't move underneath it. Blocks are packed and hash-linked in memory as they
+    are appended, then written with a single buffered write and one fsync when the with-block exits cleanly.
+    If the with-block raises, nothing is written; if the write itself fails, the chain is truncated back to
+    where it was. The tail, indexes, digest cache and Merkle tree are only updated once the batch is on disk.
+    """
+
+    def __init__(self, blockchain):
+        self.blockchain = blockchain
+        self.previous_hash = None
+        self.blocks = []  # (item_id, state, case_id hex, packed block, digest) in append order
+        self.pending = {}  # item_id -> (state, None, case_id) for items touched by this batch
+
+    def __enter__(self):
+        #The lock covers reading the tail hash, packing and appending, so concurrent writers can't fork the chain
+        self.lock = self.blockchain._get_lock()
+        self.lock.acquire()
+        try:
+            self.blockchain._recover_tail() #nothing may be appended after a torn block
+            offset, self.end, self.previous_hash = self.blockchain._get_tail()
+            #Caught up before the chain grows. The item index is only loaded if this process loaded it already;
+            #otherwise its journal is extended in commit without loading it
+            self.index = None
+            if self.blockchain._item_index is not None:
+                self.index = self.blockchain._get_item_index()
+            self.history = self.blockchain._get_history_index()
+            self.digests = self.blockchain._get_digest_cache()
+            self.merkle = self.blockchain._get_merkle()
+        except BaseException:
+            self.lock.release()
+            raise
+        return self
+
+    def entry(self, item_id):
+        """
+        Returns the latest (state, offset, case_id) of an item, taking this batch into account.
+        The offset is None for blocks that haven't been written yet.
+        """
+        if item_id in self.pending:
+            return self.pending[item_id]
+        index = self.index if self.index is not None else self.history
+        return profiling.lookup(index.get(item_id))
+
+    def append(self, case_id, item_id, state, data):
+        block_data = self.blockchain._pack_block(self.previous_hash, case_id, item_id, state, data)
+        self.previous_hash = hashlib.sha256(block_data).digest() #the only time this block is hashed on append
+        case_hex = block_data[40:56].hex()
+        self.blocks.append((item_id, state, case_hex, block_data, self.previous_hash))
+        self.pending[item_id] = (state, None, case_hex)
+
+    def commit(self):
+        if not self.blocks:
+            return
+        payload = b''.join(block[3] for block in self.blocks)
+        #Written to the active segment, which is sealed first if the batch doesn't fit
+        with profiling.timer('append'):
+            start = self.blockchain._storage().append(payload, self.end)
+        if profiling.enabled:
+            profiling.count('blocks_appended', len(self.blocks))
+            profiling.count('bytes_written', len(payload))
+            profiling.count('hashes_computed', len(self.blocks)) #one per block, in append()
+
+        entries = []
+        digests = []
+        offset = start
+        for item_id, state, case_hex, block_data, digest in self.blocks:
+            end = offset + len(block_data)
+            entries.append((offset, end, item_id, state, case_hex))
+            digests.append((offset, end, digest))
+            offset = end
+        self.blockchain._set_tail(*digests[-1])
+        if self.index is not None:
+            self.index.record_many(entries)
+        else:
+            ItemIndex(self.blockchain._file_path()).extend(entries, start)
+        self.history.record_many(entries)
+        self.digests.record_many(digests)
+        self.merkle.append([digest for offset, end, digest in digests])
+        self.blocks = []
+        self.pending = {}
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.blocks = []
+                self.pending = {}
+        finally:
+            self.lock.release()
+        return False
+
 class Blockchain:
 
     RECORD_SIZE = 144
+
+    def __init__(self, file_path=None):
+        self._path = file_path  # chain file, BCHOC_FILE_PATH if None
+        self._item_index = None  # loaded on first use by _get_item_index
+        self._tail = None  # (offset, end, hash) of the last block, see _get_tail
+        self._tail_path = None  # chain file the tail belongs to
+        self._lock = None  # ChainLock for the current chain file, see _get_lock
+        self._history_index = None  # loaded on first use by _get_history_index
+        self._digest_cache = None  # loaded on first use by _get_digest_cache
+        self._merkle = None  # loaded on first use by _get_merkle
+        self._segments = None  # SegmentedChain for the current chain file, see _storage
+        self._recovered = None  # (chain file, size) the tail was last checked at, see _recover_tail
+
+    def _file_path(self):
+        return self._path or os.getenv("BCHOC_FILE_PATH", DEFAULT_FILE_PATH)
+
+    @property
+    def previous_hash(self):
+        """
+        Hex hash of the last block, which the next block will link to. Looked up on access rather than when the
+        chain is opened, so starting up doesn't have to find the tail.
+        """
+        return self._get_last_hash()
+
     def init(self):
         """
         Initializes the blockchain and creates the INITIAL block if necessary.
         """
-        file_path = os.getenv("BCHOC_FILE_PATH", "C:\\Projects\\CSE469 Project\\CSE469\\chain.dat")
-
-        if not os.path.isfile(file_path):
-            self._write_starting_block()
+        if not self._storage().exists():
+            with self._get_lock(): #two processes initializing at once must not both write an INITIAL block
+                self._write_starting_block()
         elif self._check_for_initial():
+            with self._get_lock():
+                self._recover_tail()
             print("Blockchain file found with INITIAL block.")
-            self.previous_hash = self._get_last_hash()
         else:
             # if the file exists but there's no initial block
             raise Exception ("Blockchain file exists without an INITIAL block.")
@@ -38,7 +301,7 @@ class Blockchain:
         Writes the initial block when the new file is created
         """
         
-        file_path = os.getenv("BCHOC_FILE_PATH", "C:\\Projects\\CSE469 Project\\CSE469\\chain.dat")
+        file_path = self._file_path()
 
         try:
             with open(file_path, 'rb') as f:
@@ -70,393 +333,855 @@ class Blockchain:
 
     def _read_blocks(self):
         """"
-        Returns a list of dictionaries representing blocks.
-        The following fields are present:
+        Returns a list of Block objects. The following fields are present, decoded when accessed:
             - previous_hash: a hex string containing the hash of the previous block
             - timestamp: a datetime object containing the UTC-based time of writing
-            - case_id: a UUID object representing ID of the case
+            - case_id: a hex string with the UUID of the case
             - item_id: an integer representing ID of an item
             - state: a string following the convention of the State enum
             - data_length: length of the description area, stored as integer
             - data: a string of defined length
+        Prefer iter_blocks, which yields the same blocks one at a time.
         """
-        file_path = os.getenv("BCHOC_FILE_PATH", "C:\\Projects\\CSE469 Project\\CSE469\\chain.dat")
-        blocks = []
-        
-        try:
-            with open(file_path, 'rb') as f:
-                while True:
-                    #Read the block header to get the data length
-                    header_format = '32s d 32s 32s 12s 12s 12s I'
-                    header_size = struct.calcsize(header_format)
-                    header_data = f.read(header_size)
-                    
-                    if not header_data:
-                        break #End of file reached
-                    
-                    #Unpack the header
-                    previous_hash, timestamp, case_id, item_id, state, creator, owner, data_length = struct.unpack(header_format, header_data)
-                    
-                    #Read the data field based on the data_length
-                    data_format = '{}s'.format(data_length)
-                    data = f.read(data_length)
-                    data = struct.unpack(data_format, data)[0].decode('utf-8')
-                    
-                    #Convert fields to appropriate types
-                    previous_hash = previous_hash.hex()
-                    timestamp = datetime.utcfromtimestamp(timestamp)
-                    selected_bytes = case_id[:16] #uuid only takes a length of 16 so we have to select 16 first bytes
-                    case_id = UUID(bytes=selected_bytes)
-                    case_id_hex = case_id.hex
-                    item_id = int.from_bytes(item_id, byteorder=sys.byteorder)
-                    state = state.decode('utf-8').strip('\x00')
-                    
-                    #Append the block to the blocks list
-                    blocks.append({
-                        'previous_hash': previous_hash,
-                        'timestamp': timestamp,
-                        'case_id': case_id_hex,
-                        'item_id': item_id,
-                        'state': state,
-                        'data_length': data_length,
-                        'data': data,
-                        })
-        except FileNotFoundError:
+        if not self._storage().exists():
             print("Blockchain file not found.")
-        
-        return blocks
-    
+            return []
+        return list(self.iter_blocks())
+
+    def iter_blocks(self, start=None, stop=None, fields=None):
+        """
+        Returns a generator lazily yielding the blocks of the chain one at a time, as Block objects.
+        With profiling enabled they are ProfiledBlocks, and the blocks and bytes read are counted.
+        :param start: byte offset of the first block to yield, defaults to the start of the chain.
+        :param stop: byte offset to stop at; blocks starting at or after it are not yielded.
+        :param fields: names of the fields the caller will read, from BLOCK_FIELDS plus 'offset' and 'hash'.
+                       Blocks decode fields on access anyway, so this only validates the names.
+        Each segment file is memory-mapped and walked with struct.unpack_from; each record is copied out once,
+        as the raw bytes its Block decodes from. This gives up the zero-copy memoryview slices the reader used to
+        hand out: a Block outlives the iteration (callers keep them in lists), which a view would only allow by
+        keeping the mapping open, and bytes are what the state lookup, hashing and decoding need. Slicing a record
+        of about 150 bytes out of the mapping costs the same as creating a view of it (0.07s per 500k blocks
+        either way). Offsets are logical offsets across segments (see SegmentedChain).
+        """
+        if fields is not None:
+            for field in fields:
+                if field not in KNOWN_FIELDS:
+                    raise ValueError(f"Unknown block field: {field}")
+        if profiling.enabled:
+            return profiling.counted(self._walk_blocks(start or 0, stop, ProfiledBlock))
+        return self._walk_blocks(start or 0, stop, Block)
+
+    def _walk_blocks(self, offset, stop, block_class):
+        for segment in self._storage().segments():
+            if segment.base + segment.length <= offset:
+                continue #ends before start, not even opened
+            if stop is not None and segment.base >= stop:
+                return
+            try:
+                f = open(segment.path, 'rb')
+            except FileNotFoundError:
+                return #sealed and moved since the listing; the blocks up to here are still a prefix of the chain
+            with f:
+                #Segments are read as listed, so blocks appended meanwhile and a footer added by a seal are ignored
+                size = min(segment.length, os.fstat(f.fileno()).st_size)
+                if size == 0:
+                    continue #mmap refuses empty files
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    local = max(offset - segment.base, 0)
+                    while local + self.RECORD_SIZE <= size and (stop is None or segment.base + local < stop):
+                        #The data length is the last field of the header
+                        data_length = struct.unpack_from('I', mm, local + self.RECORD_SIZE - 4)[0]
+                        end = local + self.RECORD_SIZE + data_length
+                        if end > size:
+                            break #Incomplete record at the end of the file
+
+                        yield block_class(mm[local:end], segment.base + local)
+                        local = end
+                finally:
+                    mm.close()
+            offset = segment.base + segment.length
+
+    def _read_block_at(self, offset):
+        """
+        Reads and decodes the single record starting at the given byte offset.
+        Returns None if no record starts there.
+        """
+        record = self._storage().read_record(offset)
+        if record is None:
+            return None
+        if profiling.enabled:
+            profiling.count('blocks_decoded')
+            profiling.count('bytes_read', len(record))
+            return ProfiledBlock(record, offset)
+        return Block(record, offset)
+
+    def _scan_records(self, start=0):
+        """
+        Yields (offset, end, item_id, state, case_id) for every record from the byte offset start onward.
+        Only the fields needed by the item index are decoded.
+        """
+        for block in self.iter_blocks(start=start, fields=('offset', 'data_length', 'item_id', 'state', 'case_id')):
+            end = block['offset'] + self.RECORD_SIZE + block['data_length']
+            yield block['offset'], end, block['item_id'], block['state'], block['case_id']
+
+    def _get_item_index(self):
+        """
+        Returns the item index for the current chain file. On first use the index is loaded from disk and
+        checked against the chain tail: if the chain has grown since, the missing blocks are indexed, and if
+        the index is missing or doesn't match the chain it is rebuilt. Later calls only go back to disk when
+        the chain size changed, i.e. when another process appended blocks.
+        """
+        return self._get_synced('_item_index', ItemIndex)
+
+    def _get_digest_cache(self):
+        """
+        Returns the digest cache for the current chain file, synchronized with the chain the same way as
+        the item index.
+        """
+        return self._get_synced('_digest_cache', lambda file_path: DigestCache(file_path, self._storage(file_path)))
+
+    def _get_synced(self, attr, factory):
+        """
+        Returns the index kept in attribute attr (ItemIndex, HistoryIndex or DigestCache), created with
+        factory(file_path) if there is none for the current chain file, after _sync_index if the chain size
+        changed since it was last synchronized.
+        """
+        file_path = self._file_path()
+        index = getattr(self, attr)
+        if index is None or index.chain_path != file_path:
+            index = factory(file_path)
+        elif index.chain_size == self._chain_size(file_path):
+            profiling.count('index_fresh')
+            return index
+
+        self._sync_index(index)
+        setattr(self, attr, index)
+        return index
+
+    def _get_merkle(self):
+        """
+        Returns the Merkle mountain range over the block digests of the current chain file, caught up with the
+        digest cache. Transactions extend it as they append, so this only rebuilds it if it is missing or stale.
+        """
+        file_path = self._file_path()
+        cache = self._get_digest_cache()
+        merkle = self._merkle
+        if merkle is None or merkle.chain_path != file_path:
+            merkle = chain_merkle.MerkleLog(file_path)
+        elif merkle.leaves == cache.count():
+            return merkle
+
+        with self._get_lock(), profiling.timer('merkle_sync'):
+            merkle.sync(cache)
+        self._merkle = merkle
+        return merkle
+
+    def _get_history_index(self):
+        """
+        Returns the case/history index for the current chain file, synchronized with the chain the same way
+        as the item index.
+        """
+        return self._get_synced('_history_index', HistoryIndex)
+
+    def _sync_index(self, index):
+        """
+        Brings an index (ItemIndex, HistoryIndex or DigestCache) up to date with the chain file: catches up on blocks it
+        hasn't seen if its tail still matches the chain, and rebuilds it otherwise.
+        """
+        file_path = self._file_path()
+        #Index writes happen under the chain lock so they never interleave with another writer's
+        with self._get_lock(), profiling.timer('index_sync'):
+            profiling.count('index_syncs')
+            usable = index.refresh() #picks up what other processes recorded
+            chain_size = self._chain_size(file_path)
+            if usable and index.chain_size == chain_size:
+                return
+            if usable and self._index_matches_chain(index, chain_size):
+                missing = [index.entry(block) for block in self.iter_blocks(start=index.chain_size)]
+                if missing:
+                    index.record_many(missing)
+                    profiling.count('index_catchup_blocks', len(missing))
+            else:
+                profiling.count('index_rebuilds')
+                index.rebuild(self._rebuild_records(index))
+
+    def _rebuild_records(self, index):
+        """
+        Yields the records to rebuild an index from, in chain order. The item index only keeps the latest block of
+        every item, which the footers of sealed segments already list, so for it only the blocks after the last
+        sealed segment with a footer are read; the other indexes need every block.
+        """
+        start = 0
+        if isinstance(index, ItemIndex):
+            storage = self._storage()
+            for segment in storage.segments():
+                footer = storage.footer(segment)
+                if footer is None or segment.base != start:
+                    break
+                items = sorted((entry[1], entry[2], int(item_id), entry[0], entry[3])
+                               for item_id, entry in footer['items'].items())
+                yield from items
+                start = segment.base + segment.length
+        for block in self.iter_blocks(start=start):
+            yield index.entry(block)
+
+    def _recover_tail(self):
+        """
+        Detects a torn tail, i.e. what a crash in the middle of an append leaves at the end of the active segment,
+        and cuts it off so nothing is appended after it. A record is torn if it is incomplete: its header is
+        partial or its data length runs past the end of the file. Past the last record the digest cache has an
+        entry for, a complete record is torn too if its state is not a valid one (a crash can leave zeros where
+        the data should be) or it doesn't link to the record before it; links are only checked if there is a
+        digest cache, since without one nothing says which records were appended by this tool. A complete record
+        the cache covers stays in the chain even if it doesn't link or match its digest, for verify to report.
+        The records are walked from the last one that still hashes to its digest cache entry (a known record
+        boundary), or from the start of the segment. What is cut off is moved to BCHOC_FILE_PATH + ".torn-<offset>", or dropped if
+        BCHOC_TORN_TAIL=truncate, and digest cache entries past the new end are removed. The other indexes notice
+        the shorter chain and rebuild themselves.
+        Only writers run this (before appending, and on init); reads skip an incomplete tail without changing
+        the chain. The check is skipped while the chain size is the one last checked. The caller must hold the
+        chain lock.
+        :return: logical offset the chain was cut at, or None if the tail was intact.
+        """
+        file_path = self._file_path()
+        storage = self._storage(file_path)
+        segments = storage.segments()
+        size = segments[-1].base + segments[-1].length if segments else 0
+        if self._recovered == (file_path, size):
+            return None
+        self._recovered = (file_path, size)
+        if not segments or segments[-1].sealed:
+            return None #sealed segments were fsynced and checked when they were sealed
+
+        active = segments[-1]
+        cache = DigestCache(file_path, storage)
+        entries = cache.tail_entries(RECOVERY_ENTRIES)
+
+        with open(active.path, 'rb') as f:
+            #Start after the last block that still matches its digest, or at the start of the segment
+            start = 0
+            previous = bytes(32) if active.base == 0 else None #hash the first record walked must link to
+            if active.base and len(segments) > 1:
+                footer = storage.footer(segments[-2])
+                previous = bytes.fromhex(footer['last_hash']) if footer and 'last_hash' in footer else None
+            for offset, digest in reversed(entries):
+                if offset < active.base:
+                    break
+                f.seek(offset - active.base)
+                header = f.read(self.RECORD_SIZE)
+                if len(header) == self.RECORD_SIZE:
+                    record = header + f.read(struct.unpack_from('I', header, self.RECORD_SIZE - 4)[0])
+                    if offset - active.base + len(record) <= active.length and hashlib.sha256(record).digest() == digest:
+                        start = offset - active.base + len(record)
+                        previous = digest
+                        break
+            f.seek(start)
+            blocks = f.read(active.length - start)
+
+        covered = entries[-1][0] - active.base - start if entries else -1 #last record the cache has, local to blocks
+        local = 0
+        while local < len(blocks):
+            end = self._record_end(blocks, local)
+            if end is None:
+                break
+            if local > covered:
+                if blocks[local + 104:local + 116] not in STATE_NAMES:
+                    break
+                if entries and previous is not None and blocks[local:local + 32] != previous:
+                    break
+            previous = hashlib.sha256(blocks[local:end]).digest()
+            local = end
+        if local == len(blocks):
+            return None
+
+        cut = active.base + start + local
+        if entries and entries[-1][0] >= cut:
+            cache.truncate(cut)
+        quarantine_path = None
+        if os.getenv("BCHOC_TORN_TAIL", "quarantine") != "truncate":
+            quarantine_path = f"{file_path}{TORN_SUFFIX}-{cut}"
+        removed = storage.cut(cut, quarantine_path)
+        self._tail = None
+        self._recovered = (file_path, cut)
+        profiling.count('torn_bytes_removed', removed)
+        kept = f", moved to {quarantine_path}" if quarantine_path else ""
+        print(f"Recovered from a torn write: cut {removed} bytes at offset {cut}{kept}", file=sys.stderr)
+        return cut
+
+    def _record_end(self, blocks, local):
+        """
+        End of the record starting at local in a buffer of raw blocks, or None if it doesn't fit in the buffer.
+        """
+        if local + self.RECORD_SIZE > len(blocks):
+            return None
+        end = local + self.RECORD_SIZE + struct.unpack_from('I', blocks, local + self.RECORD_SIZE - 4)[0]
+        return end if end <= len(blocks) else None
+
+    def _chain_size(self, file_path):
+        return self._storage(file_path).size()
+
+    def _storage(self, file_path=None):
+        """
+        Returns the SegmentedChain holding the blocks of the current chain file.
+        """
+        file_path = file_path or self._file_path()
+        if self._segments is None or self._segments.chain_path != file_path:
+            self._segments = SegmentedChain(file_path)
+        return self._segments
+
+    def _get_lock(self):
+        """
+        Returns the ChainLock guarding appends to the current chain file.
+        """
+        file_path = self._file_path()
+        if self._lock is None or self._lock.path != file_path + ChainLock.SUFFIX:
+            self._lock = ChainLock(file_path)
+        return self._lock
+
+    def _index_matches_chain(self, index, chain_size):
+        """
+        Cheap staleness check: the block the index believes is its tail must still be in the chain,
+        end exactly where the index says, and be the block the index recorded there.
+        """
+        if index.chain_size > chain_size:
+            return False
+        if index.tail_offset is None:
+            return index.chain_size == 0
+        tail = self._read_block_at(index.tail_offset)
+        if tail is None:
+            return False
+        if index.tail_offset + self.RECORD_SIZE + tail['data_length'] != index.chain_size:
+            return False
+        return index.matches_tail(tail)
+
+    def get_cases(self):
+        """
+        Returns the case IDs (hex strings) of every case in the chain.
+        """
+        return self._get_history_index().cases()
+
+    def get_case_items(self, case_id):
+        """
+        Returns the item IDs registered under a case. case_id may be a UUID or any string UUID accepts.
+        """
+        if not isinstance(case_id, UUID):
+            case_id = UUID(str(case_id))
+        return self._get_history_index().items(case_id.hex)
+
+    def get_item_history(self, item_id):
+        """
+        Returns every block of an item, oldest first, as dictionaries like those of _read_blocks.
+        Only the item's own blocks are read from the chain.
+        """
+        offsets = self._get_history_index().history(int(item_id))
+        return [self._read_block_at(offset) for offset in offsets]
+
+    def _latest_entry(self, item_id):
+        """
+        Returns (state, offset, case_id) of the latest block of an item, or None if the item is unknown.
+        A process that has loaded the item index answers from memory; otherwise this is one lookup in the history
+        index, so a one-shot command never has to load the whole item index.
+        """
+        if self._item_index is not None and self._item_index.chain_path == self._file_path():
+            return profiling.lookup(self._get_item_index().get(item_id))
+        return profiling.lookup(self._get_history_index().get(item_id))
+
     def _get_specific_block(self, item_id):
         """
-        Returns a dictionary rep of the block
+        Returns a dictionary rep of the latest block for item_id, looked up through _latest_entry
+        """
+        entry = self._latest_entry(item_id)
+        if entry is None:
+            return None
+        return self._read_block_at(entry[1])
+
+    def merkle_proof(self, index=None, item_id=None):
+        """
+        Returns the inclusion proof of one block in the Merkle tree of the chain (see chain_merkle), with the
+        block's offset and raw record, so chain_merkle.verify_proof can check it without the chain.
+        :param index: position of the block in the chain.
+        :param item_id: prove the latest block of this item instead.
+        :return: the proof dictionary, or None if the item is unknown.
+        """
+        merkle = self.merkle_tree()
+        cache = self._get_digest_cache()
+        if item_id is not None:
+            entry = self._latest_entry(int(item_id))
+            if entry is None:
+                return None
+            index = cache.position(entry[1])
+        proof = merkle.proof(index)
+        proof['offset'] = cache.entries(index, index + 1)[0][0]
+        proof['record'] = self._read_raw_record(self._file_path(), proof['offset']).hex()
+        return proof
+
+    def merkle_tree(self):
+        """
+        Returns the Merkle mountain range of the chain, checked against the chain's records. The stored tree is built
+        from the digests recorded when the blocks were appended, so a record modified since, in a sealed segment as
+        much as in the active one, would not change its root: the records are hashed again and the stored tree is
+        only returned if the tree of those hashes has the same root.
+        :raises ValueError: if a record no longer matches, naming the first one.
+        """
+        merkle = self._get_merkle()
+        records = self._record_tree()
+        if records.leaves >= merkle.leaves and records.root(merkle.leaves) == merkle.root():
+            return merkle
+        divergence = chain_merkle.first_divergence(merkle, records)
+        if divergence is None:
+            raise ValueError(f"the chain has {records.leaves} blocks but {merkle.leaves} were appended to it")
+        raise ValueError(f"block {divergence} no longer matches the digest recorded when it was appended, "
+                         f"run 'verify' to check the chain")
+
+    def _record_tree(self):
+        """
+        Builds the Merkle tree of a chain in memory from its records, without reading or writing its index files.
+        """
+        return chain_merkle.MerkleTree(hashlib.sha256(block.raw).digest() for block in self.iter_blocks())
+
+    def first_divergence(self, other):
+        """
+        Compares the Merkle roots of this chain and another Blockchain. Both trees are built the same way, in
+        memory from the records of each chain, so a record modified in either copy is found. The other chain is
+        only read: its lock isn't taken and none of its index files are written.
+        :return: (index of the first block that differs or None if one chain is a prefix of the other,
+                  blocks in this chain, blocks in the other)
+        """
+        mine = self._record_tree()
+        theirs = other._record_tree()
+        return chain_merkle.first_divergence(mine, theirs), mine.leaves, theirs.leaves
+
+    def _pack_block(self, previous_hash, case_id, item_id, state, data):
+        """
+        Packs one record with the given previous hash (raw bytes) and the current UTC time.
         """
-        for block in reversed(self._read_blocks()):
-            if block['item_id'] == item_id:
-                return block
-        return None
-        
-    def _write_block(
-            self,
-            case_id: UUID,
-            item_id: int,
-            state: str,
-            data: str
-            ):
-        
-        file_path = os.getenv("BCHOC_FILE_PATH", "C:\\Projects\\CSE469 Project\\CSE469\\chain.dat")
-        
         #Convert inputs to correct format
+        if not isinstance(case_id, UUID):
+            case_id = UUID(str(case_id))
         case_id_bytes = case_id.bytes
         item_id_bytes = item_id.to_bytes(4, byteorder = sys.byteorder)
         state_bytes = state.ljust(12, '\x00').encode()
         data_bytes = data.encode()
         data_length = len(data_bytes)
         
-        #Calculate the previous block's hash
-        previous_hash = self._calculate_previous_hash(file_path)
-        
         #Current UTC time
         timestamp = datetime.utcnow().timestamp()
         
         #Pack the block using struct
         block_format = '32s d 32s 32s 12s 12s 12s I {}s'.format(data_length)
-        block_data = struct.pack(block_format, previous_hash, timestamp, case_id_bytes, item_id_bytes, state_bytes, b'\x00'*12, b'\x00'*12, data_length, data_bytes)
-        
-        #Write the block to the file
+        return struct.pack(block_format, previous_hash, timestamp, case_id_bytes, item_id_bytes, state_bytes, b'\x00'*12, b'\x00'*12, data_length, data_bytes)
+
+    def transaction(self):
+        """
+        Returns a Transaction for appending a batch of blocks as one unit:
+            with blockchain.transaction() as txn:
+                txn.append(case_id, item_id, state, data)
+        """
+        return Transaction(self)
+
+    def _write_block(
+            self,
+            case_id: UUID,
+            item_id: int,
+            state: str,
+            data: str
+            ):
+        """
+        Appends a single block to the chain.
+        """
+        return self.append_many([(case_id, item_id, state, data)])
+
+    def append_many(self, records):
+        """
+        Appends several blocks with one buffered write and one fsync.
+        :param records: iterable of (case_id, item_id, state, data) tuples.
+        :return: True if every block was written, False if the batch failed (in which case none were).
+        :raises LockTimeout: if another process held the chain lock for too long; nothing was written.
+        """
         try:
-            with open(file_path, 'ab') as f: #Open the file in append-binary mode
-                f.write(block_data)
-            return True
+            with self.transaction() as txn:
+                for case_id, item_id, state, data in records:
+                    txn.append(case_id, item_id, state, data)
+        except LockTimeout:
+            raise
         except Exception as e:
             print(f"Failed to write block: {e}")
             return False
-        
+        return True
 
-    def add_block(self, data): #used to add, remove, or checkout based on the action
+    def _plan_block(self, data, entry):
+        """
+        Works out the block an add/remove/checkout action should append.
+        :param data: the action dictionary passed to add_block.
+        :param entry: (state, offset, case_id) of the item's latest block, or None for an unknown item.
+        :return: (case_id, item_id, state, data) for the new block, or None if the action isn't allowed.
+        """
+        block, reason = self._check_action(data, entry)
+        if block is None and data["action"] == "add":
+            print(reason) #remove and checkout failures are reported by their callers
+        return block
+
+    def _check_action(self, data, entry):
+        """
+        Checks an add/remove/checkout action against the item's current state.
+        :return: (block, None) with the (case_id, item_id, state, data) to append, or (None, reason) if the
+                 action isn't allowed.
+        """
         action = data["action"]
-        item_id = data["item_id"]
+        item_id = int(data["item_id"])
 
-        case_id = data["case_id"]
+        case_id = data.get("case_id")
 
         dat = f"Item {item_id}" #formatted string
 
+        current_state = entry[0] if entry else None
+
         if (action == "add"): 
-            state = str(State.CHECKED_IN) #state of a newly added item, converts enum to string
-            outcome = self._write_block(case_id, item_id, state, dat)
-            if (outcome == True):
-                return True
-            else: 
-                return False
-        elif (action == "remove"): #means we have to create a new block with the updated state
-            block = self._get_specific_block(item_id) #get block that matches item_id
-            if (block and block["state"] == "CHECKEDIN"): 
-                new_state = str(State.DISPOSED) #state to signify blockchain is invalidating this block
-                case_id = block["case_id"]
-                dat = f"Item {item_id}"
-                outcome = self._write_block(case_id, item_id, new_state, dat)
-                if (outcome == True):
-                    return True
-                else: 
-                    return False
-        elif(action =="checkout"):
-            print("checkout")
-
-        return None
+            if (current_state is not None):
+                return None, f"Item {item_id} already exists in the blockchain."
+            if (case_id is None):
+                return None, "Case ID is required for 'add' action."
+            state = State.CHECKED_IN.value #state of a newly added item
+            return (case_id, item_id, state, dat), None
+        if action not in ("remove", "checkout"):
+            return None, f"Unknown action '{action}'."
+        if (current_state is None):
+            return None, f"Item {item_id} is not in the blockchain."
+        if (current_state != State.CHECKED_IN.value):
+            return None, f"Item {item_id} is {current_state}, it can't be {'removed' if action == 'remove' else 'checked out'}."
+        if (action == "remove"): #means we have to create a new block with the updated state
+            new_state = State.DISPOSED.value #state to signify blockchain is invalidating this block
+            return (entry[2], item_id, new_state, dat), None
+        return (entry[2], item_id, State.CHECKED_OUT.value, dat), None
 
+    def add_block(self, data): #used to add, remove, or checkout based on the action
+        #Latest state of the item, looked up in an index instead of scanning the chain
+        try:
+            entry = self._latest_entry(int(data["item_id"]))
+        except (ValueError, OverflowError):
+            print(f"Invalid item ID: {data['item_id']}")
+            return False
+        block = self._plan_block(data, entry)
+        if block is None:
+            return False
+        return self._write_block(*block)
 
-    def _calculate_previous_hash(self, file_path):
+    def add_blocks(self, actions):
         """
-        Calculate the hash of the last block in the file
+        Applies several add/remove/checkout actions as one batch. Each action is checked against the item states
+        left by the actions before it, and if any of them isn't allowed nothing is written.
+        :return: True if the whole batch was appended, False otherwise.
+        :raises LockTimeout: if another process held the chain lock for too long; nothing was written.
         """
         try:
-            with open(file_path, 'rb') as f:
-                f.seek(0, os.SEEK_END)
-                filesize = f.tell()
-                if filesize == 0:
-                    return b'\x00' * 32 #If the file is empty, return 32 bytes of zeros
-                
-                f.seek(-1, os.SEEK_END)
-                while f.read(1) != b'\x00':
-                    f.seek(-2, os.SEEK_CUR)
-                    
-                last_block_start = f.tell() + 1
-                f.seek(last_block_start)
-                last_block = f.read()
-
-                #Calculate and return the hash
-                return hashlib.sha256(last_block).digest()
-            
-        except FileNotFoundError:
-            return b'\x00' * 32 #If the file does not exist, return 32 bytes of zeros
-        
-    def _check_for_initial(self):
+            with self.transaction() as txn:
+                for data in actions:
+                    block = self._plan_block(data, txn.entry(int(data["item_id"])))
+                    if block is None:
+                        raise ValueError(f"action '{data['action']}' not allowed for item {data['item_id']}")
+                    txn.append(*block)
+        except LockTimeout:
+            raise
+        except Exception as e:
+            print(f"Failed to write blocks: {e}")
+            return False
+        return True
+
+    def apply_actions(self, actions):
         """
-        Checks for an INITIAL block within the chain.
-        :return: True if an INITIAL block is found, False otherwise.
+        Applies add/remove/checkout actions in one transaction, as batch mode does with every group of operations.
+        Unlike add_blocks, an action that isn't allowed is refused on its own and the allowed ones are still
+        written. Every action is checked against the item states left by the ones before it: the item index is
+        loaded into memory once and kept current by the transactions, and the transaction tracks its own blocks.
+        :param actions: action dictionaries, as passed to add_block.
+        :return: (applied, reason) for every action, reason saying why it wasn't applied (None if it was). If the
+                 transaction fails, nothing is written and every action gets a result, the failure for those that
+                 weren't refused already.
         """
-        # Use the _read_blocks method to get all blocks
-        blocks = self._read_blocks()
+        actions = list(actions)
+        results = []
+        try:
+            self._get_item_index()
+            with self.transaction() as txn:
+                for data in actions:
+                    try:
+                        block, reason = self._check_action(data, txn.entry(int(data["item_id"])))
+                        if block is not None:
+                            txn.append(*block)
+                    except (KeyError, ValueError, TypeError, OverflowError) as e: #malformed item or case ID
+                        block, reason = None, f"Invalid action: {e}"
+                    results.append((block is not None, reason))
+        except Exception as e:
+            failure = f"Failed to write blocks: {e}"
+            results = [(False, failure if applied else reason) for applied, reason in results]
+            return results + [(False, failure)] * (len(actions) - len(results))
+        return results
 
-        # Iterate through each block and check its state
-        for block in blocks:
-            if block['state'] == 'INITIAL':
-                return True  # Return True immediately if an INITIAL block is found
 
-        # If the loop completes without finding an INITIAL block, return False
-        return False
+    def _calculate_previous_hash(self, file_path):
+        """
+        Returns the hash of the last block in the file, as raw bytes (32 bytes of zeros for an empty chain).
+        This comes from the tracked tail, so it costs no chain I/O once the tail is known.
+        """
+        return self._get_tail()[2]
 
-    def _calculate_block_hash(self, block):
+    def _get_tail(self):
         """
-        Calculates the SHA-256 hash of the given block.
-        :param block: A dictionary representing a block with keys for previous hash, timestamp,
-                      case ID, item ID, state, and data.
-        :return: A hex string representing the hash of the block.
+        Returns (offset, end, hash) of the last block of the chain: its byte offset, the byte offset just past it
+        (the chain size) and the raw SHA-256 digest of its bytes. For an empty or missing chain this is (None, 0, zeros).
+        The tail is kept in memory; whenever the chain size no longer matches it, it is read from the last entry
+        of the digest cache, which is checked against the last record while the cache is synchronized.
         """
-        # Create a string representation of the block.
-        block_string = f"{block['previous_hash']}{block['timestamp']}{block['case_id']}{block['item_id']}{block['state']}{block['data_length']}{block['data']}"
-    
-        # Encode the string to a byte array
-        block_encoded = block_string.encode()
+        file_path = self._file_path()
+        size = self._chain_size(file_path)
+
+        if self._tail is not None and self._tail_path == file_path and self._tail[1] == size:
+            return self._tail
 
-        # Calculate the SHA-256 hash of the encoded block
-        block_hash = hashlib.sha256(block_encoded).hexdigest()
+        if size == 0:
+            tail = (None, 0, b'\x00' * 32)
+        else:
+            cache = self._get_digest_cache()
+            tail = (cache.tail_offset, cache.chain_size, cache.tail_digest)
 
-        return block_hash
+        self._tail_path = file_path
+        self._tail = tail
+        return tail
 
-    def _verify_checksums(self):
+    def _read_raw_record(self, file_path, offset):
         """
-        Performs verification of the blockchain to check for integrity issues.
-        :return: A tuple containing:
-            - An integer: the number of blocks checked,
-            - A string: error type ("NO PARENT", "DUPLICATE PARENT", "IMPROPER REMOVAL", or "VALID" if no errors),
-            - A hash (or list of hashes in case of "DUPLICATE PARENT"): blocks involved in the error.
+        Returns the raw bytes of the record starting at offset, or None if no complete record starts there.
         """
-        # Initially, assume blockchain is valid
-        error = "CLEAN"
-        error_hashes = []
+        return self._storage(file_path).read_record(offset)
 
-        # Use the _read_blocks method to get all blocks
-        blocks = self._read_blocks()
-
-        # Dictionary to track parent blocks
-        parent_blocks = {}
+    def _set_tail(self, offset, end, digest):
+        """
+        Records a freshly appended block as the new tail in memory.
+        """
+        self._tail_path = self._file_path()
+        self._tail = (offset, end, digest)
 
-        for i, block in enumerate(blocks):
-            # Skip the initial block as it has no parent
-            if i == 0:
-                continue
+    def _check_for_initial(self):
+        """
+        Checks that the chain starts with an INITIAL block. Only the first record is read: the INITIAL block is
+        always record 0, so the rest of the chain doesn't need to be parsed.
+        :return: True if the first block is a complete INITIAL block linking to nothing, False otherwise.
+        """
+        block = self._read_block_at(0)
+        return block is not None and block['state'] == 'INITIAL' and block['previous_hash'] == '0' * 64
 
-            prev_hash = block['previous_hash']
-            current_hash = self._calculate_block_hash(block)  # You need to implement this method
+    def _calculate_block_hash(self, block):
+        """
+        Returns the SHA-256 hash of the given block as a hex string. This is the canonical block hash: it is
+        taken over the block's raw bytes, which is also what the next block stores as its previous hash.
+        :param block: a Block, as returned by iter_blocks.
+        """
+        return block['hash']
 
-            # Check for "NO PARENT"
-            if prev_hash not in parent_blocks and i != 0:
-                error = "NO PARENT"
-                error_hashes.append(current_hash)
-                break
+    def verify(self, rules=None, full=False, jobs=1):
+        """
+        Runs the integrity rules over the chain in a single streaming pass.
+        With the built-in rules, every block is also checked against the digest cache (BCHOC_FILE_PATH + ".digests"),
+        and a successful (CLEAN) run leaves a checkpoint next to the chain (BCHOC_FILE_PATH + ".chk") with the block
+        count, byte offset, tail hash and the latest state of every item. The next run checks that the checkpoint
+        still matches the chain and then only verifies the blocks appended since; if it doesn't match, the whole
+        chain is verified again.
+        :param rules: list of verification.Rule instances, defaults to every built-in rule. Custom rules always
+                      verify the whole chain and never use checkpoints.
+        :param full: ignore any checkpoint and re-verify the whole chain.
+        :param jobs: number of worker processes hashing the chain in parallel; the report is the same as with 1.
+        :return: a verification.VerificationReport listing every violation with its block index and hash.
+        """
+        with profiling.timer('verify'):
+            report = self._verify(rules, full, jobs)
+        profiling.count('blocks_verified', report.num_blocks - report.resumed_from)
+        return report
 
-            # Check for "DUPLICATE PARENT"
-            if prev_hash in parent_blocks:
-                error = "DUPLICATE PARENT"
-                error_hashes.extend([parent_blocks[prev_hash], current_hash])
-                break
+    def _verify(self, rules, full, jobs):
+        if rules is not None:
+            blocks = self._blocks_to_verify(0, verification.required_fields(rules), jobs)
+            return verification.run_rules(blocks, rules)
 
-            parent_blocks[prev_hash] = current_hash
+        checkpoint_path = self._file_path() + CHECKPOINT_SUFFIX
+        tracker = verification.CheckpointRule()
+        rules = verification.default_rules() + [tracker]
+        report = verification.VerificationReport()
+        start = 0
 
-            # Additional checks can be implemented here, such as "IMPROPER REMOVAL", not usre how yet though
-            #This might be a TODO
+        checkpoint = None if full else verification.load_checkpoint(checkpoint_path)
+        if checkpoint is not None and self._checkpoint_matches_chain(checkpoint):
+            for rule in rules:
+                rule.resume(checkpoint)
+            report.num_blocks = checkpoint['blocks']
+            report.resumed_from = checkpoint['blocks']
+            start = checkpoint['offset']
 
-        # Determine the number of transactions (blocks) checked
-        num_transactions = len(blocks)
+        #Each block is hashed once while streaming and cross-checked against the digest recorded when it was appended
+        rules.insert(0, verification.DigestRule(self._get_digest_cache().iter_from(start)))
+        storage = self._storage()
+        segments = storage.segments()
+        if len(segments) > 1 or (segments and segments[0].sealed):
+            rules.insert(0, verification.SegmentRule(segments, storage.footer, start)) #first, so violations stay in chain order
 
-        # Depending on your blockchain's structure, you may need to adjust how errors are detected and how hashes are calculated or stored.
+        blocks = self._blocks_to_verify(start, verification.required_fields(rules), jobs)
+        verification.run_rules(blocks, rules, report)
 
-        print ("Transactions in blockchain:", num_transactions)
-        print("State of blockchain:", error)
-        return num_transactions, error, error_hashes
+        if not report.violations and report.num_blocks > 0:
+            verification.save_checkpoint(checkpoint_path, tracker.checkpoint)
+        return report
 
-    def _verify_remove_is_final(self):
+    def _blocks_to_verify(self, start, fields, jobs):
         """
-        Loops through the entire blockchain, keeping track of all items that have been removed. If an item that has been removed appears again, return False.
-        Otherwise, return True.
+        Yields the blocks from byte offset start onward with the given fields decoded, for the verification engine.
+        With more than one job, the block hashes are computed up front by a process pool, each worker hashing a
+        contiguous byte range of the chain, and the blocks are then streamed with those hashes attached.
         """
-        # Use the _read_blocks method to get all blocks
-        blocks = self._read_blocks()
+        if jobs <= 1 or 'hash' not in fields:
+            yield from self.iter_blocks(start=start, fields=fields)
+            return
 
-        # Keep track of item IDs and their removal status
-        removed_items = set()
-        seen_items = set()
+        #Blocks appended after the hashing pass have no digest and are left to the next run
+        digests, stop = self._parallel_hashes(start, jobs)
+        fields = tuple(field for field in fields if field != 'hash')
+        for i, block in enumerate(self.iter_blocks(start=start, stop=stop, fields=fields)):
+            block['hash'] = digests[i * 32:(i + 1) * 32].hex()
+            yield block
 
-        for block in blocks:
-            item_id = block['item_id']  # Assuming this gets the item ID correctly
-            state = block['state']
+    def _parallel_hashes(self, start, jobs):
+        """
+        Returns the raw digests of every block from byte offset start onward, concatenated in chain order, and the
+        byte offset the last of them ends at, blocks appended since the segments were listed being left out.
+        A first pass over the headers splits every segment at block boundaries into ranges of about 1/jobs of
+        the bytes to hash; the ranges, which never cross a segment boundary, are then hashed independently
+        in a process pool.
+        """
+        segments = self._storage().segments()
+        size = segments[-1].base + segments[-1].length if segments else 0
+        if size <= start:
+            return b'', start
 
-            # Check if the item has been marked as removed
-            if state in ["DISPOSED", "DESTROYED", "RELEASED"]:
-                if item_id in removed_items:
-                    # Item was removed before, should not appear again
-                    continue  # might log a warning here. I have not implemented this yet though
-                removed_items.add(item_id)
+        #Find block-aligned split points, reading only the data length of each header
+        step = (size - start) / jobs
+        ranges = []  # (segment file, start, stop), offsets local to the file
+        for segment in segments:
+            if segment.base + segment.length <= start:
+                continue
+            offset = max(start - segment.base, 0)
+            range_start = offset
+            threshold = offset + step
+            with open(segment.path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    while offset + self.RECORD_SIZE <= segment.length:
+                        end = offset + self.RECORD_SIZE + struct.unpack_from('I', mm, offset + self.RECORD_SIZE - 4)[0]
+                        if end > segment.length:
+                            break #incomplete when the segments were listed
+                        offset = end
+                        if offset >= threshold and offset < segment.length:
+                            ranges.append((segment.path, range_start, offset))
+                            range_start = offset
+                            threshold = offset + step
+                finally:
+                    mm.close()
+            ranges.append((segment.path, range_start, offset))
+            stop = segment.base + offset
 
-            if item_id in seen_items and item_id in removed_items:
-                # If an item that was previously removed is seen again, return False
-                return False
-            else:
-                seen_items.add(item_id)
+        from concurrent.futures import ProcessPoolExecutor #imported here, it is slow to import and only verify --jobs needs it
+        with ProcessPoolExecutor(max_workers=jobs) as pool, profiling.timer('parallel_hash'):
+            parts = pool.map(hash_range, [r[0] for r in ranges], [r[1] for r in ranges], [r[2] for r in ranges])
+            digests = b''.join(parts)
+        profiling.count('hashes_computed', len(digests) // 32)
+        return digests, stop
 
-        # If the loop completes without finding any items that reappear after removal, return True
-        return True
+    def _checkpoint_matches_chain(self, checkpoint):
+        """
+        Cheap consistency check of a checkpoint: the chain must still reach the checkpointed offset, and the block
+        recorded as its tail must still be there, end at that offset and have the same hash.
+        """
+        file_path = self._file_path()
+        if checkpoint['tail_offset'] is None or self._chain_size(file_path) < checkpoint['offset']:
+            return False
+        record = self._read_raw_record(file_path, checkpoint['tail_offset'])
+        if record is None or checkpoint['tail_offset'] + len(record) != checkpoint['offset']:
+            return False
+        return hashlib.sha256(record).hexdigest() == checkpoint['tail_hash']
 
-    def _verify_add_is_first(self):
+    def _verify_checksums(self, full=False, jobs=1, report=None):
         """
-        Loops through the entire blockchain, checking every new item. If a new item has the status 'CHECKEDIN', then continue. If a new item has any other status, return False.
-        Once the end of the chain has been reached with no returns, return True.
+        Performs verification of the blockchain to check for integrity issues, printing every violation found.
+        Only blocks appended since the last successful verification are checked unless full is True.
+        A report computed elsewhere, such as the verification of an archive, can be passed in to be printed.
+        :return: A tuple containing:
+            - An integer: the number of blocks checked,
+            - A string: error type of the first violation ("NO PARENT", "DUPLICATE PARENT", "IMPROPER REMOVAL", ...) or "CLEAN",
+            - A list of hashes: blocks involved in the first violation.
         """
-        # Use the _read_blocks method to get all blocks
-        blocks = self._read_blocks()
+        if report is None:
+            report = self.verify(full=full, jobs=jobs)
 
-        # Keep track of the item IDs that have been encountered
-        encountered_items = {}
+        print ("Transactions in blockchain:", report.num_blocks)
+        if report.resumed_from:
+            print("Checked since last verification:", report.num_blocks - report.resumed_from)
+        print("State of blockchain:", report.error)
+        for violation in report.violations:
+            print(f"Block {violation.index} - {violation.error}: {violation.hash}")
 
-        for block in blocks:
-            item_id = block['item_id']  # Assuming this gets the item ID correctly
-            state = block['state']
+        error_hashes = []
+        if report.violations:
+            first = report.violations[0]
+            error_hashes = first.related + [first.hash]
+        return report.num_blocks, report.error, error_hashes
 
-            # Check if the item is encountered for the first time
-            if item_id not in encountered_items:
-                # If the item's first state is not 'CHECKEDIN', return False
-                if state != 'CHECKEDIN':
-                    return False
-                encountered_items[item_id] = True
-            # No need to check further if the item has already been encountered
+    def _verify_remove_is_final(self):
+        """
+        Returns False if any item appears again after it has been removed, True otherwise.
+        """
+        return not self.verify([verification.RemoveIsFinalRule()]).violations
 
-        # If the loop completes without encountering any item that violates the rule, return True
-        return True
+    def _verify_add_is_first(self):
+        """
+        Returns False if the first block of any item has a status other than 'CHECKEDIN', True otherwise.
+        """
+        return not self.verify([verification.AddIsFirstRule()]).violations
 
     def _verify_all_released(self):
         """
-        Loops through the blockchain, makes sure that the releases are valid
+        Makes sure that the releases are valid
         """
-        blocks = self._read_blocks()
-        
-        for block in blocks:
-            if block['state'] == "RELEASED" and block['data_length'] <= 0:
-                return False
-            
-        return True
+        return not self.verify([verification.ReleaseHasDataRule()]).violations
     
     def _check_double_check(self):
         """
-        Loops through the entire blockchain. Checks if any item is checked out twice 
-        with no checkins inbetween, and if any item is checked in twice with no checkouts
-        inbetween. Returns false if that does so happen to happen
-        """
-        # Use the _read_blocks method to get all blocks
-        blocks = self._read_blocks()
-
-        # Keep track of the last state for each item
-        last_state = {}
-
-        for block in blocks:
-            item_id = block['item_id']  # Assuming this gets the item ID correctly
-            state = block['state']
-
-            # Check conditions for CHECKEDOUT and CHECKEDIN states
-            if state == 'CHECKEDOUT':
-                if item_id in last_state and last_state[item_id] == 'CHECKEDOUT':
-                    # Item is checked out again without being checked in
-                    return False
-            elif state == 'CHECKEDIN':
-                if item_id in last_state and last_state[item_id] == 'CHECKEDIN':
-                    # Item is checked in again without being checked out
-                    return False
-        
-            # Update the last state for the item
-            last_state[item_id] = state
-
-        # If the loop completes without finding any violations, return True
-        return True
+        Checks if any item is checked out twice with no checkins inbetween, and if any item is
+        checked in twice with no checkouts inbetween. Returns false if that does so happen to happen
+        """
+        return not self.verify([verification.DoubleCheckRule()]).violations
     
     def _unique_parent_check(self):
         """
-        This checks if any block shares a parent with another and reutnrs false if it does
+        This checks if any block shares a parent with another and returns false if it does
         """
-        blocks = self._read_blocks()
-        
-        parents = []
-        
-        for block in blocks:
-            parent = block['previous_hash']
-            
-            if parent in parents:
-                return False
-            else:
-                parent.append(block['previous_hash'])
-                
-        return True
+        violations = self.verify([verification.ParentRule()]).violations
+        return not any(violation.error == "DUPLICATE PARENT" for violation in violations)
 
     def _get_last_block(self):
         """
-        Retrieves the last block from the blockchain file.
+        Retrieves the last block from the blockchain file, using the tracked tail offset.
         """
-        file_path = os.getenv('BCHOC_FILE_PATH', 'default_blockchain_file_path.dat')
-        blocks = self._read_blocks()
-
-        if blocks:
-            return blocks[-1]  # Return the last block if available
-        else:
+        offset = self._get_tail()[0]
+        if offset is None:
             return None  # Return None if the blockchain is empty
+        return self._read_block_at(offset)
 
     def _get_last_hash(self):
         """
-        Calculates hash of the last block, used when a previously created file is read.
+        Returns the hex hash of the last block, used when a previously created file is read.
+        This is the value the next appended block will store as its previous hash.
         """
-        # Use a modified version of _read_blocks method to get the last block only
-        last_block = self._get_last_block()
+        offset, end, tail_hash = self._get_tail()
 
-        if last_block is None:
+        if offset is None:
             return None  # Return None if there are no blocks
-    
-        last_block_hash = self._calculate_block_hash(last_block)
 
-        return last_block_hash
+        return tail_hash.hex()
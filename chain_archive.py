@@ -0,0 +1,361 @@
+"""
+Compact archive format for a verified chain.
+
+A chain record is 144 header bytes plus its data, but most of the header is padding: case_id and item_id are
+32-byte fields of which 16 and 4 bytes are used, creator and owner are always zero, and previous_hash is the hash
+of the block before, which can be recomputed. An archive keeps only what can't be derived, column by column, in
+chunks of up to CHUNK_BLOCKS blocks compressed independently:
+    - timestamp: the raw 8 bytes as an integer, delta-encoded against the block before
+    - case: an index into the chunk's dictionary of distinct case IDs
+    - item: the item ID
+    - state: one byte, an index into STATE_ORDER
+    - data_length / data: the data areas, concatenated
+Blocks whose header doesn't have that canonical shape (a previous hash that isn't the hash of the block before,
+non-zero padding, an unknown state) keep their full raw header as an exception, so every original record, and
+therefore every original block hash, is reproduced byte for byte. Chunks are compressed with zlib, or with zstd
+if the zstandard package is installed and asked for.
+
+File layout:
+    MAGIC, header length (uint32 LE), header JSON: version, codec, byte order of the source chain, the hash the
+        first block links to
+    chunks, each: meta length (uint32 LE), meta JSON (block count, case dictionary, exceptions, column sizes),
+        compressed columns
+    index JSON: block count, chain size, last hash, and per chunk its file offset, block count, logical offset
+        of its first block and hash of its last block
+    TRAILER: index offset, index length, END_MAGIC
+show and verify read an archive directly (ChainArchive), one chunk in memory at a time.
+"""
+import array
+import hashlib
+import json
+import os
+import shutil
+import struct
+import sys
+import zlib
+import verification
+from blockchain import Block, State, CHECKPOINT_SUFFIX, TORN_SUFFIX
+from chain_index import ItemIndex, HistoryIndex, DigestCache
+from chain_lock import ChainLock
+from chain_merkle import MerkleLog
+from chain_segments import SegmentedChain
+
+try:
+    import zstandard
+except ImportError:  # zstd archives are unavailable, zlib ones work without it
+    zstandard = None
+
+MAGIC = b'BCHOCARC'
+END_MAGIC = b'BCHOCEND'
+VERSION = 1
+LENGTH = struct.Struct('<I')
+TRAILER = struct.Struct('<QI8s')  # offset of the index, its length, END_MAGIC
+RECORD_SIZE = 144
+CHUNK_BLOCKS = 1 << 16
+CODECS = ('zlib', 'zstd')
+COLUMNS = (('timestamp', 'Q'), ('case', 'I'), ('item', 'I'), ('state', 'B'), ('data_length', 'I'), ('data', None))
+STATE_ORDER = tuple(state.value for state in State)
+STATE_CODES = {state.ljust(12, '\x00').encode(): code for code, state in enumerate(STATE_ORDER)}
+ZEROS = bytes(32)
+WRITE_BYTES = 4 * 1024 * 1024  # records written per append when an archive is imported
+SIDECARS = (ItemIndex.SUFFIX, HistoryIndex.SUFFIX, HistoryIndex.SUFFIX + "-wal", HistoryIndex.SUFFIX + "-shm",
+            DigestCache.SUFFIX, MerkleLog.SUFFIX, CHECKPOINT_SUFFIX, ".seal.tmp")
+
+
+def _codec(name):
+    """
+    Returns (compress, decompress) functions for a codec name.
+    """
+    if name == 'zlib':
+        return (lambda data: zlib.compress(data, 6)), zlib.decompress
+    if name == 'zstd':
+        if zstandard is None:
+            raise ImportError("zstd archives need the zstandard package, install it with: pip install zstandard")
+        return zstandard.ZstdCompressor(level=9).compress, zstandard.ZstdDecompressor().decompress
+    raise ValueError(f"Unknown codec {name!r}, expected one of {', '.join(CODECS)}")
+
+
+def _to_little_endian(values):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values
+
+
+def export_chain(blockchain, path, codec='zlib', chunk_blocks=CHUNK_BLOCKS):
+    """
+    Writes the chain of the given Blockchain to an archive. The chain must verify CLEAN.
+    :param codec: 'zlib', or 'zstd' if zstandard is installed.
+    :return: dictionary with the blocks archived, the chain size and the archive size in bytes.
+    """
+    compress = _codec(codec)[0]
+    report = blockchain.verify()
+    if report.violations:
+        raise ValueError(f"the chain doesn't verify ({report.error}), only a CLEAN chain can be archived")
+
+    tmp_path = path + ".tmp"
+    chunks = []
+    total = 0
+    size = 0
+    last_hash = None
+    with open(tmp_path, 'wb') as f:
+        header = json.dumps({'version': VERSION, 'codec': codec, 'byteorder': sys.byteorder,
+                             'previous_hash': ZEROS.hex()}).encode()
+        f.write(MAGIC + LENGTH.pack(len(header)) + header)
+
+        writer = _ChunkWriter(ZEROS)
+        for block in blockchain.iter_blocks():
+            writer.add(block.raw)
+            if writer.count == chunk_blocks:
+                chunks.append([f.tell(), writer.count, size, writer.previous.hex()])
+                size += writer.size
+                f.write(writer.finish(compress))
+                writer = _ChunkWriter(writer.previous)
+        if writer.count:
+            chunks.append([f.tell(), writer.count, size, writer.previous.hex()])
+            size += writer.size
+            f.write(writer.finish(compress))
+        total = sum(chunk[1] for chunk in chunks)
+        last_hash = writer.previous.hex() if total else None
+
+        index = json.dumps({'blocks': total, 'bytes': size, 'last_hash': last_hash, 'chunks': chunks}).encode()
+        index_offset = f.tell()
+        f.write(index + TRAILER.pack(index_offset, len(index), END_MAGIC))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return {'blocks': total, 'chain_bytes': size, 'archive_bytes': os.path.getsize(path)}
+
+
+class _ChunkWriter:
+    """
+    Accumulates the columns of one chunk.
+    """
+
+    def __init__(self, previous):
+        self.previous = previous  # raw hash of the last block added, what the next one should link to
+        self.count = 0
+        self.size = 0
+        self.last_timestamp = 0
+        self.cases = {}
+        self.exceptions = []
+        self.columns = {name: array.array(kind) if kind else [] for name, kind in COLUMNS}
+
+    def add(self, raw):
+        order = sys.byteorder
+        timestamp = int.from_bytes(raw[32:40], order)
+        case = raw[40:56]
+        state = STATE_CODES.get(raw[104:116])
+        canonical = raw[0:32] == self.previous and state is not None and raw[56:72] == ZEROS[:16] \
+            and raw[76:104] == ZEROS[:28] and raw[116:140] == ZEROS[:24]
+        if not canonical:
+            self.exceptions.append([self.count, raw[:RECORD_SIZE].hex()])
+
+        columns = self.columns
+        columns['timestamp'].append((timestamp - self.last_timestamp) & 0xFFFFFFFFFFFFFFFF)
+        columns['case'].append(self.cases.setdefault(case, len(self.cases)))
+        columns['item'].append(int.from_bytes(raw[72:76], order))
+        columns['state'].append(state if state is not None else 0)
+        columns['data_length'].append(len(raw) - RECORD_SIZE)
+        columns['data'].append(raw[RECORD_SIZE:])
+        self.last_timestamp = timestamp
+        self.previous = hashlib.sha256(raw).digest()
+        self.count += 1
+        self.size += len(raw)
+
+    def finish(self, compress):
+        blobs = []
+        sizes = []
+        for name, kind in COLUMNS:
+            values = self.columns[name]
+            raw = b''.join(values) if kind is None else _to_little_endian(values).tobytes()
+            blob = compress(raw)
+            blobs.append(blob)
+            sizes.append([name, len(blob), len(raw)])
+        meta = json.dumps({'blocks': self.count, 'cases': [case.hex() for case in self.cases],
+                           'exceptions': self.exceptions, 'columns': sizes}).encode()
+        return LENGTH.pack(len(meta)) + meta + b''.join(blobs)
+
+
+class ChainArchive:
+    """
+    Read access to an archive written by export_chain.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a chain archive")
+            self.header = json.loads(f.read(LENGTH.unpack(f.read(LENGTH.size))[0]).decode())
+            if self.header['version'] != VERSION:
+                raise ValueError(f"unsupported archive version {self.header['version']}")
+            f.seek(-TRAILER.size, os.SEEK_END)
+            index_offset, index_length, magic = TRAILER.unpack(f.read(TRAILER.size))
+            if magic != END_MAGIC:
+                raise ValueError(f"{path} is incomplete: its index is missing")
+            f.seek(index_offset)
+            self.index = json.loads(f.read(index_length).decode())
+        self._decompress = _codec(self.header['codec'])[1]
+
+    def __len__(self):
+        return self.index['blocks']
+
+    def iter_blocks(self, check=False):
+        """
+        Yields every block of the archived chain in order, as Block objects with the offsets they had in the chain
+        and their hash already computed (rebuilding a block's successor needs it anyway). ValueError if a chunk
+        can't be decoded.
+        :param check: also raise ValueError, once its last block has been yielded, for a chunk whose block count
+                      or last hash isn't the one recorded in the index.
+        """
+        previous = bytes.fromhex(self.header['previous_hash'])
+        with open(self.path, 'rb') as f:
+            for offset, count, first_offset, last_hash in self.index['chunks']:
+                f.seek(offset)
+                if not check:
+                    yield from self._read_chunk(f, first_offset, previous)
+                else:
+                    block, blocks = None, 0
+                    for block in self._read_chunk(f, first_offset, previous):
+                        blocks += 1
+                        yield block
+                    if blocks != count or block is None or block.hash != last_hash:
+                        raise ValueError(f"the chunk at block offset {first_offset} doesn't match the archive index")
+                previous = bytes.fromhex(last_hash) #a damaged chunk doesn't change how the next one is rebuilt
+
+    def _read_chunk(self, f, offset, previous):
+        order = self.header['byteorder']
+        meta = json.loads(f.read(LENGTH.unpack(f.read(LENGTH.size))[0]).decode())
+        columns = {}
+        for (name, kind), (stored_name, length, raw_length) in zip(COLUMNS, meta['columns']):
+            try:
+                raw = self._decompress(f.read(length))
+            except Exception as e: #zlib.error, zstd.ZstdError
+                raise ValueError(f"damaged {name} column in the chunk at block offset {offset}: {e}") from None
+            if len(raw) != raw_length:
+                raise ValueError(f"damaged {name} column in the chunk at block offset {offset}")
+            if kind is None:
+                columns[name] = raw
+            else:
+                values = array.array(kind)
+                values.frombytes(raw)
+                columns[name] = _to_little_endian(values)
+
+        cases = [bytes.fromhex(case) + ZEROS[:16] for case in meta['cases']]
+        states = [state.ljust(12, '\x00').encode() for state in STATE_ORDER]
+        exceptions = {index: bytes.fromhex(header) for index, header in meta['exceptions']}
+        timestamps, case_index, items = columns['timestamp'], columns['case'], columns['item']
+        state_codes, lengths, data = columns['state'], columns['data_length'], columns['data']
+        padding = ZEROS[:24]
+        timestamp = 0
+        position = 0
+        for i in range(meta['blocks']):
+            timestamp = (timestamp + timestamps[i]) & 0xFFFFFFFFFFFFFFFF
+            length = lengths[i]
+            header = exceptions.get(i)
+            if header is None:
+                header = previous + timestamp.to_bytes(8, order) + cases[case_index[i]] \
+                    + items[i].to_bytes(4, order) + ZEROS[:28] + states[state_codes[i]] + padding \
+                    + length.to_bytes(4, order)
+            raw = header + data[position:position + length]
+            block = Block(raw, offset)
+            digest = hashlib.sha256(raw).digest()
+            block['hash'] = digest.hex()
+            yield block
+            previous = digest
+            position += length
+            offset += len(raw)
+
+    def verify(self):
+        """
+        Runs the built-in integrity rules over the archived chain, and checks the hash of the last block of every
+        chunk against the one recorded when it was archived. Since the blocks link by recomputed hashes, a change
+        anywhere in a chunk shows up as a HASH MISMATCH at its last block. A chunk that can't be decoded at all
+        ends the run with a BAD ARCHIVE CHUNK violation carrying the recorded hash of its last block.
+        :return: a verification.VerificationReport.
+        """
+        expected = {}
+        chunk_hashes = {}  # index of the first block of every chunk -> recorded hash of its last block
+        first = 0
+        for offset, count, first_offset, last_hash in self.index['chunks']:
+            chunk_hashes[first] = last_hash
+            first += count
+            expected[first - 1] = last_hash
+        rules = [verification.ArchiveRule(expected)] + verification.default_rules()
+        report = verification.VerificationReport()
+        damaged = []
+        verification.run_rules(self._readable_blocks(damaged), rules, report)
+        if damaged:
+            #Chunks are decoded whole before their first block is yielded, so the damaged one starts at num_blocks
+            report.add(report.num_blocks, chunk_hashes.get(report.num_blocks), "BAD ARCHIVE CHUNK", damaged)
+        return report
+
+    def _readable_blocks(self, damaged):
+        """
+        Yields the blocks of the archive up to the first chunk that can't be decoded, whose error is added to damaged.
+        """
+        try:
+            yield from self.iter_blocks()
+        except (ValueError, KeyError, IndexError, OverflowError) as e:
+            damaged.append(str(e))
+
+
+def import_archive(path, chain_path):
+    """
+    Expands an archive into a new chain at chain_path, which must not exist yet, along with its digest cache.
+    Index files left at chain_path by an earlier chain are removed first; the other indexes are built on first use.
+    Every chunk is checked against the archive index as it is written, and if anything fails the partial chain is
+    removed again, so a damaged archive never leaves a chain behind.
+    :return: the number of blocks written.
+    """
+    archive = ChainArchive(path)
+    storage = SegmentedChain(chain_path)
+    if storage.exists():
+        raise FileExistsError(f"{chain_path} already exists")
+    if archive.header['byteorder'] != sys.byteorder:
+        raise ValueError("the archive was written on a machine with a different byte order than this one")
+
+    with ChainLock(chain_path):
+        _remove_chain(chain_path)
+        try:
+            written = _write_blocks(archive, storage, DigestCache(chain_path, storage))
+            if written != len(archive):
+                raise ValueError(f"the archive holds {written} blocks, its index says {len(archive)}")
+        except BaseException as e:
+            _remove_chain(chain_path)
+            if isinstance(e, (KeyError, IndexError, OverflowError, struct.error)): #undecodable chunk metadata
+                raise ValueError(f"damaged archive: {e!r}") from None
+            raise
+    return written
+
+
+def _write_blocks(archive, storage, digests):
+    written = 0
+    buffer, entries, size, start = [], [], 0, 0
+    for block in archive.iter_blocks(check=True):
+        entries.append((block.offset, block.offset + len(block.raw), bytes.fromhex(block.hash)))
+        buffer.append(block.raw)
+        size += len(block.raw)
+        written += 1
+        if size >= min(WRITE_BYTES, storage.segment_size // 4):
+            storage.append(b''.join(buffer), start)
+            digests.record_many(entries)
+            buffer, entries, start, size = [], [], start + size, 0
+    if buffer:
+        storage.append(b''.join(buffer), start)
+        digests.record_many(entries)
+    return written
+
+
+def _remove_chain(chain_path):
+    """
+    Removes a chain file, its segments, its index files and the torn tails cut off it (but not its lock file).
+    """
+    shutil.rmtree(chain_path + SegmentedChain.DIRECTORY_SUFFIX, ignore_errors=True)
+    directory, name = os.path.split(os.path.abspath(chain_path))
+    torn = [os.path.join(directory, other) for other in os.listdir(directory) if other.startswith(name + TORN_SUFFIX + "-")]
+    for path in [chain_path] + [chain_path + suffix for suffix in SIDECARS] + torn:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,511 @@
+import hashlib
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+
+
+class ItemIndex:
+    """
+    On-disk index of the latest block for every item in the chain.
+    The index lives next to the chain file (BCHOC_FILE_PATH + ".idx") as an append-only journal,
+    one line per block appended to the chain:
+        offset end item_id state case_id
+    where offset/end are the byte range of the block in the chain file and case_id is a hex string.
+    Later lines supersede earlier ones for the same item, so loading the journal leaves each item
+    mapped to (latest state, file offset, case_id). The largest end seen is the chain size the index covers.
+    """
+
+    SUFFIX = ".idx"
+
+    def __init__(self, chain_path):
+        self.chain_path = chain_path
+        self.path = chain_path + self.SUFFIX
+        self.items = {}  # item_id -> (state, offset, case_id)
+        self.tail_offset = None  # offset of the last block covered by the index
+        self.chain_size = 0  # number of chain bytes covered by the index
+        self.lines = 0  # number of journal lines, used to decide when to compact
+        self.position = 0  # journal bytes already applied, see refresh
+        self.inode = None  # identity of the journal file that position refers to
+
+    def load(self):
+        """
+        Reads the journal from disk.
+        :return: True if a well-formed journal was loaded, False if it is missing or damaged.
+        """
+        self.items = {}
+        self.tail_offset = None
+        self.chain_size = 0
+        self.lines = 0
+        self.position = 0
+        self.inode = None
+        return self._read_from(0)
+
+    def refresh(self):
+        """
+        Applies journal lines written by other processes since the last load or refresh.
+        Falls back to a full load if the journal was compacted (replaced) in the meantime.
+        :return: True if the index is usable, False if the journal is missing or damaged.
+        """
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        if stat.st_ino != self.inode or stat.st_size < self.position:
+            return self.load()
+        return self._read_from(self.position)
+
+    def _read_from(self, position):
+        try:
+            with open(self.path, 'rb') as f:
+                self.inode = os.fstat(f.fileno()).st_ino
+                f.seek(position)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break # a line still being written, pick it up next time
+                    offset, end, item_id, state, case_id = line.decode().split()
+                    self._apply(int(offset), int(end), int(item_id), state, case_id)
+                    self.lines += 1
+                    position += len(line)
+        except FileNotFoundError:
+            return False
+        except ValueError:
+            # A torn or hand-edited line means the journal can't be trusted
+            return False
+        self.position = position
+        return True
+
+    def _apply(self, offset, end, item_id, state, case_id):
+        self.items[item_id] = (state, offset, case_id)
+        if end > self.chain_size:
+            self.chain_size = end
+            self.tail_offset = offset
+
+    def record(self, offset, end, item_id, state, case_id):
+        """
+        Records a newly appended block both in memory and in the journal.
+        """
+        self.record_many([(offset, end, item_id, state, case_id)])
+
+    def record_many(self, entries):
+        """
+        Records a batch of newly appended blocks with a single journal write.
+        :param entries: list of (offset, end, item_id, state, case_id) tuples in chain order.
+        """
+        lines = []
+        for offset, end, item_id, state, case_id in entries:
+            self._apply(offset, end, item_id, state, case_id)
+            lines.append(f"{offset} {end} {item_id} {state} {case_id}\n")
+        with open(self.path, 'ab') as f:
+            f.write(''.join(lines).encode())
+            self.position = f.tell()
+        self.lines += len(lines)
+
+        # Superseded lines only slow down loading, so rewrite the journal once they dominate it
+        if self.lines > 2 * len(self.items) + 1024:
+            self.compact()
+
+    def extend(self, entries, chain_size):
+        """
+        Appends the journal lines of newly appended blocks without loading the journal, so writers that never
+        load the index still keep it current. The lines are only written if the journal covers exactly chain_size
+        bytes (the chain size before the blocks were appended), which the end of its last line tells; a journal
+        that is missing, behind, ahead or ends in a torn line is left alone, to catch up or be rebuilt when it is
+        next loaded. The caller must hold the chain lock.
+        :param entries: list of (offset, end, item_id, state, case_id) tuples in chain order.
+        :return: True if the lines were written.
+        """
+        try:
+            with open(self.path, 'r+b') as f:
+                size = f.seek(0, os.SEEK_END)
+                f.seek(max(0, size - 512)) #far longer than one line
+                tail = f.read()
+                if tail and not tail.endswith(b"\n"):
+                    return False
+                try:
+                    covered = int(tail.splitlines()[-1].split()[1]) if tail else 0
+                except (ValueError, IndexError):
+                    return False
+                if covered != chain_size:
+                    return False
+                f.write(''.join(f"{offset} {end} {item_id} {state} {case_id}\n"
+                                for offset, end, item_id, state, case_id in entries).encode())
+        except FileNotFoundError:
+            return False
+        return True
+
+    def rebuild(self, records):
+        """
+        Recreates the index from scratch.
+        :param records: iterable of (offset, end, item_id, state, case_id) tuples in chain order.
+        """
+        self.items = {}
+        self.tail_offset = None
+        self.chain_size = 0
+        for offset, end, item_id, state, case_id in records:
+            self._apply(offset, end, item_id, state, case_id)
+        self.compact()
+
+    def compact(self):
+        """
+        Rewrites the journal with one line per item. The tail block is written last so that
+        it is still the largest end after reloading.
+        """
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, 'w') as f:
+            for item_id, (state, offset, case_id) in sorted(self.items.items(), key=lambda kv: kv[1][1]):
+                end = self.chain_size if offset == self.tail_offset else offset
+                f.write(f"{offset} {end} {item_id} {state} {case_id}\n")
+        os.replace(tmp_path, self.path)
+        self.lines = len(self.items)
+        self.position = os.path.getsize(self.path)
+        self.inode = os.stat(self.path).st_ino
+
+    @staticmethod
+    def entry(block):
+        """
+        Converts a Block into the (offset, end, item_id, state, case_id) tuple the index records.
+        """
+        return (block.offset, block.offset + len(block.raw), block.item_id, block.state, block.case_id)
+
+    def matches_tail(self, block):
+        """
+        True if the index's tail is the given block: the latest block of its item, with the same state.
+        """
+        entry = self.items.get(block.item_id)
+        return entry is not None and entry[0] == block.state and entry[1] == self.tail_offset
+
+    def get(self, item_id):
+        """
+        Returns (state, offset, case_id) of the latest block for item_id, or None if the item is unknown.
+        """
+        return self.items.get(item_id)
+
+    def state(self, item_id):
+        """
+        Returns the latest state of item_id, or None if the item is unknown.
+        """
+        entry = self.items.get(item_id)
+        return entry[0] if entry else None
+
+
+class HistoryIndex:
+    """
+    Secondary indexes over every block of the chain, kept in an SQLite database next to the chain file
+    (BCHOC_FILE_PATH + ".db"):
+        - case_id -> set of item_ids registered under the case
+        - item_id -> offsets of all of its blocks, in chain order
+    Lookups go through SQLite's B-tree indexes, so they only touch the rows they return and don't depend
+    on the total length of the chain. Like ItemIndex it records the chain size it covers, so it can be
+    checked against the chain, caught up or rebuilt.
+    """
+
+    SUFFIX = ".db"
+
+    def __init__(self, chain_path):
+        self.chain_path = chain_path
+        self.path = chain_path + self.SUFFIX
+        self.db = None
+        self.chain_size = 0
+        self.tail_offset = None
+        self._mutex = threading.Lock()  # the daemon shares one connection between threads
+
+    def _connect(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS blocks (offset INTEGER PRIMARY KEY, end INTEGER, item_id INTEGER, state TEXT, case_id TEXT)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS blocks_item ON blocks (item_id, offset)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS blocks_case ON blocks (case_id, item_id)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+            self.db.commit()
+        return self.db
+
+    def _query(self, sql, params=()):
+        with self._mutex:
+            return self._connect().execute(sql, params).fetchall()
+
+    def refresh(self):
+        """
+        Re-reads the covered chain size and tail, which other processes may have moved.
+        :return: True if the database is usable, False if it is damaged.
+        """
+        try:
+            row = self._query("SELECT offset, end FROM blocks ORDER BY offset DESC LIMIT 1")
+        except sqlite3.DatabaseError:
+            return False
+        row = row[0] if row else None
+        self.tail_offset, self.chain_size = row if row else (None, 0)
+        return True
+
+    def record_many(self, entries):
+        """
+        Records a batch of newly appended blocks in one SQLite transaction.
+        :param entries: list of (offset, end, item_id, state, case_id) tuples in chain order.
+        """
+        with self._mutex:
+            db = self._connect()
+            with db:
+                db.executemany("INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?)", entries)
+        if entries:
+            self.tail_offset, self.chain_size = entries[-1][0], entries[-1][1]
+
+    def rebuild(self, records):
+        """
+        Recreates the database from scratch.
+        :param records: iterable of (offset, end, item_id, state, case_id) tuples in chain order.
+        """
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.remove(self.path + suffix)
+        self.tail_offset = None
+        self.chain_size = 0
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= 10000:
+                self.record_many(batch)
+                batch = []
+        self.record_many(batch)
+
+    entry = staticmethod(ItemIndex.entry)
+
+    def matches_tail(self, block):
+        """
+        True if the index's tail block has the same item and state as the given block.
+        """
+        rows = self._query("SELECT item_id, state FROM blocks WHERE offset = ?", (self.tail_offset,))
+        return bool(rows) and tuple(rows[0]) == (block.item_id, block.state)
+
+    def cases(self):
+        """
+        Returns every case_id (hex string) in the chain, sorted.
+        """
+        return [row[0] for row in self._query("SELECT DISTINCT case_id FROM blocks WHERE state <> 'INITIAL' ORDER BY case_id")]
+
+    def items(self, case_id):
+        """
+        Returns the item_ids registered under a case, sorted.
+        """
+        query = "SELECT DISTINCT item_id FROM blocks WHERE case_id = ? ORDER BY item_id"
+        return [row[0] for row in self._query(query, (case_id,))]
+
+    def history(self, item_id):
+        """
+        Returns the byte offsets of every block of an item, in chain order.
+        """
+        query = "SELECT offset FROM blocks WHERE item_id = ? ORDER BY offset"
+        return [row[0] for row in self._query(query, (item_id,))]
+
+    def get(self, item_id):
+        """
+        Returns (state, offset, case_id) of the item's latest block, like ItemIndex.get, or None if it is unknown.
+        """
+        query = "SELECT state, offset, case_id FROM blocks WHERE item_id = ? ORDER BY offset DESC LIMIT 1"
+        rows = self._query(query, (item_id,))
+        return tuple(rows[0]) if rows else None
+
+
+class DigestCache:
+    """
+    Raw SHA-256 digest of every block, keyed by its byte offset, in BCHOC_FILE_PATH + ".digests".
+    Entries are fixed-size (offset, digest) pairs appended in chain order, so a lookup is a binary search over
+    the file and the last entry is the tail. Digests are written when blocks are appended (the writer computes
+    them anyway to link the next block) and let the tail be recovered and blocks be cross-checked without
+    re-hashing the chain.
+    """
+
+    SUFFIX = ".digests"
+    ENTRY = struct.Struct('<Q32s')
+
+    def __init__(self, chain_path, chain):
+        self.chain_path = chain_path
+        self.chain = chain  # SegmentedChain the blocks are read from
+        self.path = chain_path + self.SUFFIX
+        self.chain_size = 0  # number of chain bytes covered
+        self.tail_offset = None
+        self.tail_digest = None
+
+    @staticmethod
+    def entry(block):
+        """
+        Converts a Block into the (offset, end, digest) tuple the cache records.
+        """
+        return (block.offset, block.offset + len(block.raw), bytes.fromhex(block.hash))
+
+    def refresh(self):
+        """
+        Re-reads the last entry, which other processes may have appended, and checks it against the chain:
+        the record at that offset must still hash to the cached digest. The chain size the cache covers is
+        the end of that record.
+        :return: True if the cache is usable, False if it is missing, damaged or doesn't match the chain.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size % self.ENTRY.size:
+                    return False #torn entry
+                if size == 0:
+                    self.chain_size, self.tail_offset, self.tail_digest = 0, None, None
+                    return True
+                f.seek(size - self.ENTRY.size)
+                offset, digest = self.ENTRY.unpack(f.read(self.ENTRY.size))
+        except FileNotFoundError:
+            return False
+        record = self.chain.read_record(offset)
+        if record is None or hashlib.sha256(record).digest() != digest:
+            return False
+        self.tail_offset, self.tail_digest = offset, digest
+        self.chain_size = offset + len(record)
+        return True
+
+    def record_many(self, entries):
+        """
+        Appends the digests of a batch of newly appended blocks.
+        :param entries: list of (offset, end, digest) tuples in chain order.
+        """
+        if not entries:
+            return
+        with open(self.path, 'ab') as f:
+            f.write(b''.join(self.ENTRY.pack(offset, digest) for offset, end, digest in entries))
+        self.tail_offset, self.chain_size, self.tail_digest = entries[-1]
+
+    def rebuild(self, records):
+        """
+        Recreates the cache from scratch.
+        :param records: iterable of (offset, end, digest) tuples in chain order.
+        """
+        tmp_path = self.path + ".tmp"
+        last = (None, 0, None)
+        with open(tmp_path, 'wb') as f:
+            for record in records:
+                f.write(self.ENTRY.pack(record[0], record[2]))
+                last = record
+        os.replace(tmp_path, self.path)
+        self.tail_offset, self.chain_size, self.tail_digest = last
+
+    def matches_tail(self, block):
+        """
+        True if the cached tail digest is the digest of the given block.
+        """
+        return self.tail_offset == block.offset and self.tail_digest == bytes.fromhex(block.hash)
+
+    def tail_entries(self, count):
+        """
+        Returns the last count (offset, digest) entries of the file in chain order, ignoring a torn entry at its end.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                size -= size % self.ENTRY.size
+                first = max(0, size - count * self.ENTRY.size)
+                f.seek(first)
+                data = f.read(size - first)
+        except FileNotFoundError:
+            return []
+        return list(self.ENTRY.iter_unpack(data))
+
+    def truncate(self, offset):
+        """
+        Drops the entries of blocks at or after the given byte offset, and a torn entry at the end of the file.
+        """
+        try:
+            with open(self.path, 'r+b') as f:
+                size = os.fstat(f.fileno()).st_size
+                count = size // self.ENTRY.size
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if count else None
+                try:
+                    keep = self._search(mm, count, offset) if count else 0
+                finally:
+                    if mm is not None:
+                        mm.close()
+                if keep * self.ENTRY.size != size:
+                    f.truncate(keep * self.ENTRY.size)
+        except FileNotFoundError:
+            return
+        if self.tail_offset is not None and self.tail_offset >= offset:
+            self.chain_size, self.tail_offset, self.tail_digest = 0, None, None #re-read by the next refresh
+
+    def iter_from(self, offset=0):
+        """
+        Yields (offset, digest) for every cached block at or after the given byte offset, in chain order.
+        Reads the file as it is, without synchronizing it with the chain first.
+        """
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            count = os.fstat(f.fileno()).st_size // self.ENTRY.size
+            if count == 0:
+                return
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                i = self._search(mm, count, offset)
+                while i < count:
+                    yield self.ENTRY.unpack_from(mm, i * self.ENTRY.size)
+                    i += 1
+            finally:
+                mm.close()
+
+    def lookup(self, offset):
+        """
+        Returns the digest of the block at the given byte offset, or None if it isn't cached.
+        """
+        for found, digest in self.iter_from(offset):
+            return digest if found == offset else None
+        return None
+
+    def count(self):
+        """
+        Number of complete entries in the file, i.e. of blocks cached.
+        """
+        try:
+            return os.path.getsize(self.path) // self.ENTRY.size
+        except FileNotFoundError:
+            return 0
+
+    def entries(self, first=0, stop=None):
+        """
+        Returns the (offset, digest) entries from position first up to stop (the block index in the chain).
+        """
+        stop = self.count() if stop is None else stop
+        if stop <= first:
+            return []
+        with open(self.path, 'rb') as f:
+            f.seek(first * self.ENTRY.size)
+            return list(self.ENTRY.iter_unpack(f.read((stop - first) * self.ENTRY.size)))
+
+    def position(self, offset):
+        """
+        Returns the position in the chain (block index) of the block at the given byte offset, or None if it isn't cached.
+        """
+        count = self.count()
+        if count == 0:
+            return None
+        with open(self.path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                i = self._search(mm, count, offset)
+                found = i < count and struct.unpack_from('<Q', mm, i * self.ENTRY.size)[0] == offset
+            finally:
+                mm.close()
+        return i if found else None
+
+    def _search(self, mm, count, offset):
+        """
+        Index of the first entry whose block offset is >= offset.
+        """
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            if struct.unpack_from('<Q', mm, middle * self.ENTRY.size)[0] < offset:
+                low = middle + 1
+            else:
+                high = middle
+        return low
@@ -0,0 +1,115 @@
+import os
+import threading
+import time
+import profiling
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+
+class LockTimeout(Exception):
+    """
+    Raised when the chain lock couldn't be acquired within the configured timeout.
+    """
+
+
+class ChainLock:
+    """
+    Advisory lock serializing writers of one chain file, across processes (fcntl.flock on
+    BCHOC_FILE_PATH + ".lock") and across threads of this process. The lock is reentrant for the
+    thread holding it, so code already inside a transaction can call helpers that lock again.
+    Waiting is bounded: acquire() polls with a growing back-off and raises LockTimeout after timeout seconds.
+    Contention is counted in stats:
+        - acquired: number of times the lock was taken
+        - contended: how many of those had to wait for another holder
+        - timeouts: number of acquire() calls that gave up
+        - wait_total / wait_max: seconds spent waiting, in total and for the longest single wait
+    """
+
+    SUFFIX = ".lock"
+
+    def __init__(self, chain_path, timeout=None):
+        self.path = chain_path + self.SUFFIX
+        if timeout is None:
+            timeout = float(os.getenv("BCHOC_LOCK_TIMEOUT", "10"))
+        self.timeout = timeout
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._owner = None  # thread ident of the holder
+        self._fd = None
+        self._held_since = None  # when the lock was taken, for the hold time histogram
+        self.stats = {'acquired': 0, 'contended': 0, 'timeouts': 0, 'wait_total': 0.0, 'wait_max': 0.0}
+
+    def acquire(self):
+        began = time.monotonic()
+        if not self._thread_lock.acquire(blocking=False):
+            self.stats['contended'] += 1 #another thread of this process is writing
+            if not self._thread_lock.acquire(timeout=self.timeout):
+                self.stats['timeouts'] += 1
+                raise LockTimeout(f"timed out after {self.timeout}s waiting for {self.path}")
+
+        if self._depth == 0:
+            try:
+                self._lock_file(began)
+            except BaseException:
+                self._thread_lock.release()
+                raise
+            self._owner = threading.get_ident()
+            self._held_since = time.monotonic()
+        self._depth += 1
+
+        waited = time.monotonic() - began
+        self.stats['acquired'] += 1
+        self.stats['wait_total'] += waited
+        self.stats['wait_max'] = max(self.stats['wait_max'], waited)
+        profiling.observe('lock_wait', waited)
+
+    def _lock_file(self, began):
+        if fcntl is None:
+            return
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        delay = 0.0005
+        contended = False
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except (BlockingIOError, PermissionError):
+                contended = True
+                if time.monotonic() - began >= self.timeout:
+                    os.close(fd)
+                    self.stats['timeouts'] += 1
+                    raise LockTimeout(f"timed out after {self.timeout}s waiting for {self.path}")
+                time.sleep(delay)
+                delay = min(delay * 2, 0.01)
+        if contended:
+            self.stats['contended'] += 1
+        self._fd = fd
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            self._owner = None
+            profiling.observe('lock_hold', time.monotonic() - self._held_since)
+            if self._fd is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+                os.close(self._fd)
+                self._fd = None
+        self._thread_lock.release()
+
+    @property
+    def held(self):
+        """
+        True if the calling thread currently holds the lock.
+        """
+        return self._owner == threading.get_ident()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
@@ -0,0 +1,292 @@
+"""
+Merkle mountain range over the block digests.
+
+The leaves are the digests of the digest cache, in chain order, so leaf i is block i. A Merkle mountain range is
+a list of perfect binary Merkle trees ("mountains") of decreasing height, one per bit set in the number of leaves.
+Appending a leaf adds at most log2(n) nodes and never changes an existing one, so the tree is extended in place
+on every append, and the tree of any prefix of the chain is a prefix of the node file. Nodes are hashed with
+domain separation (RFC 6962 style): leaves as SHA-256(0x00 || digest), inner nodes as SHA-256(0x01 || left || right).
+The root commits to the number of leaves and every mountain peak: SHA-256(0x02 || leaves || bagged peaks), the
+peaks being folded from the right with the inner node hash.
+
+An inclusion proof for one block is its record, the siblings on the path up to its mountain's peak and the
+peaks, which is O(log n) hashes; verify_proof() checks it without access to the chain. Two copies of a chain
+are compared by their roots, and where they differ, the first block they disagree on is found by a binary
+search over prefix roots, each computed from O(log n) stored nodes.
+"""
+import hashlib
+import itertools
+import os
+import struct
+
+NODE_SIZE = 32
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+ROOT_PREFIX = b'\x02'
+SYNC_LEAVES = 65536  # digests read from the cache at a time when catching up
+
+
+def leaf_hash(digest):
+    return hashlib.sha256(LEAF_PREFIX + digest).digest()
+
+
+def node_hash(left, right):
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+def mmr_size(leaves):
+    """
+    Number of nodes of a mountain range with the given number of leaves.
+    """
+    return 2 * leaves - bin(leaves).count('1')
+
+
+def leaves_for_size(size):
+    """
+    Largest number of leaves whose mountain range has at most size nodes.
+    """
+    low, high = 0, size
+    while low < high:
+        middle = (low + high + 1) // 2
+        if mmr_size(middle) <= size:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def mountains(leaves):
+    """
+    Yields (height, position of the peak, index of the first leaf) of every mountain, highest first.
+    """
+    position = 0
+    first = 0
+    for height in range(leaves.bit_length() - 1, -1, -1):
+        if leaves >> height & 1:
+            position += (1 << (height + 1)) - 1
+            yield height, position - 1, first
+            first += 1 << height
+
+
+def bag(leaves, peaks):
+    """
+    Root of a mountain range from its number of leaves and its peak hashes, highest mountain first.
+    """
+    if not peaks:
+        return hashlib.sha256(ROOT_PREFIX + struct.pack('<Q', 0)).digest()
+    bagged = peaks[-1]
+    for peak in reversed(peaks[:-1]):
+        bagged = node_hash(peak, bagged)
+    return hashlib.sha256(ROOT_PREFIX + struct.pack('<Q', leaves) + bagged).digest()
+
+
+class MerkleLog:
+    """
+    The mountain range of a chain, stored in BCHOC_FILE_PATH + ".mmr" as a flat array of 32-byte nodes in the order
+    they were created (each leaf followed by the parents it completes). It follows the digest cache: sync() adds
+    the leaves of blocks appended since it was last updated and rebuilds the file if it no longer matches the cache.
+    """
+
+    SUFFIX = ".mmr"
+
+    def __init__(self, chain_path):
+        self.chain_path = chain_path
+        self.path = chain_path + self.SUFFIX
+        self.leaves = 0
+        self.peaks = []  # (height, hash) of every mountain, highest first
+
+    def load(self):
+        """
+        Reads the number of leaves and the peaks from the node file, cutting off nodes a crash left incomplete.
+        """
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            size = 0
+        self.leaves = leaves_for_size(size // NODE_SIZE)
+        if size != mmr_size(self.leaves) * NODE_SIZE:
+            with open(self.path, 'r+b') as f:
+                f.truncate(mmr_size(self.leaves) * NODE_SIZE)
+        self.peaks = [(height, node) for (height, position, first), node in
+                      zip(mountains(self.leaves), self.nodes([p for h, p, f in mountains(self.leaves)]))]
+
+    def nodes(self, positions):
+        """
+        Reads the nodes at the given positions.
+        """
+        if not positions:
+            return []
+        with open(self.path, 'rb') as f:
+            found = []
+            for position in positions:
+                f.seek(position * NODE_SIZE)
+                found.append(f.read(NODE_SIZE))
+            return found
+
+    def sync(self, cache):
+        """
+        Brings the tree up to date with a DigestCache that is synchronized with the chain. The caller must hold the
+        chain lock. Leaves for blocks the cache no longer has (a torn tail was cut) are dropped; the remaining ones
+        are trusted if the last is the leaf of the cache's digest for that block, and the tree is rebuilt otherwise.
+        """
+        self.load()
+        count = cache.count()
+        if self.leaves > count:
+            self.truncate(count)
+        if self.leaves:
+            last = cache.entries(self.leaves - 1, self.leaves)
+            if self.nodes([mmr_size(self.leaves - 1)])[0] != leaf_hash(last[0][1]):
+                self.truncate(0)
+        for first in range(self.leaves, count, SYNC_LEAVES):
+            self.append([digest for offset, digest in cache.entries(first, min(first + SYNC_LEAVES, count))])
+
+    def truncate(self, leaves):
+        """
+        Drops every leaf from the given one on.
+        """
+        with open(self.path, 'ab') as f:
+            f.truncate(mmr_size(leaves) * NODE_SIZE)
+        self.load()
+
+    def append(self, digests):
+        """
+        Adds the leaves of newly appended blocks, given their raw digests in chain order, with one write.
+        """
+        if not digests:
+            return
+        nodes = []
+        peaks = self.peaks
+        for digest in digests:
+            node = leaf_hash(digest)
+            nodes.append(node)
+            height = 0
+            while peaks and peaks[-1][0] == height:
+                node = node_hash(peaks.pop()[1], node)
+                nodes.append(node)
+                height += 1
+            peaks.append((height, node))
+        self._write(b''.join(nodes))
+        self.leaves += len(digests)
+
+    def _write(self, nodes):
+        with open(self.path, 'ab') as f:
+            f.write(nodes)
+
+    def root(self, leaves=None):
+        """
+        Root of the tree of the first leaves blocks (the whole chain by default).
+        """
+        if leaves is None or leaves == self.leaves:
+            return bag(self.leaves, [peak for height, peak in self.peaks])
+        if leaves > self.leaves:
+            raise ValueError(f"the chain only has {self.leaves} blocks")
+        return bag(leaves, self.nodes([position for height, position, first in mountains(leaves)]))
+
+    def proof(self, index, leaves=None):
+        """
+        Returns the inclusion proof of block index in the tree of the first leaves blocks:
+            - path: [side, hash] of every sibling from the leaf up to its mountain's peak, side being 'L' if the
+              sibling is on the left
+            - peaks: every peak hash, highest mountain first, and mountain: which of them the block is under
+        """
+        leaves = self.leaves if leaves is None else leaves
+        if not 0 <= index < leaves <= self.leaves:
+            raise ValueError(f"block {index} is not in a chain of {leaves} blocks")
+        peaks = list(mountains(leaves))
+        for mountain, (height, peak, first) in enumerate(peaks):
+            if first <= index < first + (1 << height):
+                break
+        #Walk down from the peak; in post-order the children of node p at height h are p - 2**h and p - 1
+        siblings = []
+        position = peak
+        leaf = index - first
+        while height > 0:
+            half = 1 << (height - 1)
+            left, right = position - (1 << height), position - 1
+            if leaf < half:
+                siblings.append(('R', right))
+                position = left
+            else:
+                siblings.append(('L', left))
+                position = right
+                leaf -= half
+            height -= 1
+        siblings.reverse()
+        hashes = self.nodes([position for side, position in siblings] + [p for h, p, f in peaks])
+        return {
+            'leaves': leaves,
+            'index': index,
+            'path': [[side, node.hex()] for (side, position), node in zip(siblings, hashes)],
+            'peaks': [node.hex() for node in hashes[len(siblings):]],
+            'mountain': mountain,
+            'root': bag(leaves, hashes[len(siblings):]).hex(),
+        }
+
+
+class MerkleTree(MerkleLog):
+    """
+    A mountain range kept in memory, built from a sequence of digests. Used to hash a chain's records again, and
+    for a chain whose files must not be written, such as the other copy 'merkle compare' reads.
+    """
+
+    def __init__(self, digests=()):
+        super().__init__("")
+        self.path = None
+        self._nodes = bytearray()
+        digests = iter(digests)
+        while True:
+            chunk = list(itertools.islice(digests, SYNC_LEAVES))
+            if not chunk:
+                break
+            self.append(chunk)
+
+    def nodes(self, positions):
+        return [bytes(self._nodes[position * NODE_SIZE:(position + 1) * NODE_SIZE]) for position in positions]
+
+    def _write(self, nodes):
+        self._nodes += nodes
+
+
+def verify_proof(proof):
+    """
+    Checks an inclusion proof on its own: the record must hash to a leaf that, combined with the path, gives the
+    peak of its mountain, and the peaks must bag to the root. Which mountain the block is under and the side of
+    every sibling follow from its index and the number of leaves, so a proof only holds for the index it claims.
+    :param proof: dictionary as produced by MerkleLog.proof, plus 'record', the raw record as hex.
+    :return: True if the proof is valid.
+    """
+    index, leaves = proof['index'], proof['leaves']
+    if not isinstance(index, int) or not isinstance(leaves, int) or not 0 <= index < leaves:
+        return False
+    for mountain, (height, peak, first) in enumerate(mountains(leaves)):
+        if first <= index < first + (1 << height):
+            break
+    #Bit j of the leaf's position in its mountain says whether its ancestor at height j is a right child
+    sides = ['L' if (index - first) >> level & 1 else 'R' for level in range(height)]
+    if proof['mountain'] != mountain or [side for side, sibling in proof['path']] != sides:
+        return False
+    node = leaf_hash(hashlib.sha256(bytes.fromhex(proof['record'])).digest())
+    for side, sibling in proof['path']:
+        node = node_hash(bytes.fromhex(sibling), node) if side == 'L' else node_hash(node, bytes.fromhex(sibling))
+    peaks = [bytes.fromhex(peak) for peak in proof['peaks']]
+    if len(peaks) != bin(leaves).count('1') or peaks[mountain] != node:
+        return False
+    return bag(leaves, peaks).hex() == proof['root']
+
+
+def first_divergence(left, right):
+    """
+    Compares two trees. Returns None if one chain is a prefix of the other (or they are equal), otherwise the
+    index of the first block they disagree on, found by a binary search over the roots of their common prefixes.
+    """
+    common = min(left.leaves, right.leaves)
+    if left.root(common) == right.root(common):
+        return None
+    low, high = 0, common  # the prefixes of low blocks agree, those of high blocks don't
+    while high - low > 1:
+        middle = (low + high) // 2
+        if left.root(middle) == right.root(middle):
+            low = middle
+        else:
+            high = middle
+    return high - 1
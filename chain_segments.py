@@ -0,0 +1,422 @@
+import atexit
+import hashlib
+import json
+import os
+import struct
+import sys
+import threading
+import time
+from collections import namedtuple
+import profiling
+
+RECORD_SIZE = 144
+DURABILITY_LEVELS = ('block', 'batch', 'time')
+FOOTER_MAGIC = b'BCHOCSEG'
+TRAILER = struct.Struct('<QI8s')  # bytes of blocks in the segment, length of the JSON footer before it, magic
+
+# One file of the chain.
+#   - path: the segment file
+#   - base: logical offset of its first block, i.e. the bytes of blocks in every segment before it
+#   - length: bytes of blocks in the file (a sealed segment's footer comes after them)
+#   - sealed: True for every file except the active segment at BCHOC_FILE_PATH
+# The footer of a sealed segment is only parsed when asked for, see SegmentedChain.footer.
+Segment = namedtuple('Segment', ['path', 'base', 'length', 'sealed'])
+
+
+class SegmentedChain:
+    """
+    The chain stored as size-bounded segment files. Blocks are appended to the active segment, which is the file
+    at BCHOC_FILE_PATH; once appending a batch would grow it past the segment size, it is sealed first: a footer
+    with its block count, first and last hash and the latest state of every item in it is added, and the file
+    moves to BCHOC_FILE_PATH + ".segments/NNNNNN.seg". A new active segment is started by the next append.
+    Block offsets everywhere else are logical offsets: positions in the concatenation of the blocks of every
+    segment, footers excluded, so a chain that never reached the segment size is exactly the old single file.
+    Sealed segments never change: listing them only reads the fixed-size trailer of each file, once, and the JSON
+    footer is parsed on first use (footer()) and cached.
+
+    How often appends are flushed to disk is set by the durability level (BCHOC_DURABILITY):
+        - block: every block is fsynced on its own, so a crash loses at most the block being written
+        - batch: one fsync per appended batch, i.e. per transaction (the default)
+        - time: group commit; appends are only fsynced once BCHOC_SYNC_INTERVAL seconds (default 1) have passed
+          since the last fsync, so every batch written in between shares one fsync. A crash can lose the batches
+          of the last interval. A background timer fsyncs pending appends when the interval is up even if nothing
+          else is appended (a long-running server may stay idle); they are also fsynced by sync(), when the
+          segment is sealed and at exit.
+    Sealing always fsyncs, so sealed segments are durable whatever the level.
+    """
+
+    DIRECTORY_SUFFIX = ".segments"
+
+    def __init__(self, chain_path, segment_size=None, durability=None, sync_interval=None):
+        self.chain_path = chain_path
+        self.directory = chain_path + self.DIRECTORY_SUFFIX
+        if segment_size is None:
+            segment_size = int(os.getenv("BCHOC_SEGMENT_SIZE", str(64 * 1024 * 1024)))
+        self.segment_size = segment_size
+        if durability is None:
+            durability = os.getenv("BCHOC_DURABILITY", "batch")
+        if durability not in DURABILITY_LEVELS:
+            raise ValueError(f"Unknown durability level {durability!r}, expected one of {', '.join(DURABILITY_LEVELS)}")
+        self.durability = durability
+        if sync_interval is None:
+            sync_interval = float(os.getenv("BCHOC_SYNC_INTERVAL", "1"))
+        self.sync_interval = sync_interval
+        self._last_sync = time.monotonic()
+        self._unsynced = False  # appends written since the last fsync, in time mode
+        self._sync_at_exit = False
+        self._sync_lock = threading.RLock()  # the sync timer runs in its own thread
+        self._sync_timer = None  # pending threading.Timer of the time level
+        self._sealed = {}  # file name -> bytes of blocks of sealed segments already read
+        self._footers = {}  # (path, base) -> decoded footer, or None if it is damaged
+        self._active = None  # (stat key, read_footer result) of the active file, so it is only re-read when it changes
+
+    def segments(self):
+        """
+        Returns the segments of the chain in order, the active one last if it has any blocks.
+        The directory is listed before and after looking at the active file, and again if a segment was sealed
+        in between, so the result never misses or repeats blocks that moved from the active file to a segment.
+        """
+        names = self._list()
+        while True:
+            try:
+                stat = os.stat(self.chain_path)
+            except FileNotFoundError:
+                stat = None
+            again = self._list()
+            if again == names:
+                break
+            names = again
+
+        segments = []
+        base = 0
+        for name in names:
+            length = self._read_sealed(name)
+            segments.append(Segment(os.path.join(self.directory, name), base, length, True))
+            base += length
+        if stat is not None and stat.st_size > 0:
+            key = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+            if self._active is None or self._active[0] != key:
+                self._active = (key, read_footer(self.chain_path)) #sealed, but not moved yet (see seal)
+            sealed = self._active[1]
+            if sealed is not None:
+                self._footers[(self.chain_path, base)] = sealed[1] #it is about to move, read it now
+                segments.append(Segment(self.chain_path, base, sealed[0], True))
+            else:
+                segments.append(Segment(self.chain_path, base, stat.st_size, False))
+        return segments
+
+    def footer(self, segment):
+        """
+        Returns the decoded footer of a sealed segment, or None for the active segment or a damaged footer.
+        """
+        if not segment.sealed:
+            return None
+        key = (segment.path, segment.base)
+        if key not in self._footers:
+            found = read_footer(segment.path)
+            self._footers[key] = found[1] if found is not None and found[0] == segment.length else None
+        return self._footers[key]
+
+    def size(self):
+        """
+        Logical size of the chain: the bytes of blocks in every segment.
+        """
+        segments = self.segments()
+        return segments[-1].base + segments[-1].length if segments else 0
+
+    def exists(self):
+        return os.path.isfile(self.chain_path) or bool(self._list())
+
+    def locate(self, offset, segments=None):
+        """
+        Returns the segment holding the given logical offset, or None if it is past the end of the chain.
+        """
+        for segment in segments if segments is not None else self.segments():
+            if segment.base <= offset < segment.base + segment.length:
+                return segment
+        return None
+
+    def read_record(self, offset):
+        """
+        Returns the raw bytes of the record starting at the given logical offset, or None if no complete record starts there.
+        """
+        segment = self.locate(offset)
+        if segment is None:
+            return None
+        with open(segment.path, 'rb') as f:
+            f.seek(offset - segment.base)
+            header_data = f.read(RECORD_SIZE)
+            if len(header_data) < RECORD_SIZE:
+                return None
+            data_length = struct.unpack_from('I', header_data, RECORD_SIZE - 4)[0]
+            if offset - segment.base + RECORD_SIZE + data_length > segment.length:
+                return None
+            data = f.read(data_length)
+            if len(data) < data_length:
+                return None
+            return header_data + data
+
+    def append(self, payload, expected_start):
+        """
+        Appends a batch of packed blocks to the active segment, sealing it first if the batch would make it
+        larger than the segment size. A batch is never split, so no block spans two segments.
+        The caller must hold the chain lock.
+        :param expected_start: logical offset the caller linked the batch to; RuntimeError if the chain isn't that size.
+        :return: the logical offset the batch was written at.
+        """
+        segments = self.segments()
+        if segments and segments[-1].sealed and segments[-1].path == self.chain_path:
+            self._move(segments[-1]) #finish a seal that was interrupted
+            segments = self.segments()
+        base = segments[-1].base + segments[-1].length if segments else 0
+        if segments and not segments[-1].sealed and 0 < segments[-1].length and \
+                segments[-1].length + len(payload) > self.segment_size:
+            self.seal(segments)
+            segments = self.segments()
+
+        active_base = segments[-1].base if segments and not segments[-1].sealed else base
+        with open(self.chain_path, 'ab') as f: #Open the file in append-binary mode
+            start = active_base + f.tell()
+            if start != expected_start:
+                raise RuntimeError("chain file changed while the transaction held the lock")
+            local = f.tell()
+            try:
+                if self.durability == 'block':
+                    for record in split_records(payload):
+                        f.write(record)
+                        f.flush()
+                        fsync(f.fileno())
+                else:
+                    f.write(payload)
+                    f.flush()
+                    self._group_commit(f.fileno())
+            except Exception:
+                f.truncate(local) #roll back a partially written batch
+                raise
+        return start
+
+    def _group_commit(self, fd):
+        """
+        Fsyncs a batch that was just written, unless the time durability level lets it wait for a later fsync.
+        """
+        with self._sync_lock:
+            now = time.monotonic()
+            if self.durability == 'time' and now - self._last_sync < self.sync_interval:
+                self._unsynced = True
+                if not self._sync_at_exit:
+                    atexit.register(self.sync)
+                    self._sync_at_exit = True
+                if self._sync_timer is None:
+                    self._sync_timer = threading.Timer(self._last_sync + self.sync_interval - now, self._timed_sync)
+                    self._sync_timer.daemon = True
+                    self._sync_timer.start()
+                profiling.count('fsyncs_deferred')
+                return
+            fsync(fd)
+            self._last_sync = now
+            self._unsynced = False
+
+    def _timed_sync(self):
+        with self._sync_lock:
+            self._sync_timer = None
+            self.sync()
+
+    def sync(self):
+        """
+        Fsyncs appends the time durability level has not flushed yet.
+        """
+        with self._sync_lock:
+            if not self._unsynced:
+                return
+            try:
+                with open(self.chain_path, 'ab') as f:
+                    fsync(f.fileno())
+            except FileNotFoundError:
+                pass #sealed since, and sealing fsyncs
+            self._last_sync = time.monotonic()
+            self._unsynced = False
+
+    def cut(self, offset, quarantine_path=None):
+        """
+        Truncates the active segment at the given logical offset, dropping a torn tail. The bytes removed are first
+        written to quarantine_path if one is given.
+        The caller must hold the chain lock.
+        :return: the number of bytes removed.
+        """
+        segments = self.segments()
+        if not segments or segments[-1].sealed or offset < segments[-1].base:
+            raise ValueError("only the active segment can be cut")
+        local = offset - segments[-1].base
+        with open(self.chain_path, 'r+b') as f:
+            f.seek(local)
+            removed = f.read()
+            if not removed:
+                return 0
+            if quarantine_path is not None:
+                with open(quarantine_path, 'wb') as q:
+                    q.write(removed)
+                    q.flush()
+                    fsync(q.fileno())
+            f.truncate(local)
+            f.flush()
+            fsync(f.fileno())
+        return len(removed)
+
+    def seal(self, segments=None):
+        """
+        Seals the active segment. The sealed copy, blocks plus footer, is written next to the active file and
+        atomically replaces it; it is then renamed into the segments directory. Readers see the same blocks at
+        every step, and a seal interrupted after the replace is finished by the next append.
+        The caller must hold the chain lock.
+        """
+        segments = segments if segments is not None else self.segments()
+        if not segments or segments[-1].sealed:
+            return
+        profiling.count('segments_sealed')
+        active = segments[-1]
+        with open(self.chain_path, 'rb') as f:
+            blocks = f.read(active.length)
+        footer = summarize(blocks, active.base, len(segments))
+        blocks = blocks[:footer['bytes']] #an incomplete record at the end isn't part of the chain
+        footer_data = json.dumps(footer, sort_keys=True).encode()
+
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self.chain_path + ".seal.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(blocks)
+            f.write(footer_data)
+            f.write(TRAILER.pack(len(blocks), len(footer_data), FOOTER_MAGIC))
+            f.flush()
+            fsync(f.fileno())
+        os.replace(tmp_path, self.chain_path)
+        self._unsynced = False #the sealed copy was fsynced
+        self._move(footer)
+
+    def _move(self, footer):
+        path = os.path.join(self.directory, f"{footer['index']:06d}.seg")
+        os.makedirs(self.directory, exist_ok=True)
+        os.rename(self.chain_path, path)
+        self._footers[(path, footer['base'])] = footer
+        self._fsync_directory(self.directory)
+        self._fsync_directory(os.path.dirname(os.path.abspath(self.chain_path)))
+
+    def _fsync_directory(self, directory):
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except OSError:
+            return #not supported on this platform
+        try:
+            fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def _list(self):
+        try:
+            return sorted(name for name in os.listdir(self.directory) if name.endswith(".seg"))
+        except FileNotFoundError:
+            return []
+
+    def _read_sealed(self, name):
+        if name not in self._sealed:
+            path = os.path.join(self.directory, name)
+            trailer = read_trailer(path)
+            self._sealed[name] = trailer[0] if trailer is not None else os.path.getsize(path)
+        return self._sealed[name]
+
+
+def fsync(fd):
+    """
+    os.fsync, counted and timed when profiling is enabled.
+    """
+    with profiling.timer('fsync'):
+        os.fsync(fd)
+    profiling.count('fsyncs')
+
+
+def split_records(payload):
+    """
+    Yields the records of a batch of packed blocks, using the data length at the end of each header.
+    """
+    view = memoryview(payload)
+    offset = 0
+    while offset < len(payload):
+        end = offset + RECORD_SIZE + struct.unpack_from('I', payload, offset + RECORD_SIZE - 4)[0]
+        yield view[offset:end]
+        offset = end
+
+
+def read_trailer(path):
+    """
+    Reads the trailer at the end of a sealed segment file, without parsing the footer.
+    :return: (bytes of blocks, length of the footer), or None if the file has no valid trailer.
+    """
+    try:
+        with open(path, 'rb') as f:
+            return _read_trailer(f)
+    except FileNotFoundError:
+        return None
+
+
+def _read_trailer(f):
+    size = os.fstat(f.fileno()).st_size
+    if size < TRAILER.size:
+        return None
+    f.seek(size - TRAILER.size)
+    length, footer_length, magic = TRAILER.unpack(f.read(TRAILER.size))
+    if magic != FOOTER_MAGIC or length + footer_length + TRAILER.size != size:
+        return None
+    return length, footer_length
+
+
+def read_footer(path):
+    """
+    Reads the footer of a sealed segment file.
+    :return: (bytes of blocks, footer dictionary), or None if the file has no valid footer.
+    """
+    try:
+        with open(path, 'rb') as f:
+            trailer = _read_trailer(f)
+            if trailer is None:
+                return None
+            length, footer_length = trailer
+            f.seek(length)
+            footer = json.loads(f.read(footer_length).decode())
+    except (FileNotFoundError, ValueError):
+        return None
+    return length, footer
+
+
+def summarize(blocks, base, index):
+    """
+    Builds the footer of a segment from its raw blocks:
+        - index: position of the segment, 1 for the first one
+        - base / bytes / blocks: logical offset of the segment, bytes of blocks in it and how many blocks there are
+        - previous_hash: hash the first block links to, i.e. the last block of the segment before
+        - first_hash / last_hash: hashes of the first and last block
+        - items: item_id -> [state, offset, end, case_id] of the latest block of every item in the segment
+    """
+    footer = {'index': index, 'base': base, 'bytes': 0, 'blocks': 0, 'items': {},
+              'previous_hash': None, 'first_hash': None, 'last_hash': None}
+    view = memoryview(blocks)
+    offset = 0
+    last = None
+    while offset + RECORD_SIZE <= len(blocks):
+        end = offset + RECORD_SIZE + struct.unpack_from('I', blocks, offset + RECORD_SIZE - 4)[0]
+        if end > len(blocks):
+            break
+        if offset == 0:
+            footer['previous_hash'] = blocks[0:32].hex()
+            footer['first_hash'] = hashlib.sha256(view[0:end]).hexdigest()
+        item_id = int.from_bytes(blocks[offset + 72:offset + 76], byteorder=sys.byteorder)
+        state = blocks[offset + 104:offset + 116].decode('utf-8').strip('\x00')
+        footer['items'][str(item_id)] = [state, base + offset, base + end, blocks[offset + 40:offset + 56].hex()]
+        footer['blocks'] += 1
+        last = (offset, end)
+        offset = end
+    if last is not None:
+        footer['last_hash'] = hashlib.sha256(view[last[0]:last[1]]).hexdigest()
+    footer['bytes'] = offset
+    view.release()
+    return footer
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Synthetic chain generator.
+
+Writes a valid chain of N blocks straight to disk, without going through the append path: items are registered
+under M cases and then move through realistic custody transitions (CHECKEDIN <-> CHECKEDOUT, ending in DISPOSED,
+DESTROYED or RELEASED). Blocks are hash-linked and written through SegmentedChain, so large chains are split
+into sealed segments like real ones, and the digest cache is written along the way. The other indexes are built
+on first use. Corruptions can be injected; every one of them is listed in the returned manifest with the block
+index and error verify should report for it.
+
+Usage:
+    python3 chaingen.py PATH --blocks N [--cases M] [--items K] [--corrupt KIND[:COUNT] ...] [--seed S]
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import struct
+import sys
+import uuid
+from chain_index import DigestCache
+from chain_lock import ChainLock
+from chain_segments import SegmentedChain
+
+HEADER = struct.Struct('32s d 32s 32s 12s 12s 12s I')
+FLUSH_BYTES = 4 * 1024 * 1024  # written to the chain in batches of about this size, or a quarter segment if smaller
+REMOVED = ("DISPOSED", "DESTROYED", "RELEASED")
+
+# Corruption kind -> the error verify reports for it. A "hash-mismatch" block is also reported by the
+# block after it as "NO PARENT", since that block links to the original hash.
+CORRUPTIONS = {
+    'no-parent': "NO PARENT",
+    'duplicate-parent': "DUPLICATE PARENT",
+    'improper-removal': "IMPROPER REMOVAL",
+    'double-checkout': "DOUBLE CHECKOUT",
+    'release-without-data': "RELEASE WITHOUT DATA",
+    'add-not-first': "ADD NOT FIRST",
+    'hash-mismatch': "HASH MISMATCH",
+}
+
+
+class ItemPool:
+    """
+    Items in one state, with O(1) random picks and removals.
+    """
+
+    def __init__(self):
+        self.items = []
+        self.positions = {}
+
+    def add(self, item_id):
+        self.positions[item_id] = len(self.items)
+        self.items.append(item_id)
+
+    def remove(self, item_id):
+        position = self.positions.pop(item_id)
+        last = self.items.pop()
+        if last != item_id:
+            self.items[position] = last
+            self.positions[last] = position
+
+    def pick(self, rng):
+        return self.items[rng.randrange(len(self.items))]
+
+    def __len__(self):
+        return len(self.items)
+
+
+class Generator:
+
+    def __init__(self, blocks, cases, items, corruptions, seed, start_time):
+        self.rng = random.Random(seed)
+        self.blocks = blocks
+        self.cases = [uuid.UUID(int=self.rng.getrandbits(128), version=4).bytes for _ in range(cases)]
+        self.items = items
+        self.next_item = 1
+        self.item_case = {}
+        self.checked_in = ItemPool()
+        self.checked_out = ItemPool()
+        self.removed = []
+        self.time = start_time
+        self.index = 0
+        self.previous_hash = b'\x00' * 32
+        self.grandparent_hash = None
+        self.violations = []
+
+        #Corruptions are spread over the chain, at least 3 blocks apart so their reports don't interfere
+        kinds = [kind for kind, count in corruptions for _ in range(count)]
+        slots = self.rng.sample(range(1, max(1, (blocks - 2) // 3)), min(len(kinds), max(0, (blocks - 2) // 3 - 1)))
+        self.pending = sorted(zip([slot * 3 for slot in slots], kinds))
+
+    def block(self, index):
+        """
+        Returns the raw record of block index and the digest the next block links to.
+        """
+        self.index = index
+        if index == 0:
+            return self._pack(b'\x00' * 32, b'\x00' * 16, 0, "INITIAL", "Initial block")
+
+        kind = None
+        if self.pending and self.pending[0][0] <= index:
+            kind = self.pending[0][1]
+            transition = self._corrupt(kind)
+            if transition is not None:
+                self.pending.pop(0)
+                self.violations.append({"index": index, "error": CORRUPTIONS[kind]})
+                if kind == 'hash-mismatch':
+                    self.violations.append({"index": index + 1, "error": "NO PARENT"})
+            else:
+                kind = None #not possible yet, tried again on the next block
+        if kind is None:
+            transition = self._transition()
+
+        item_id, state, data = transition
+        previous_hash = self.previous_hash
+        if kind == 'no-parent':
+            previous_hash = hashlib.sha256(os.urandom(32)).digest()
+        elif kind == 'duplicate-parent':
+            previous_hash = self.grandparent_hash
+        self.time += self.rng.expovariate(1 / 60.0)
+        return self._pack(previous_hash, self.item_case[item_id], item_id, state, data, tamper=kind == 'hash-mismatch')
+
+    def _pack(self, previous_hash, case_id, item_id, state, data, tamper=False):
+        data_bytes = data.encode()
+        record = HEADER.pack(previous_hash, self.time, case_id, item_id.to_bytes(4, byteorder=sys.byteorder),
+                             state.encode(), b'\x00' * 12, b'\x00' * 12, len(data_bytes)) + data_bytes
+        digest = hashlib.sha256(record).digest()
+        if tamper:
+            record = record[:-1] + bytes([record[-1] ^ 1]) #changed after its digest was recorded
+        self.grandparent_hash, self.previous_hash = self.previous_hash, digest
+        return record, digest
+
+    def _new_item(self):
+        item_id = self.next_item
+        self.next_item += 1
+        self.item_case[item_id] = self.rng.choice(self.cases)
+        return item_id
+
+    def _transition(self):
+        """
+        Picks the next regular block: a new item is checked in, a checked in item is checked out or removed,
+        or a checked out item is checked back in.
+        """
+        remaining_blocks = max(1, self.blocks - self.index)
+        remaining_items = self.items - (self.next_item - 1)
+        active = len(self.checked_in) + len(self.checked_out)
+        if active == 0 or (remaining_items > 0 and self.rng.random() < remaining_items / remaining_blocks):
+            item_id = self._new_item()
+            self.checked_in.add(item_id)
+            return item_id, "CHECKEDIN", f"Item {item_id}"
+
+        if len(self.checked_out) and (not len(self.checked_in) or self.rng.random() < 0.5):
+            item_id = self.checked_out.pick(self.rng)
+            self.checked_out.remove(item_id)
+            self.checked_in.add(item_id)
+            return item_id, "CHECKEDIN", f"Item {item_id}"
+
+        item_id = self.checked_in.pick(self.rng)
+        self.checked_in.remove(item_id)
+        if self.rng.random() < 0.1:
+            state = self.rng.choice(REMOVED)
+            self.removed.append(item_id)
+            data = f"Released to owner of item {item_id}" if state == "RELEASED" else f"Item {item_id}"
+            return item_id, state, data
+        self.checked_out.add(item_id)
+        return item_id, "CHECKEDOUT", f"Item {item_id}"
+
+    def _corrupt(self, kind):
+        """
+        Returns the (item_id, state, data) of a block that breaks a rule, or None if the chain has no item to
+        break it with yet. Link corruptions use a regular transition.
+        """
+        if kind in ('no-parent', 'duplicate-parent', 'hash-mismatch'):
+            return self._transition()
+        if kind == 'improper-removal' and self.removed:
+            item_id = self.removed.pop()
+            return item_id, "CHECKEDOUT", f"Item {item_id}"
+        if kind == 'double-checkout' and len(self.checked_out):
+            item_id = self.checked_out.pick(self.rng)
+            return item_id, "CHECKEDOUT", f"Item {item_id}"
+        if kind == 'release-without-data' and len(self.checked_in):
+            item_id = self.checked_in.pick(self.rng)
+            self.checked_in.remove(item_id)
+            return item_id, "RELEASED", ""
+        if kind == 'add-not-first':
+            item_id = self._new_item()
+            self.checked_out.add(item_id)
+            return item_id, "CHECKEDOUT", f"Item {item_id}"
+        return None
+
+
+def generate(chain_path, blocks, cases=10, items=None, corruptions=(), seed=0, start_time=1.7e9):
+    """
+    Writes a chain of the given number of blocks to chain_path, which must not exist yet.
+    :param cases: number of cases the items are registered under.
+    :param items: number of distinct items, defaults to a quarter of the blocks.
+    :param corruptions: list of (kind, count) pairs, kinds from CORRUPTIONS.
+    :param seed: seed of the random generator; the same arguments produce the same chain.
+    :return: manifest dictionary with the blocks, cases and items written and the violations injected.
+    """
+    for kind, count in corruptions:
+        if kind not in CORRUPTIONS:
+            raise ValueError(f"Unknown corruption: {kind}")
+    storage = SegmentedChain(chain_path)
+    if storage.exists():
+        raise FileExistsError(f"{chain_path} already exists")
+    generator = Generator(blocks, cases, items if items is not None else max(1, blocks // 4), corruptions, seed, start_time)
+    digests = DigestCache(chain_path, storage)
+    flush_bytes = max(1, min(FLUSH_BYTES, storage.segment_size // 4)) #batches are never split across segments
+
+    with ChainLock(chain_path):
+        buffer = []
+        entries = []
+        size = 0
+        start = 0
+        for index in range(blocks):
+            record, digest = generator.block(index)
+            entries.append((start + size, start + size + len(record), digest))
+            buffer.append(record)
+            size += len(record)
+            if size >= flush_bytes or index == blocks - 1:
+                start = storage.append(b''.join(buffer), start) + size
+                digests.record_many(entries)
+                buffer, entries, size = [], [], 0
+
+    return {
+        "blocks": blocks,
+        "cases": len(generator.cases),
+        "items": generator.next_item - 1,
+        "violations": generator.violations,
+        "skipped_corruptions": [kind for position, kind in generator.pending],
+    }
+
+
+def parse_corruption(text):
+    kind, _, count = text.partition(':')
+    return kind, int(count or 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic chain of custody')
+    parser.add_argument('path', help='Chain file to create')
+    parser.add_argument('--blocks', type=int, required=True)
+    parser.add_argument('--cases', type=int, default=10)
+    parser.add_argument('--items', type=int, help='Distinct items, defaults to a quarter of the blocks')
+    parser.add_argument('--corrupt', action='append', default=[], type=parse_corruption,
+                        help=f"KIND[:COUNT] to inject, KIND one of {', '.join(CORRUPTIONS)}")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    manifest = generate(args.path, args.blocks, args.cases, args.items, args.corrupt, args.seed)
+    print(json.dumps(manifest, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Cold-start latency of one-shot bchoc commands across chain sizes.
+
+For every size a chain is built through the Blockchain API and its indexes are created once, then each command
+is run as a fresh `python3 bchoc.py ...` process several times and the median wall time is reported as JSON,
+next to the time it takes the interpreter to start and import bchoc without doing anything. With lazy startup
+the commands that don't read the whole chain (everything but plain show and a full verify) should take about
+the same time at every size.
+
+Usage:
+    python3 coldstart.py [--sizes 1000,10000,100000] [--runs 5] [--keep DIR]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from blockchain import Blockchain
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BCHOC = os.path.join(HERE, "bchoc.py")
+BATCH = 1000
+
+
+def build(chain_path, size, case_id):
+    """
+    Creates a chain of about size blocks: every item is added, and every other one checked out again.
+    """
+    os.environ["BCHOC_FILE_PATH"] = chain_path
+    blockchain = Blockchain()
+    blockchain.init()
+    items = max(1, (size - 1) * 2 // 3)
+    for start in range(1, items + 1, BATCH):
+        chunk = range(start, min(start + BATCH, items + 1))
+        blockchain.add_blocks([{"action": "add", "case_id": case_id, "item_id": item_id} for item_id in chunk])
+        blockchain.add_blocks([{"action": "checkout", "item_id": item_id} for item_id in chunk if item_id % 2])
+    blockchain._get_item_index() #every index exists before the first measured command
+    return items
+
+
+def timed(command, env):
+    began = time.perf_counter()
+    subprocess.run(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    return time.perf_counter() - began
+
+
+def measure(chain_path, items, case_id, runs):
+    env = dict(os.environ, BCHOC_FILE_PATH=chain_path)
+    python = [sys.executable]
+    commands = {
+        "python_import": lambda n: python + ["-c", f"import sys; sys.path.insert(0, {HERE!r}); import bchoc"],
+        "init": lambda n: python + [BCHOC, "init"],
+        "show_cases": lambda n: python + [BCHOC, "show", "cases"],
+        "show_history": lambda n: python + [BCHOC, "show", "history", "-i", "2"],
+        "add": lambda n: python + [BCHOC, "add", "-c", case_id, "-i", str(items + 1 + n)],
+        "checkout": lambda n: python + [BCHOC, "checkout", "-i", str(2 + 2 * n)],
+    }
+    return {name: round(statistics.median(timed(command(n), env) for n in range(runs)) * 1000, 1)
+            for name, command in commands.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold-start latency of one-shot bchoc commands')
+    parser.add_argument('--sizes', default='1000,10000,100000', help='Comma-separated chain sizes in blocks')
+    parser.add_argument('--runs', type=int, default=5, help='Runs of each command, the median is reported')
+    parser.add_argument('--keep', help='Directory to keep the chains in, instead of a temporary one')
+    args = parser.parse_args()
+
+    directory = args.keep or tempfile.mkdtemp(prefix="bchoc-coldstart-")
+    os.makedirs(directory, exist_ok=True)
+    results = []
+    try:
+        for size in [int(size) for size in args.sizes.split(',')]:
+            chain_path = os.path.join(directory, f"chain-{size}.dat")
+            case_id = str(uuid.uuid4())
+            items = build(chain_path, size, case_id)
+            blocks = Blockchain().verify().num_blocks
+            results.append({"blocks": blocks, "median_ms": measure(chain_path, items, case_id, args.runs)})
+    finally:
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Local load test for the bchoc daemon.
+
+Starts bchoc_server.py on a scratch chain, hammers it with concurrent writer and reader clients, verifies
+the resulting chain through the server and prints a JSON summary of throughput and latency.
+
+Usage:
+    python3 loadtest.py [--writers 4] [--readers 4] [--items 200] [--batch 10] [--keep DIR]
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from blockchain import Blockchain
+from bchoc_server import Client
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def summarize(latencies):
+    return {
+        "requests": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        "max_ms": round(max(latencies) * 1000, 3) if latencies else None,
+    }
+
+
+def wait_for_socket(path, process, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("server exited during startup")
+        if os.path.exists(path):
+            return
+        time.sleep(0.05)
+    raise RuntimeError("server did not start")
+
+
+def writer(socket_path, worker, items, batch, latencies, errors):
+    """
+    Registers items in batches, then checks out and removes every other one.
+    """
+    client = Client(socket_path)
+    case_id = str(uuid.uuid4())
+    item_ids = [worker * 1000000 + n for n in range(1, items + 1)]
+    try:
+        for start in range(0, len(item_ids), batch):
+            began = time.perf_counter()
+            response = client.request("add", case_id=case_id, item_ids=item_ids[start:start + batch])
+            latencies.append(time.perf_counter() - began)
+            if not response["ok"]:
+                errors.append(response["error"])
+        for item_id in item_ids[::2]:
+            op = "checkout" if item_id % 4 == 1 else "remove"
+            began = time.perf_counter()
+            response = client.request(op, item_id=item_id)
+            latencies.append(time.perf_counter() - began)
+            if not response["ok"]:
+                errors.append(response["error"])
+    finally:
+        client.close()
+
+
+def reader(socket_path, stop, latencies, errors):
+    """
+    Mixes cheap index lookups with full-chain history queries until the writers are done.
+    """
+    client = Client(socket_path)
+    n = 0
+    try:
+        while not stop.is_set():
+            n += 1
+            if n % 10 == 0:
+                request = ("history", {"item_id": 1000001})
+            else:
+                request = ("state", {"item_id": 1000000 + n % 50})
+            began = time.perf_counter()
+            response = client.request(request[0], **request[1])
+            latencies.append(time.perf_counter() - began)
+            if not response["ok"]:
+                errors.append(response["error"])
+    finally:
+        client.close()
+
+
+def run(writers, readers, items, batch, directory):
+    chain_path = os.path.join(directory, "chain.dat")
+    socket_path = chain_path + ".sock"
+    env = dict(os.environ, BCHOC_FILE_PATH=chain_path)
+
+    os.environ["BCHOC_FILE_PATH"] = chain_path
+    Blockchain().init()
+
+    server = subprocess.Popen([sys.executable, os.path.join(HERE, "bchoc_server.py"), "serve", "--socket", socket_path],
+                              env=env, stdout=subprocess.DEVNULL)
+    try:
+        wait_for_socket(socket_path, server)
+
+        write_latencies, read_latencies, errors = [], [], []
+        stop = threading.Event()
+        threads = [threading.Thread(target=writer, args=(socket_path, w + 1, items, batch, write_latencies, errors))
+                   for w in range(writers)]
+        reader_threads = [threading.Thread(target=reader, args=(socket_path, stop, read_latencies, errors))
+                          for _ in range(readers)]
+
+        began = time.perf_counter()
+        for thread in threads + reader_threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - began
+        stop.set()
+        for thread in reader_threads:
+            thread.join()
+
+        client = Client(socket_path)
+        verify = client.request("verify")["result"]
+        client.close()
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        "writers": writers,
+        "readers": readers,
+        "elapsed_s": round(elapsed, 3),
+        "write": summarize(write_latencies),
+        "read": summarize(read_latencies),
+        "write_requests_per_s": round(len(write_latencies) / elapsed, 1),
+        "read_requests_per_s": round(len(read_latencies) / elapsed, 1),
+        "errors": len(errors),
+        "blocks": verify["blocks"],
+        "state": verify["state"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the bchoc daemon')
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--items', type=int, default=200, help='Items registered by each writer')
+    parser.add_argument('--batch', type=int, default=10, help='Items per add request')
+    parser.add_argument('--keep', help='Directory to keep the chain in, instead of a temporary one')
+    args = parser.parse_args()
+
+    directory = args.keep or tempfile.mkdtemp(prefix="bchoc-load-")
+    os.makedirs(directory, exist_ok=True)
+    try:
+        result = run(args.writers, args.readers, args.items, args.batch, directory)
+    finally:
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+    print(json.dumps(result, indent=2))
+    return 0 if result["state"] == "CLEAN" and result["errors"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""
+Opt-in instrumentation of the hot paths of bchoc.
+
+Counters (bytes read, blocks decoded, hashes computed, fsyncs, index lookups, ...) and timing histograms
+(SHA-256, fsync, lock waits, appends, index syncs, verify) are collected while profiling is enabled, either for
+the whole process with BCHOC_PROFILE=1 (BCHOC_PROFILE=json for JSON) or for one command with bchoc --stats.
+Instrumentation points check the module-level flag `enabled` and do nothing else when it is off; the per-block
+ones are not even reached then, because iter_blocks only wraps its blocks in a counting generator, and hands out
+ProfiledBlock instead of Block, while profiling is on.
+profile_call() runs a function under cProfile and dumps the result, for bchoc --profile FILE.
+"""
+import json
+import math
+import os
+import sys
+import time
+
+_setting = os.getenv("BCHOC_PROFILE", "")
+enabled = _setting not in ("", "0")
+output_format = "json" if _setting == "json" else "text"
+
+counters = {}  # name -> count
+histograms = {}  # name -> Histogram
+
+
+class Histogram:
+    """
+    Distribution of durations, in power-of-two buckets of microseconds (bucket b holds durations up to 2**b µs),
+    with exact count, total, min and max.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = 0.0
+        self.buckets = {}
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        bucket = max(0, math.ceil(math.log2(seconds * 1e6))) if seconds > 0 else 0
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def percentile(self, fraction):
+        """
+        Upper bound, in seconds, of the bucket holding the given fraction of the samples.
+        """
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= fraction * self.count:
+                return min(2 ** bucket / 1e6, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_s': self.total,
+            'mean_us': self.total / self.count * 1e6 if self.count else 0.0,
+            'min_us': (self.min or 0.0) * 1e6,
+            'p50_us': self.percentile(0.5) * 1e6,
+            'p99_us': self.percentile(0.99) * 1e6,
+            'max_us': self.max * 1e6,
+            'buckets_us': {str(2 ** bucket): n for bucket, n in sorted(self.buckets.items())},
+        }
+
+
+class _Timer:
+    __slots__ = ('name', 'began')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.began = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.perf_counter() - self.began)
+        return False
+
+
+class _NoTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NO_TIMER = _NoTimer()
+
+
+def enable(fmt=None):
+    global enabled, output_format
+    enabled = True
+    if fmt is not None:
+        output_format = fmt
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    counters.clear()
+    histograms.clear()
+
+
+def count(name, amount=1):
+    if enabled:
+        counters[name] = counters.get(name, 0) + amount
+
+
+def observe(name, seconds):
+    if enabled:
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram()
+        histogram.add(seconds)
+
+
+def timer(name):
+    """
+    Context manager recording the duration of its block in the named histogram:
+        with profiling.timer('fsync'):
+            os.fsync(fd)
+    """
+    return _Timer(name) if enabled else _NO_TIMER
+
+
+def lookup(entry):
+    """
+    Counts an index lookup and whether the item was known, then returns its result unchanged.
+    """
+    if enabled:
+        count('index_lookups')
+        if entry is None:
+            count('index_misses')
+    return entry
+
+
+def counted(blocks):
+    """
+    Passes blocks through, counting them and the bytes they were decoded from.
+    """
+    decoded = 0
+    size = 0
+    try:
+        for block in blocks:
+            decoded += 1
+            size += len(block.raw)
+            yield block
+    finally:
+        count('blocks_decoded', decoded)
+        count('bytes_read', size)
+
+
+def summary(lock=None):
+    """
+    Returns everything collected so far as a dictionary: counters, timings and the stats of the given ChainLock.
+    """
+    result = {
+        'counters': dict(sorted(counters.items())),
+        'timings': {name: histogram.to_dict() for name, histogram in sorted(histograms.items())},
+    }
+    if lock is not None:
+        result['lock'] = dict(lock.stats)
+    return result
+
+
+def report(lock=None, fmt=None, stream=None):
+    """
+    Prints the summary to stderr, so it never mixes with command output: a table, or JSON if fmt is "json".
+    """
+    stream = stream or sys.stderr
+    data = summary(lock)
+    if (fmt or output_format) == "json":
+        print(json.dumps(data, indent=2), file=stream)
+        return
+    print("--- bchoc stats ---", file=stream)
+    for name, value in data['counters'].items():
+        print(f"{name:<24}{value:>14}", file=stream)
+    if data['timings']:
+        print(f"{'timing':<24}{'count':>8}{'total ms':>12}{'mean us':>12}{'p50 us':>10}{'p99 us':>10}{'max us':>12}", file=stream)
+    for name, timing in data['timings'].items():
+        print(f"{name:<24}{timing['count']:>8}{timing['total_s'] * 1000:>12.2f}{timing['mean_us']:>12.1f}"
+              f"{timing['p50_us']:>10.0f}{timing['p99_us']:>10.0f}{timing['max_us']:>12.1f}", file=stream)
+    if 'lock' in data:
+        print("lock: " + ", ".join(f"{name} {value:.6g}" for name, value in data['lock'].items()), file=stream)
+
+
+def profile_call(path, function, *args):
+    """
+    Runs function(*args) under cProfile, dumps the profile to path (load it with pstats) and prints the
+    functions with the highest cumulative time to stderr.
+    :return: what the function returned.
+    """
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args)
+    finally:
+        profiler.dump_stats(path)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(20)
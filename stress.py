@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Multi-process stress test for concurrent appends.
+
+Starts several worker processes that all append to the same chain file at once (single adds, batched adds
+and checkouts), then verifies the chain, checks that no block was lost, compares the item index against
+a fresh rebuild and prints the lock contention metrics of every worker as JSON.
+
+Usage:
+    python3 stress.py [--workers 8] [--items 100] [--batch 5] [--keep DIR]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from blockchain import Blockchain
+from chain_index import ItemIndex
+
+
+def worker(chain_path, number, items, batch, results):
+    os.environ["BCHOC_FILE_PATH"] = chain_path
+    blockchain = Blockchain()
+    case_id = str(uuid.uuid4())
+    item_ids = [number * 1000000 + n for n in range(1, items + 1)]
+    failures = 0
+    blocks = 0
+
+    began = time.perf_counter()
+    for start in range(0, len(item_ids), batch):
+        chunk = item_ids[start:start + batch]
+        if len(chunk) == 1 or start // batch % 2 == 0:
+            actions = [{"action": "add", "case_id": case_id, "item_id": item_id} for item_id in chunk]
+            ok = blockchain.add_blocks(actions)
+        else:
+            ok = all([blockchain.add_block({"action": "add", "case_id": case_id, "item_id": item_id}) for item_id in chunk])
+        failures += not ok
+        blocks += len(chunk) if ok else 0
+    for item_id in item_ids[::3]:
+        ok = blockchain.add_block({"action": "checkout", "item_id": item_id})
+        failures += not ok
+        blocks += 1 if ok else 0
+
+    stats = dict(blockchain._get_lock().stats)
+    stats["elapsed_s"] = time.perf_counter() - began
+    results.put({"worker": number, "blocks": blocks, "failures": failures, "lock": stats})
+
+
+def run(workers, items, batch, directory):
+    chain_path = os.path.join(directory, "chain.dat")
+    os.environ["BCHOC_FILE_PATH"] = chain_path
+    Blockchain().init()
+
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=worker, args=(chain_path, n + 1, items, batch, results))
+                 for n in range(workers)]
+    began = time.perf_counter()
+    for process in processes:
+        process.start()
+    reports = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - began
+
+    blockchain = Blockchain()
+    report = blockchain.verify()
+    expected = 1 + sum(r["blocks"] for r in reports)
+
+    # The incrementally maintained indexes must agree with one rebuilt from the chain. Workers look items up in
+    # the history index and leave the item index to catch up from the chain when it is next loaded.
+    maintained = blockchain._get_item_index()
+    history = blockchain._get_history_index()
+    rebuilt = ItemIndex(os.path.join(directory, "rebuilt"))
+    rebuilt.rebuild(blockchain._scan_records())
+
+    return {
+        "workers": workers,
+        "elapsed_s": round(elapsed, 3),
+        "blocks": report.num_blocks,
+        "expected_blocks": expected,
+        "state": report.error,
+        "violations": len(report.violations),
+        "index_consistent": maintained.items == rebuilt.items,
+        "history_consistent": all(history.get(item_id) == rebuilt.get(item_id) for item_id in rebuilt.items),
+        "failures": sum(r["failures"] for r in reports),
+        "lock_contended": sum(r["lock"]["contended"] for r in reports),
+        "lock_timeouts": sum(r["lock"]["timeouts"] for r in reports),
+        "lock_wait_max_s": round(max(r["lock"]["wait_max"] for r in reports), 4),
+        "workers_detail": sorted(reports, key=lambda r: r["worker"]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent append stress test')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--items', type=int, default=100, help='Items added by each worker')
+    parser.add_argument('--batch', type=int, default=5, help='Items per batch')
+    parser.add_argument('--keep', help='Directory to keep the chain in, instead of a temporary one')
+    args = parser.parse_args()
+
+    directory = args.keep or tempfile.mkdtemp(prefix="bchoc-stress-")
+    os.makedirs(directory, exist_ok=True)
+    try:
+        result = run(args.workers, args.items, args.batch, directory)
+    finally:
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+    print(json.dumps(result, indent=2))
+    ok = (result["state"] == "CLEAN" and result["blocks"] == result["expected_blocks"]
+          and result["index_consistent"] and result["history_consistent"] and result["failures"] == 0)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
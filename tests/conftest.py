@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chaingen
+
+CASE = "11111111-1111-4111-8111-111111111111"
+
+
+@pytest.fixture
+def chain_path(tmp_path, monkeypatch):
+    """
+    Path of a chain in a temporary directory, also set as BCHOC_FILE_PATH.
+    """
+    path = str(tmp_path / "chain.dat")
+    monkeypatch.setenv("BCHOC_FILE_PATH", path)
+    monkeypatch.delenv("BCHOC_DURABILITY", raising=False)
+    monkeypatch.delenv("BCHOC_SEGMENT_SIZE", raising=False)
+    return path
+
+
+@pytest.fixture
+def generated(chain_path):
+    """
+    A clean synthetic chain of 2000 blocks at chain_path.
+    """
+    chaingen.generate(chain_path, 2000, seed=1)
+    return chain_path
+
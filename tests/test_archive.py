@@ -0,0 +1,66 @@
+import os
+
+import pytest
+
+import chain_archive
+from blockchain import Blockchain
+
+
+@pytest.fixture
+def archive(generated, tmp_path):
+    path = str(tmp_path / "chain.bca")
+    chain_archive.export_chain(Blockchain(generated), path, chunk_blocks=500)
+    return path
+
+
+def chain_files(path):
+    directory, name = os.path.split(path)
+    return sorted(entry for entry in os.listdir(directory) if entry.startswith(name) and not entry.endswith(".lock"))
+
+
+def test_round_trip_gives_back_the_same_chain(generated, archive, tmp_path):
+    copy = str(tmp_path / "copy.dat")
+    assert chain_archive.import_archive(archive, copy) == 2000
+    with open(generated, 'rb') as original, open(copy, 'rb') as imported:
+        assert original.read() == imported.read()
+    assert Blockchain(copy).verify(full=True).error == "CLEAN"
+
+
+def test_damaged_chunk_leaves_no_chain(archive, tmp_path, monkeypatch):
+    monkeypatch.setenv("BCHOC_SEGMENT_SIZE", "65536") #the chunks before the damaged one are written and sealed
+    chunks = chain_archive.ChainArchive(archive).index['chunks']
+    with open(archive, 'r+b') as f:
+        f.seek(chunks[2][0] + 200)
+        byte = f.read(1)
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte[0] ^ 0xFF]))
+    copy = str(tmp_path / "copy.dat")
+    with pytest.raises(ValueError):
+        chain_archive.import_archive(archive, copy)
+    assert chain_files(copy) == []
+    assert chain_archive.ChainArchive(archive).verify().violations
+
+
+def test_chunk_not_matching_the_index_is_rejected(archive, tmp_path):
+    archived = chain_archive.ChainArchive(archive)
+    last_hash = archived.index['chunks'][1][3]
+    with open(archive, 'rb') as f:
+        data = f.read()
+    with open(archive, 'wb') as f:
+        f.write(data.replace(last_hash.encode(), ('0' * 64).encode()))
+    copy = str(tmp_path / "copy.dat")
+    with pytest.raises(ValueError, match="doesn't match the archive index"):
+        chain_archive.import_archive(archive, copy)
+    assert chain_files(copy) == []
+
+
+def test_stale_index_files_are_replaced(archive, tmp_path):
+    copy = str(tmp_path / "copy.dat")
+    stale = (".digests", ".mmr", ".idx", ".db-wal", ".db-shm", ".torn-1234")
+    for suffix in stale:
+        with open(copy + suffix, 'wb') as f:
+            f.write(b'stale data from another chain\n')
+    chain_archive.import_archive(archive, copy)
+    assert os.path.getsize(copy + ".digests") == 2000 * 40
+    assert not any(os.path.exists(copy + suffix) for suffix in stale[1:])
+    assert Blockchain(copy).verify(full=True).error == "CLEAN"
@@ -0,0 +1,108 @@
+import io
+from uuid import UUID
+
+import pytest
+
+import bchoc
+from blockchain import Blockchain
+from chain_lock import ChainLock
+from chain_segments import SegmentedChain
+from conftest import CASE
+
+
+def run(chain_path, command, capsys):
+    bchoc.run(Blockchain(chain_path), bchoc.parse(['bchoc'] + command.split()))
+    return capsys.readouterr().out
+
+
+def test_report(generated, capsys):
+    pytest.importorskip('numpy')
+    latest, checkouts, intervals, previous = {}, {}, {}, {}
+    for block in Blockchain(generated).iter_blocks():
+        if block.item_id in previous:
+            state = previous[block.item_id].state
+            intervals[state] = intervals.get(state, 0) + 1
+        previous[block.item_id] = block
+        if block.state == "INITIAL":
+            continue
+        latest[block.item_id] = block
+        if block.state == "CHECKEDOUT":
+            checkouts[block.item_id] = checkouts.get(block.item_id, 0) + 1
+
+    cases = {}
+    for block in latest.values():
+        states = cases.setdefault(str(UUID(block.case_id)), {})
+        states[block.state] = states.get(block.state, 0) + 1
+    expected = []
+    for case_id in sorted(cases):
+        expected.append(f"Case: {case_id}")
+        expected += [f"  {state}: {count}" for state, count in sorted(cases[case_id].items())]
+    assert run(generated, "report states", capsys).splitlines() == expected
+
+    reported = {}
+    for line in run(generated, f"report checkouts --top {len(checkouts)}", capsys).splitlines():
+        item, count = line[len("Item "):-len(" checkouts")].split(": ")
+        reported[int(item)] = int(count)
+    assert reported == checkouts
+    top = run(generated, "report checkouts --top 3", capsys).splitlines()
+    assert [int(line.split(": ")[1].split()[0]) for line in top] == sorted(checkouts.values(), reverse=True)[:3]
+
+    dwell = run(generated, "report dwell", capsys).splitlines()
+    assert {line.split(":")[0]: int(line.split(": ")[1].split()[0]) for line in dwell} == intervals
+
+
+def test_invalid_ids_are_reported(generated, capsys):
+    assert run(generated, "show items -c xyz", capsys) == "Invalid case ID: xyz\n"
+    assert run(generated, "show history -i abc", capsys) == "Invalid item ID: abc\n"
+    assert "Block checkout failed" in run(generated, "checkout -i abc", capsys)
+    assert "Block remove failed" in run(generated, "remove -i abc", capsys)
+
+
+def test_locked_chain_is_reported_as_busy(generated, capsys, monkeypatch):
+    monkeypatch.setenv("BCHOC_LOCK_TIMEOUT", "0.05")
+    Blockchain(generated).get_item_history(1) #indexes are built before the lock is taken away
+    capsys.readouterr()
+    with ChainLock(generated):
+        for command in (f"add -c {CASE} -i 999999", "checkout -i 1", "verify"):
+            assert bchoc.execute(Blockchain(generated), bchoc.parse(['bchoc'] + command.split())) == 1
+            assert capsys.readouterr().out.startswith("The chain is busy")
+def test_remove_appends_one_block(chain_path, capsys):
+    Blockchain(chain_path).init()
+    run(chain_path, f"add -c {CASE} -i 1", capsys)
+    assert run(chain_path, "remove -i 1", capsys) == "Removed item 1 from the blockchain.\n"
+    assert [block.state for block in Blockchain(chain_path).get_item_history(1)] == ["CHECKEDIN", "DISPOSED"]
+
+
+def test_batch(chain_path, capsys, monkeypatch):
+    Blockchain(chain_path).init()
+    capsys.readouterr()
+    script = "\n".join([
+        f"add -c {CASE} -i 1 -i 2",
+        "checkout -i 1",
+        "checkout -i 1",
+        '{"action": "remove", "item_id": 2}',
+        "frobnicate",
+    ]) + "\n"
+    monkeypatch.setattr('sys.stdin', io.StringIO(script))
+    lines = run(chain_path, "batch --group 2", capsys).splitlines()
+    assert lines[:5] == ["1 add 1 OK", "1 add 2 OK", "2 checkout 1 OK",
+                         "3 checkout 1 REFUSED Item 1 is CHECKEDOUT, it can't be checked out.", "4 remove 2 OK"]
+    assert lines[5].startswith("5 - - INVALID")
+    assert lines[6].startswith("Batch: 5 operations")
+    assert Blockchain(chain_path).verify(full=True).error == "CLEAN"
+
+
+def test_failed_batch_returns_a_result_for_every_action(chain_path, monkeypatch):
+    blockchain = Blockchain(chain_path)
+    blockchain.init()
+    actions = [{"action": "add", "case_id": CASE, "item_id": item_id} for item_id in (1, 1, 2)]
+
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(SegmentedChain, 'append', fail)
+    assert blockchain.apply_actions(actions) == [(False, "Failed to write blocks: disk full"),
+                                                 (False, "Item 1 already exists in the blockchain."),
+                                                 (False, "Failed to write blocks: disk full")]
+    monkeypatch.setattr(Blockchain, '_get_item_index', fail)
+    assert blockchain.apply_actions(actions) == [(False, "Failed to write blocks: disk full")] * 3
@@ -0,0 +1,75 @@
+import os
+
+import pytest
+
+import bchoc
+import chain_merkle
+import chaingen
+from blockchain import Blockchain
+
+
+def test_proofs_verify_for_every_block(generated):
+    blockchain = Blockchain(generated)
+    for index in list(range(20)) + [1023, 1024, 1999]:
+        assert chain_merkle.verify_proof(blockchain.merkle_proof(index))
+
+
+def test_proof_with_wrong_index_is_rejected(generated):
+    proof = Blockchain(generated).merkle_proof(4)
+    for index in (0, 5, 6, 1999):
+        assert not chain_merkle.verify_proof(dict(proof, index=index))
+
+
+def test_proof_of_modified_record_is_rejected(generated):
+    proof = Blockchain(generated).merkle_proof(7)
+    record = bytearray.fromhex(proof['record'])
+    record[40] ^= 1
+    assert not chain_merkle.verify_proof(dict(proof, record=record.hex()))
+
+
+def test_tree_extended_on_append_matches_a_rebuild(generated):
+    blockchain = Blockchain(generated)
+    blockchain._get_merkle()
+    blockchain.add_blocks([{"action": "add", "case_id": "11111111-1111-4111-8111-111111111111", "item_id": n}
+                           for n in range(900000, 900010)])
+    root = blockchain._get_merkle().root()
+    os.remove(generated + ".mmr")
+    assert Blockchain(generated)._get_merkle().root() == root
+
+
+def test_compare_finds_divergence_without_writing_the_other_copy(generated, tmp_path):
+    other = str(tmp_path / "other.dat")
+    with open(generated, 'rb') as f:
+        data = bytearray(f.read())
+    position = Blockchain(generated)._get_digest_cache().entries(1234, 1235)[0][0]
+    data[position + 40] ^= 1
+    with open(other, 'wb') as f:
+        f.write(data)
+
+    divergence, mine, theirs = Blockchain(generated).first_divergence(Blockchain(other))
+    assert (divergence, mine, theirs) == (1234, 2000, 2000)
+    assert [name for name in os.listdir(tmp_path) if name.startswith("other.dat")] == ["other.dat"]
+
+
+def test_compare_finds_a_modified_record_in_the_local_copy(chain_path, tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv("BCHOC_SEGMENT_SIZE", "65536")
+    other = str(tmp_path / "other.dat")
+    chaingen.generate(chain_path, 2000, seed=1)
+    chaingen.generate(other, 2000, seed=1)
+    blockchain = Blockchain(chain_path)
+    root = blockchain.merkle_tree().root()
+    segment = blockchain._storage().segments()[0]
+    assert segment.sealed
+    position = blockchain._get_digest_cache().entries(123, 124)[0][0]
+    with open(segment.path, 'r+b') as f:
+        f.seek(position + 40)
+        byte = f.read(1)[0]
+        f.seek(position + 40)
+        f.write(bytes([byte ^ 1]))
+
+    blockchain = Blockchain(chain_path)
+    assert blockchain.first_divergence(Blockchain(other)) == (123, 2000, 2000)
+    with pytest.raises(ValueError, match="block 123"):
+        blockchain.merkle_tree()
+    bchoc.run(blockchain, bchoc.parse(['bchoc', 'merkle', 'compare', '--root', root.hex(), '--leaves', '2000']))
+    assert "block 123 no longer matches" in capsys.readouterr().out
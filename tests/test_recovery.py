@@ -0,0 +1,90 @@
+import hashlib
+import os
+import struct
+
+import chaingen
+from blockchain import Blockchain
+from conftest import CASE
+
+
+def pack(previous_hash, item_id, state="CHECKEDIN", data="Item"):
+    data = data.encode()
+    return struct.pack(f'32s d 32s 32s 12s 12s 12s I {len(data)}s', previous_hash, 1.7e9, bytes(32),
+                       item_id.to_bytes(4, 'little').ljust(32, b'\x00'), state.encode().ljust(12, b'\x00'),
+                       bytes(12), bytes(12), len(data), data)
+
+
+def add(blockchain, item_id):
+    return blockchain.add_blocks([{"action": "add", "case_id": CASE, "item_id": item_id}])
+
+
+def test_torn_record_is_cut_before_the_next_append(generated):
+    blockchain = Blockchain(generated)
+    intact = os.path.getsize(generated)
+    with open(generated, 'ab') as f:
+        f.write(pack(bytes(32), 999999)[:100]) #header cut short by a crash
+    assert add(blockchain, 999999)
+    assert os.path.exists(f"{generated}.torn-{intact}")
+    report = Blockchain(generated).verify(full=True)
+    assert report.error == "CLEAN"
+    assert report.num_blocks == 2001
+
+
+def test_reads_never_cut_a_torn_record(generated):
+    with open(generated, 'ab') as f:
+        f.write(b'\x00' * 50)
+    before = os.path.getsize(generated)
+    Blockchain(generated).verify(full=True)
+    Blockchain(generated).get_item_history(1)
+    assert os.path.getsize(generated) == before
+
+
+def test_zero_filled_tail_is_cut(generated):
+    intact = os.path.getsize(generated)
+    with open(generated, 'ab') as f:
+        f.write(bytes(4096)) #the file grew but the data never reached the disk
+    assert add(Blockchain(generated), 999999)
+    assert os.path.getsize(f"{generated}.torn-{intact}") == 4096
+    report = Blockchain(generated).verify(full=True)
+    assert (report.error, report.num_blocks) == ("CLEAN", 2001)
+
+
+def test_record_past_the_digest_cache_that_does_not_link_is_cut(generated):
+    #A well-formed block linking to the INITIAL block, appended by a writer that doesn't take the lock
+    with open(generated, 'rb') as f:
+        header = f.read(144)
+        first = header + f.read(struct.unpack_from('I', header, 140)[0])
+    intact = os.path.getsize(generated)
+    with open(generated, 'ab') as f:
+        f.write(pack(hashlib.sha256(first).digest(), 888888))
+
+    assert add(Blockchain(generated), 999999)
+    assert os.path.exists(f"{generated}.torn-{intact}")
+    assert Blockchain(generated).verify(full=True).error == "CLEAN"
+
+
+def test_modified_record_the_digest_cache_covers_is_kept_and_reported(generated):
+    offset = Blockchain(generated)._get_digest_cache().entries(1999, 2000)[0][0]
+    with open(generated, 'r+b') as f:
+        f.seek(offset)
+        f.write(bytes(32))
+    before = os.path.getsize(generated)
+
+    assert add(Blockchain(generated), 999999)
+    assert os.path.getsize(generated) > before
+    report = Blockchain(generated).verify(full=True)
+    assert report.num_blocks == 2001
+    assert report.violations and report.violations[0].index == 1999
+
+
+def test_no_parent_without_digest_cache_is_reported_not_cut(chain_path):
+    manifest = chaingen.generate(chain_path, 1000, corruptions=[('no-parent', 1)], seed=2)
+    os.remove(chain_path + ".digests")
+    before = os.path.getsize(chain_path)
+
+    report = Blockchain(chain_path).verify(full=True)
+    assert report.num_blocks == 1000
+    assert {(v.index, v.error) for v in report.violations} == \
+        {(v["index"], v["error"]) for v in manifest["violations"]}
+    assert add(Blockchain(chain_path), 999999)
+    assert os.path.getsize(chain_path) > before
@@ -0,0 +1,29 @@
+import chaingen
+from blockchain import Blockchain
+from conftest import CASE
+
+
+def test_parallel_verify_matches_serial(chain_path, monkeypatch):
+    monkeypatch.setenv("BCHOC_SEGMENT_SIZE", "65536")
+    chaingen.generate(chain_path, 2000, seed=3, corruptions=[(kind, 2) for kind in chaingen.CORRUPTIONS])
+    serial = Blockchain(chain_path).verify(full=True)
+    parallel = Blockchain(chain_path).verify(full=True, jobs=3)
+    assert serial.violations
+    assert (parallel.num_blocks, parallel.violations) == (serial.num_blocks, serial.violations)
+
+
+def test_blocks_appended_during_a_parallel_verify_are_left_out(generated, monkeypatch):
+    blockchain = Blockchain(generated)
+    hashes = Blockchain._parallel_hashes
+
+    def append_after_hashing(self, start, jobs):
+        result = hashes(self, start, jobs)
+        Blockchain(generated).add_blocks([{"action": "add", "case_id": CASE, "item_id": 900000}])
+        return result
+
+    monkeypatch.setattr(Blockchain, '_parallel_hashes', append_after_hashing)
+    report = blockchain.verify(full=True, jobs=2)
+    assert (report.error, report.num_blocks) == ("CLEAN", 2000)
+    monkeypatch.undo()
+    report = Blockchain(generated).verify()
+    assert (report.error, report.num_blocks, report.resumed_from) == ("CLEAN", 2001, 2000)
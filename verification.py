@@ -0,0 +1,349 @@
+import json
+import os
+import threading
+from collections import namedtuple
+
+# One integrity problem found in the chain.
+#   - index: position of the offending block in the chain (0 is the INITIAL block)
+#   - hash: hex SHA-256 of the offending block's raw bytes
+#   - error: short error type, e.g. "NO PARENT" or "DUPLICATE PARENT"
+#   - related: hashes of other blocks involved in the error (e.g. the other child of a duplicated parent)
+Violation = namedtuple('Violation', ['index', 'hash', 'error', 'related'])
+
+REMOVED_STATES = ("DISPOSED", "DESTROYED", "RELEASED")
+HEADER_SIZE = 144
+
+
+class VerificationReport:
+    """
+    Result of a verification run: how many blocks the chain has and every violation found, in chain order.
+    """
+
+    def __init__(self):
+        self.num_blocks = 0
+        self.violations = []
+        self.resumed_from = 0  # blocks covered by the checkpoint this run started from, 0 for a full run
+
+    def add(self, index, block_hash, error, related=()):
+        self.violations.append(Violation(index, block_hash, error, list(related)))
+
+    @property
+    def error(self):
+        """
+        The error type of the first violation, or "CLEAN" if the chain passed every rule.
+        """
+        return self.violations[0].error if self.violations else "CLEAN"
+
+
+class Rule:
+    """
+    Base class of the pluggable integrity rules. The engine feeds every block to check() in chain order,
+    then calls finish() once the end of the chain is reached. Rules record problems on the report.
+    fields lists the block fields the rule reads, so the engine only decodes what is needed.
+    resume() restores the rule's state from a checkpoint (see CheckpointRule) so an incremental
+    verify can continue where the last successful one stopped.
+    """
+
+    fields = ()
+
+    def check(self, index, block, report):
+        raise NotImplementedError
+
+    def finish(self, report):
+        pass
+
+    def resume(self, checkpoint):
+        pass
+
+
+class DigestRule(Rule):
+    """
+    Every block must still hash to the digest recorded in the digest cache when it was appended
+    ("HASH MISMATCH" otherwise), which catches blocks rewritten in place after the fact.
+    Blocks the cache doesn't cover are skipped.
+    """
+
+    fields = ('offset',)
+
+    def __init__(self, digests):
+        """
+        :param digests: iterable of (offset, raw digest) pairs in chain order, see DigestCache.iter_from.
+        """
+        self.digests = iter(digests)
+        self.current = next(self.digests, None)
+
+    def check(self, index, block, report):
+        offset = block['offset']
+        while self.current is not None and self.current[0] < offset:
+            self.current = next(self.digests, None)
+        if self.current is not None and self.current[0] == offset and self.current[1].hex() != block['hash']:
+            report.add(index, block['hash'], "HASH MISMATCH", [self.current[1].hex()])
+
+
+class ArchiveRule(Rule):
+    """
+    The last block of every chunk of an archive must hash to the hash recorded for it when the archive was written
+    ("HASH MISMATCH" otherwise). Archived blocks link to the recomputed hash of the block before, so this is what
+    catches a change anywhere in the chunk. See chain_archive.
+    """
+
+    fields = ('hash',)
+
+    def __init__(self, expected):
+        """
+        :param expected: dictionary of block index -> hex hash recorded for it.
+        """
+        self.expected = expected
+
+    def check(self, index, block, report):
+        expected = self.expected.get(index)
+        if expected is not None and expected != block['hash']:
+            report.add(index, block['hash'], "HASH MISMATCH", [expected])
+
+
+class ParentRule(Rule):
+    """
+    Every block after the INITIAL one must point at an earlier block ("NO PARENT" otherwise),
+    and no two blocks may share the same parent ("DUPLICATE PARENT").
+    """
+
+    fields = ('previous_hash',)
+
+    def __init__(self):
+        self.seen = set()  # hashes of all blocks so far
+        self.children = {}  # parent hash -> hash of the block that points at it
+
+    def resume(self, checkpoint):
+        # Only the tail is kept in a checkpoint: a new block pointing at an older block is reported as "NO PARENT"
+        self.seen = {checkpoint['tail_hash']}
+
+    def check(self, index, block, report):
+        block_hash = block['hash']
+        if index > 0:
+            parent = block['previous_hash']
+            if parent in self.children:
+                report.add(index, block_hash, "DUPLICATE PARENT", [self.children[parent]])
+            elif parent not in self.seen:
+                report.add(index, block_hash, "NO PARENT")
+            else:
+                self.children[parent] = block_hash
+        self.seen.add(block_hash)
+
+
+class AddIsFirstRule(Rule):
+    """
+    The first block of every item must check it in.
+    """
+
+    fields = ('item_id', 'state')
+
+    def __init__(self):
+        self.items = set()
+
+    def resume(self, checkpoint):
+        self.items = set(checkpoint['items'])
+
+    def check(self, index, block, report):
+        item_id = block['item_id']
+        if item_id in self.items:
+            return
+        self.items.add(item_id)
+        if index == 0 and block['state'] == "INITIAL":
+            return
+        if block['state'] != "CHECKEDIN":
+            report.add(index, block['hash'], "ADD NOT FIRST")
+
+
+class RemoveIsFinalRule(Rule):
+    """
+    Once an item has been disposed of, destroyed or released, no further block may mention it.
+    """
+
+    fields = ('item_id', 'state')
+
+    def __init__(self):
+        self.removed = set()
+
+    def resume(self, checkpoint):
+        self.removed = {item_id for item_id, state in checkpoint['items'].items() if state in REMOVED_STATES}
+
+    def check(self, index, block, report):
+        item_id = block['item_id']
+        if item_id in self.removed:
+            report.add(index, block['hash'], "IMPROPER REMOVAL")
+        elif block['state'] in REMOVED_STATES:
+            self.removed.add(item_id)
+
+
+class ReleaseHasDataRule(Rule):
+    """
+    A RELEASED block must carry data describing who the item was released to.
+    """
+
+    fields = ('state', 'data_length')
+
+    def check(self, index, block, report):
+        if block['state'] == "RELEASED" and block['data_length'] <= 0:
+            report.add(index, block['hash'], "RELEASE WITHOUT DATA")
+
+
+class DoubleCheckRule(Rule):
+    """
+    An item can't be checked out twice without a checkin in between, or checked in twice without a checkout.
+    """
+
+    fields = ('item_id', 'state')
+
+    def __init__(self):
+        self.last_state = {}
+
+    def resume(self, checkpoint):
+        self.last_state = dict(checkpoint['items'])
+
+    def check(self, index, block, report):
+        item_id = block['item_id']
+        state = block['state']
+        last = self.last_state.get(item_id)
+        if state == "CHECKEDOUT" and last == "CHECKEDOUT":
+            report.add(index, block['hash'], "DOUBLE CHECKOUT")
+        elif state == "CHECKEDIN" and last == "CHECKEDIN":
+            report.add(index, block['hash'], "DOUBLE CHECKIN")
+        self.last_state[item_id] = state
+
+
+class SegmentRule(Rule):
+    """
+    The footer of every sealed segment must describe the blocks in it: the block count, the hash the first block
+    links to, the first and last hash, and the latest state of every item ("BAD SEGMENT FOOTER" otherwise,
+    reported at the last block of the segment). Segments that ended before the block verification resumed from
+    were checked by an earlier run and are skipped; for one it resumed inside of, only the end is compared.
+    """
+
+    fields = ('offset', 'item_id', 'state', 'case_id', 'previous_hash', 'data_length')
+
+    def __init__(self, segments, footer, start=0):
+        """
+        :param segments: the chain's segments, see SegmentedChain.segments.
+        :param footer: function returning the decoded footer of a segment, see SegmentedChain.footer.
+        :param start: byte offset verification starts at.
+        """
+        self.footer = footer
+        self.pending = [segment for segment in segments if segment.sealed and segment.base + segment.length > start]
+        self.start = start
+        self.seen = None  # what was read of the first pending segment so far
+
+    def check(self, index, block, report):
+        offset = block['offset']
+        while self.pending and offset >= self.pending[0].base + self.pending[0].length:
+            self._finish_segment(report)
+        if not self.pending or offset < self.pending[0].base:
+            return
+        if self.seen is None:
+            self.seen = {'blocks': 0, 'items': {}, 'previous_hash': block['previous_hash'], 'first_hash': block['hash']}
+        seen = self.seen
+        seen['blocks'] += 1
+        seen['last_hash'] = block['hash']
+        seen['last_index'] = index
+        seen['items'][str(block['item_id'])] = [block['state'], offset, offset + HEADER_SIZE + block['data_length'], block['case_id']]
+
+    def finish(self, report):
+        while self.pending:
+            self._finish_segment(report)
+
+    def _finish_segment(self, report):
+        segment = self.pending.pop(0)
+        seen, self.seen = self.seen, None
+        if seen is None:
+            return #no block of it was read
+        footer = self.footer(segment)
+        if footer is None:
+            ok = False
+        elif segment.base < self.start:
+            ok = footer['last_hash'] == seen['last_hash']
+        else:
+            ok = all(footer[key] == seen[key] for key in ('blocks', 'previous_hash', 'first_hash', 'last_hash', 'items'))
+        if not ok:
+            report.add(seen['last_index'], seen['last_hash'], "BAD SEGMENT FOOTER")
+
+
+class CheckpointRule(Rule):
+    """
+    Never reports anything; it records what a checkpoint needs: the number of blocks, the byte offset where
+    verification stopped, the offset and hash of the last block, and the latest state of every item.
+    """
+
+    fields = ('item_id', 'state', 'offset', 'data_length')
+
+    def __init__(self):
+        self.checkpoint = {'blocks': 0, 'offset': 0, 'tail_offset': None, 'tail_hash': None, 'items': {}}
+
+    def check(self, index, block, report):
+        checkpoint = self.checkpoint
+        checkpoint['items'][block['item_id']] = block['state']
+        checkpoint['tail_offset'] = block['offset']
+        checkpoint['tail_hash'] = block['hash']
+        checkpoint['offset'] = block['offset'] + HEADER_SIZE + block['data_length']
+
+    def finish(self, report):
+        self.checkpoint['blocks'] = report.num_blocks
+
+    def resume(self, checkpoint):
+        self.checkpoint = dict(checkpoint, items=dict(checkpoint['items']))
+
+
+def load_checkpoint(path):
+    """
+    Reads a checkpoint file written by save_checkpoint. Returns None if it is missing or unreadable.
+    """
+    try:
+        with open(path, 'r') as f:
+            checkpoint = json.load(f)
+        checkpoint['items'] = {int(item_id): state for item_id, state in checkpoint['items'].items()}
+        return checkpoint
+    except (FileNotFoundError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_checkpoint(path, checkpoint):
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp" #concurrent verifies must not share a temp file
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def default_rules():
+    """
+    Returns a fresh instance of every built-in rule.
+    """
+    return [ParentRule(), AddIsFirstRule(), RemoveIsFinalRule(), ReleaseHasDataRule(), DoubleCheckRule()]
+
+
+def required_fields(rules):
+    """
+    Returns the block fields needed to run the given rules. The raw hash is always included so
+    violations can be reported with it.
+    """
+    fields = {'hash'}
+    for rule in rules:
+        fields.update(rule.fields)
+    return tuple(fields)
+
+
+def run_rules(blocks, rules, report=None):
+    """
+    Feeds every block to every rule in a single pass.
+    :param blocks: iterable of block dictionaries in chain order, with at least required_fields(rules) decoded.
+    :param rules: list of Rule instances.
+    :return: the VerificationReport.
+    """
+    if report is None:
+        report = VerificationReport()
+    index = report.num_blocks
+    for block in blocks:
+        for rule in rules:
+            rule.check(index, block, report)
+        index += 1
+    report.num_blocks = index
+    for rule in rules:
+        rule.finish(report)
+    return report